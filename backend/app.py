@@ -1,17 +1,46 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, Response, stream_with_context
+from werkzeug.utils import secure_filename
 from flask_cors import CORS
 import os
 from services.user_service import UserService
+from database.answer_store import answer_store
+from database.db_handler import profile_cache, stats_cache
+from database.submission_store import naive_utc, submission_store
+from database.state_store import state_store
 from services.scoring_service import ScoringService
-from services.problem_service import ProblemService
-import uuid
-from werkzeug.utils import secure_filename
-from datetime import datetime
+from services.problem_service import (ProblemService, DuplicateProblemError, HIDDEN_FIELDS, LIST_FIELDS,
+                                      parse_projection, project, projection_cache)
+from services.topic_service import topic_index
+from services.dedupe_service import problem_dedupe, DUPLICATE_THRESHOLD
+from services.similarity_service import IndexNotReady, similar_problems
+from services.suggest_service import problem_suggester
+from services.query_service import query_engine
+from services.study_plan_service import study_planner
+from services.activity_service import activity_tracker
+from services.timeseries_service import timeseries
+from services.sketch_service import stat_sketches
+from services.partition_service import partition_service
+from services.replication_service import replication_primary, replica
+from services.contest_service import contest_service
+from services.event_service import broadcaster, problem_channel, user_channel
+from services.review_service import review_store, format_review
+from services.media_service import media_store, UploadError, ALLOWED_EXTENSIONS
+from services.thumbnail_service import thumbnailer
+from services.file_server import serve_file
+from logger import get_logger, request_id_var
+from datetime import datetime, timedelta
+import hmac
 import json
+import time
+import uuid
+from config import ADMIN_TOKEN, ADMIN_TOKEN_HEADER, CLUSTER_SECRET, CLUSTER_SECRET_HEADER, DATA_DIR, INTERNAL_PATHS
+
+logger = get_logger('app')
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": ["http://localhost:5173", "http://localhost:5174"]}})
+CORS(app, resources={r"/*": {"origins": ["http://localhost:5173", "http://localhost:5174"]}},
+     expose_headers=["X-Total-Count", "X-Next-Cursor", "X-Request-ID", "X-Replication-Token", "X-Replication-Lag"])
 
 # Get current directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -23,22 +52,26 @@ scoring_service = ScoringService()
 
 # Configure upload folder
 UPLOAD_FOLDER = os.path.join(current_dir, 'uploads')
-ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov', 'webm'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Set to the internal nginx location that maps to UPLOAD_FOLDER to let nginx send upload bodies
+app.config['UPLOADS_X_ACCEL_PREFIX'] = os.environ.get('UPLOADS_X_ACCEL_PREFIX')
+
+# Longest solve time a submission may report; anything longer is a client bug
+MAX_TIME_TAKEN_SECONDS = 24 * 60 * 60
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # File paths
-PROBLEMS_FILE = os.path.join(current_dir, 'data', 'problems.json')
-USERS_FILE = os.path.join(current_dir, 'data', 'users.json')
-USER_ANSWERS_FILE = os.path.join(current_dir, 'data', 'user_answers.json')
-REVIEWS_FILE = os.path.join(current_dir, 'data', 'reviews.json')
-SUBMISSIONS_FILE = os.path.join(current_dir, 'data', 'submissions.json')
+PROBLEMS_FILE = os.path.join(DATA_DIR, 'problems.json')
+USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+USER_ANSWERS_FILE = os.path.join(DATA_DIR, 'user_answers.json')
+REVIEWS_FILE = os.path.join(DATA_DIR, 'reviews.json')
+SUBMISSIONS_FILE = os.path.join(DATA_DIR, 'submissions.json')
 
 # Make sure data directory exists
-os.makedirs(os.path.join(current_dir, 'data'), exist_ok=True)
+os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(os.path.join(current_dir, 'uploads'), exist_ok=True)
 
 # Create empty JSON files if they don't exist
@@ -47,25 +80,174 @@ for file_path in [PROBLEMS_FILE, USERS_FILE, USER_ANSWERS_FILE, REVIEWS_FILE, SU
         with open(file_path, 'w') as f:
             json.dump([], f)
 
+# Build in-memory indexes from the data files before any new submissions land
+state_store.load()
+topic_index.load()
+study_planner.load()
+submission_store.load()
+activity_tracker.load()
+timeseries.load()
+stat_sketches.load()
+problem_dedupe.load()
+similar_problems.load()
+problem_suggester.load()
+
+# Either follow a primary's mutation log or ship our own to replicas
+if replica is not None:
+    replica.start()
+else:
+    replication_primary.start()
+
+# Request correlation: every log record written while handling a request carries its id
+@app.before_request
+def start_request_log():
+    request.environ['request_started'] = time.perf_counter()
+    request.environ['request_id_token'] = request_id_var.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex)
+
+@app.before_request
+def guard_internal_routes():
+    """Partition handoff and replication read and replace whole users, answers included; nodes only."""
+    if not request.path.startswith(INTERNAL_PATHS):
+        return None
+    if not CLUSTER_SECRET:
+        return jsonify({'error': 'Node-to-node routes are disabled until CLUSTER_SECRET is set'}), 403
+    if not hmac.compare_digest(request.headers.get(CLUSTER_SECRET_HEADER, ''), CLUSTER_SECRET):
+        return jsonify({'error': 'Forbidden'}), 403
+    return None
+
+@app.before_request
+def guard_replica():
+    """Replicas are read-only and do not ship a log of their own."""
+    if replica is None:
+        return None
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return jsonify({'error': 'This node is a read-only replica', 'primary': replica.primary}), 405
+    if request.path in ('/api/replication/snapshot', '/api/replication/stream'):
+        return jsonify({'error': 'This node is a replica', 'primary': replica.primary}), 409
+    return None
+
+@app.before_request
+def wait_for_replication_token():
+    if replica is None:
+        return None
+    token = request.headers.get('X-Min-Replication-Token') or request.args.get('min_token')
+    if not token:
+        return None
+    try:
+        caught_up = replica.wait_for(token)
+    except ValueError:
+        return jsonify({'error': 'Invalid replication token'}), 400
+    if not caught_up:
+        return jsonify({'error': 'Replica has not caught up with this token yet', **replica.status()}), 503
+    return None
+
+@app.after_request
+def finish_request_log(response):
+    response.headers['X-Request-ID'] = request_id_var.get()
+    if replica is not None:
+        response.headers['X-Replication-Lag'] = str(replica.lag_seconds())
+    logger.info('request', extra={
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'duration_ms': round((time.perf_counter() - request.environ['request_started']) * 1000, 2)
+    })
+    return response
+
+@app.teardown_request
+def clear_request_id(exc):
+    token = request.environ.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
+
 # Problem routes
 @app.route('/problems', methods=['GET'])
 def get_problems():
     try:
-        problems = problem_service.get_all_problems()
-        return jsonify(problems)
+        projection = parse_projection(request.args.get('fields'), request.args.get('exclude'), LIST_FIELDS)
+        return Response(problem_service.get_problems_json(projection), mimetype='application/json')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Error getting problems: {e}")
+        logger.exception("Error getting problems")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/problems/<int:problem_id>', methods=['GET'])
 def get_problem(problem_id):
     try:
+        projection = parse_projection(request.args.get('fields'), request.args.get('exclude'))
         problem = problem_service.get_problem_by_id(problem_id)
         if problem:
-            return jsonify(problem)
+            return jsonify(project(problem, projection))
         return jsonify({'error': 'Problem not found'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error getting problem")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/problems/<int:problem_id>/hints', methods=['GET'])
+def get_problem_hints(problem_id):
+    try:
+        hints = problem_service.get_problem_hints(problem_id)
+        if hints is None:
+            return jsonify({'error': 'Problem not found'}), 404
+        return jsonify({'problem_id': problem_id, 'hints': hints})
+    except Exception as e:
+        logger.exception("Error getting problem hints")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/problems/suggest', methods=['GET'])
+def suggest_problems():
+    try:
+        return jsonify(problem_suggester.suggest(request.args.get('prefix', ''), request.args.get('limit', 10, type=int)))
     except Exception as e:
-        print(f"Error getting problem: {e}")
+        logger.exception("Error suggesting problems")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/problems/<int:problem_id>/similar', methods=['GET'])
+def get_similar_problems(problem_id):
+    try:
+        similar = problem_service.get_similar_problems(problem_id, request.args.get('limit', 5, type=int))
+        if similar is None:
+            return jsonify({'error': 'Problem not found'}), 404
+        return jsonify(similar)
+    except IndexNotReady as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except Exception as e:
+        logger.exception("Error getting similar problems")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/problems/<int:problem_id>/solve_times', methods=['GET'])
+def get_problem_solve_times(problem_id):
+    """p50/p90/p99 solve times in seconds; with ?time_taken= also the percent of solves it beats.
+
+    ?digest=true adds the t-digest centroids, which the router merges across nodes.
+    """
+    try:
+        if not problem_service.get_problem_by_id(problem_id):
+            return jsonify({'error': 'Problem not found'}), 404
+        return jsonify(stat_sketches.problem_solve_times(problem_id, request.args.get('time_taken', type=float),
+                                                         request.args.get('digest', '').lower() == 'true'))
+    except Exception as e:
+        logger.exception("Error getting solve times")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/problems', methods=['POST'])
+def create_problem():
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No problem provided'}), 400
+        allow_duplicates = request.args.get('allow_duplicates', '').lower() == 'true'
+        problem = problem_service.create_problem(data, allow_duplicates)
+        return jsonify(project(problem, (None, HIDDEN_FIELDS))), 201
+    except DuplicateProblemError as e:
+        return jsonify({'error': str(e), 'duplicates': e.matches}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error creating problem")
         return jsonify({'error': str(e)}), 500
 
 # User routes
@@ -77,7 +259,7 @@ def get_user(user_id):
             return jsonify(user)
         return jsonify({'error': 'User not found'}), 404
     except Exception as e:
-        print(f"Error getting user: {e}")
+        logger.exception("Error getting user")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/users/<user_id>/stats', methods=['GET'])
@@ -88,7 +270,7 @@ def get_user_stats(user_id):
             return jsonify(stats)
         return jsonify({'error': 'User stats not found'}), 404
     except Exception as e:
-        print(f"Error getting user stats: {e}")
+        logger.exception("Error getting user stats")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/user_answer/<user_id>/<int:problem_id>', methods=['GET'])
@@ -104,7 +286,7 @@ def get_user_answer(user_id, problem_id):
             'timestamp': ''
         })
     except Exception as e:
-        print(f"Error getting user answer: {e}")
+        logger.exception("Error getting user answer")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/users/<user_id>/answers', methods=['GET'])
@@ -113,7 +295,7 @@ def get_user_answers(user_id):
         answers = user_service.get_user_answers(user_id)
         return jsonify(answers)
     except Exception as e:
-        print(f"Error getting user answers: {e}")
+        logger.exception("Error getting user answers")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/users/<user_id>/submit_answer/<int:problem_id>', methods=['POST'])
@@ -123,21 +305,16 @@ def submit_answer(user_id, problem_id):
         if not data or 'answer' not in data:
             return jsonify({'error': 'No answer provided'}), 400
 
-        # Load current user answers
-        user_answers = {}
-        if os.path.exists(USER_ANSWERS_FILE):
-            with open(USER_ANSWERS_FILE, 'r') as f:
-                user_answers = json.load(f)
-
-        # Initialize user's answers if not exists
-        if user_id not in user_answers:
-            user_answers[user_id] = {}
-
         # Get the problem
         problem = problem_service.get_problem_by_id(problem_id)
         if not problem:
             return jsonify({'error': 'Problem not found'}), 404
 
+        time_taken = data.get('time_taken')
+        if time_taken is not None and (isinstance(time_taken, bool) or not isinstance(time_taken, (int, float))
+                                       or not 0 <= time_taken <= MAX_TIME_TAKEN_SECONDS):  # also false for NaN
+            return jsonify({'error': f'time_taken must be between 0 and {MAX_TIME_TAKEN_SECONDS} seconds'}), 400
+
         # Check the answer
         is_correct = scoring_service.check_answer(data['answer'], problem.get('correct_answer', ''))
         
@@ -149,25 +326,41 @@ def submit_answer(user_id, problem_id):
             'is_correct': is_correct,
             'timestamp': datetime.now().isoformat()
         }
+        if time_taken is not None:
+            submission['time_taken'] = int(time_taken)
 
-        # Load and update submissions.json
-        submissions = []
-        if os.path.exists(SUBMISSIONS_FILE):
-            with open(SUBMISSIONS_FILE, 'r') as f:
-                submissions = json.load(f)
-        submissions.append(submission)
-        with open(SUBMISSIONS_FILE, 'w') as f:
-            json.dump(submissions, f, indent=2)
+        # Append to submissions.json and the columnar store
+        submission_store.write([submission])
 
-        # Update user_answers.json
-        user_answers[user_id][str(problem_id)] = {
+        # Update this user's answer shard
+        previous_answer = answer_store.replace_answer(user_id, problem_id, {
             'answer': data['answer'],
             'is_correct': is_correct,
             'timestamp': submission['timestamp']
-        }
-        
-        with open(USER_ANSWERS_FILE, 'w') as f:
-            json.dump(user_answers, f, indent=2)
+        })
+
+        topic_index.record_submission(user_id, problem_id, is_correct)
+        problem_suggester.record_attempt(problem_id)
+        study_planner.record_answer(user_id, problem_id, is_correct)
+        activity_tracker.record(user_id, submission['timestamp'], is_correct, submission.get('time_taken'))
+        timeseries.record(user_id, submission['timestamp'], is_correct)
+        # Ranked against earlier solves only, before this one is added
+        faster_than = (stat_sketches.faster_than(problem_id, submission['time_taken'])
+                       if is_correct and 'time_taken' in submission else None)
+        stat_sketches.record(user_id, problem_id, submission['timestamp'], data['answer'], is_correct,
+                             submission.get('time_taken'), previous_answer)
+
+        # Push the new submission and stat delta to live subscribers. Problem stats count each
+        # user's latest answer, so a resubmission replaces the previous answer instead of adding one
+        broadcaster.publish(problem_channel(problem_id), 'stats_delta', {
+            'problem_id': problem_id,
+            'total_attempts': 0 if previous_answer is not None else 1,
+            'correct_attempts': int(is_correct) - int(bool(previous_answer and previous_answer.get('is_correct'))),
+            'answer': data['answer'],
+            'previous_answer': previous_answer.get('answer') if previous_answer is not None else None
+        })
+        broadcaster.publish(problem_channel(problem_id), 'submission', submission)
+        broadcaster.publish(user_channel(user_id), 'submission', submission)
 
         # Update user stats
         user = user_service.get_user(user_id)
@@ -179,20 +372,24 @@ def submit_answer(user_id, problem_id):
                     'problems_solved': 0
                 }
             
-            user['stats']['total_submissions'] = len([s for s in submissions if s['user_id'] == user_id])
-            user['stats']['correct_submissions'] = len([s for s in submissions if s['user_id'] == user_id and s['is_correct']])
-            user['stats']['problems_solved'] = len(set(str(s['problem_id']) for s in submissions if s['user_id'] == user_id and s['is_correct']))
+            summary = submission_store.user_summary(user_id, recent=0)
+            user['stats']['total_submissions'] = summary['total']
+            user['stats']['correct_submissions'] = summary['correct']
+            user['stats']['problems_solved'] = len(summary['solved_problems'])
             
-            with open(USERS_FILE, 'w') as f:
-                json.dump(user, f, indent=2)
+            user_service.update_user(user_id, {'stats': user['stats']})
 
-        return jsonify({
+        # Lets the client read its own write from a replica, see services/replication_service.py
+        replication_token = replication_primary.token()
+        response = jsonify({
             'success': True,
+            'replication_token': replication_token,
             'answer': {
                 'answer': data['answer'],
                 'is_correct': is_correct,
                 'timestamp': submission['timestamp']
             },
+            'faster_than': faster_than,
             'stats': {
                 'problemsSolved': user['stats']['problems_solved'] if user is not None else 0,
                 'accuracyRate': round(user['stats']['correct_submissions'] / user['stats']['total_submissions'] * 100, 2) if user is not None and user['stats']['total_submissions'] > 0 else 0,
@@ -203,9 +400,25 @@ def submit_answer(user_id, problem_id):
                 'lastUpdated': submission['timestamp']
             }
         })
+        response.headers['X-Replication-Token'] = replication_token
+        return response
 
     except Exception as e:
-        print(f"Error submitting answer: {e}")
+        logger.exception("Error submitting answer")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/users/<user_id>/activity', methods=['GET'])
+def get_user_activity(user_id):
+    try:
+        today = datetime.now().date()
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if 'to' in request.args else today
+        start = (datetime.strptime(request.args['from'], '%Y-%m-%d').date() if 'from' in request.args
+                 else end - timedelta(days=364))
+        return jsonify(activity_tracker.get_activity(user_id, start, end))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error getting user activity")
         return jsonify({'error': str(e)}), 500
 
 # Unified Stats Route
@@ -221,21 +434,15 @@ def get_unified_stats(user_id):
         problems = problem_service.get_all_problems()
         problem_dict = {str(p['id']): p for p in problems}
 
-        # Load submissions
-        submissions = []
-        if os.path.exists(SUBMISSIONS_FILE):
-            with open(SUBMISSIONS_FILE, 'r') as f:
-                submissions = json.load(f)
-
-        # Filter user's submissions
-        user_submissions = [s for s in submissions if s['user_id'] == user_id]
+        # Scan the user's rows in the columnar submission store
+        summary = submission_store.user_summary(user_id, recent=5)
         
         # Calculate submission stats
-        total_submissions = len(user_submissions)
-        correct_submissions = len([s for s in user_submissions if s['is_correct']])
+        total_submissions = summary['total']
+        correct_submissions = summary['correct']
         
         # Calculate unique problems solved
-        solved_problems = set(str(s['problem_id']) for s in user_submissions if s['is_correct'])
+        solved_problems = set(str(problem_id) for problem_id in summary['solved_problems'])
         
         # Calculate difficulty stats
         difficulty_stats = {
@@ -251,9 +458,7 @@ def get_unified_stats(user_id):
 
         # Get recent activity (last 5 submissions)
         recent_submissions = []
-        sorted_submissions = sorted(user_submissions, key=lambda x: x['timestamp'], reverse=True)[:5]
-
-        for sub in sorted_submissions:
+        for sub in summary['recent']:
             problem_id = str(sub['problem_id'])
             if problem_id in problem_dict:
                 problem = problem_dict[problem_id]
@@ -285,19 +490,343 @@ def get_unified_stats(user_id):
 
         return jsonify(unified_stats)
     except Exception as e:
-        print(f"Error in get_unified_stats: {str(e)}")
+        logger.exception("Error in get_unified_stats")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/users/<user_id>/study-plan/due', methods=['GET'])
+def get_due_reviews(user_id):
+    try:
+        limit = request.args.get('limit', default=20, type=int)
+        due = study_planner.get_due(user_id, limit=max(0, min(limit, 500)))
+        return jsonify({'user_id': user_id, 'due': due})
+    except Exception as e:
+        logger.exception("Error getting study plan")
+        return jsonify({'error': str(e)}), 500
+
+# Contest routes
+def is_admin() -> bool:
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get(ADMIN_TOKEN_HEADER, ''), ADMIN_TOKEN)
+
+def is_cluster_node() -> bool:
+    return bool(CLUSTER_SECRET) and hmac.compare_digest(request.headers.get(CLUSTER_SECRET_HEADER, ''), CLUSTER_SECRET)
+
+@app.route('/api/contests', methods=['GET'])
+def get_contests():
+    try:
+        return jsonify(contest_service.list_contests())
+    except Exception as e:
+        logger.exception("Error getting contests")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/contests', methods=['POST'])
+def create_contest():
+    if not is_admin():
+        return jsonify({'error': 'Only admins can create contests'}), 403
+    try:
+        contest = contest_service.create_contest(request.get_json() or {})
+        return jsonify(contest), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error creating contest")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/contests/<contest_id>', methods=['GET'])
+def get_contest(contest_id):
+    try:
+        contest = contest_service.get_contest(contest_id)
+        if contest:
+            return jsonify(contest)
+        return jsonify({'error': 'Contest not found'}), 404
+    except Exception as e:
+        logger.exception("Error getting contest")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/contests/<contest_id>/submit/<int:problem_id>', methods=['POST'])
+def submit_contest_answer(contest_id, problem_id):
+    try:
+        data = request.get_json()
+        if not data or 'answer' not in data or 'user_id' not in data:
+            return jsonify({'error': 'Missing user_id or answer'}), 400
+        result = contest_service.submit(contest_id, data['user_id'], problem_id, data['answer'])
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error submitting contest answer")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/contests/<contest_id>/scoreboard', methods=['GET'])
+def get_contest_scoreboard(contest_id):
+    try:
+        page = max(1, request.args.get('page', default=1, type=int))
+        page_size = max(1, min(request.args.get('page_size', default=50, type=int), 500))
+        live = request.args.get('live', 'false').lower() == 'true'
+        if live and not is_admin():
+            return jsonify({'error': 'Only admins can see a frozen scoreboard live'}), 403
+        scoreboard = contest_service.get_scoreboard(contest_id, page, page_size, live)
+        if scoreboard:
+            return jsonify(scoreboard)
+        return jsonify({'error': 'Contest not found'}), 404
+    except Exception as e:
+        logger.exception("Error getting scoreboard")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/contests/<contest_id>/standings/<user_id>', methods=['GET'])
+def get_contest_standing(contest_id, user_id):
+    try:
+        live = request.args.get('live', 'false').lower() == 'true'
+        if live and not is_admin():
+            return jsonify({'error': 'Only admins can see a frozen scoreboard live'}), 403
+        standing = contest_service.get_standing(contest_id, user_id, live)
+        if standing:
+            return jsonify(standing)
+        return jsonify({'error': 'Standing not found'}), 404
+    except Exception as e:
+        logger.exception("Error getting standing")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/contests/<contest_id>/unfreeze', methods=['POST'])
+def unfreeze_contest(contest_id):
+    if not is_admin():
+        return jsonify({'error': 'Only admins can unfreeze a contest'}), 403
+    try:
+        contest = contest_service.unfreeze(contest_id)
+        if contest:
+            return jsonify(contest)
+        return jsonify({'error': 'Contest not found'}), 404
+    except Exception as e:
+        logger.exception("Error unfreezing contest")
+        return jsonify({'error': str(e)}), 500
+
+# Topic routes
+@app.route('/api/topics', methods=['GET'])
+def get_topics():
+    try:
+        user_id = request.args.get('user_id')
+        subjects = topic_index.get_topics(user_id)
+        if request.args.get('approx', '').lower() == 'true':
+            unique_users = stat_sketches.topic_unique_users(t['name'] for s in subjects for t in s['topics'])
+            for subject in subjects:
+                for topic in subject['topics']:
+                    topic['unique_users'] = unique_users[topic['name']]
+            return jsonify({'subjects': subjects, 'unique_users_relative_error': round(stat_sketches.topic_users.relative_error, 4)})
+        return jsonify({'subjects': subjects})
+    except Exception as e:
+        logger.exception("Error getting topics")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/topics/<topic>/solve_times', methods=['GET'])
+def get_topic_solve_times(topic):
+    try:
+        with_digest = request.args.get('digest', '').lower() == 'true'
+        return jsonify(dict(stat_sketches.topic_solve_times(topic, with_digest), topic=topic))
+    except Exception as e:
+        logger.exception("Error getting topic solve times")
+        return jsonify({'error': str(e)}), 500
+
+# Query routes
+@app.route('/api/query', methods=['POST'])
+def run_query():
+    """Group-by aggregation over submissions, e.g.
+    {"filter": {"subject": "Physics"}, "group_by": ["day"], "metrics": ["count", "accuracy", "p90_time_taken"]}
+    """
+    try:
+        return jsonify(query_engine.execute(request.get_json(silent=True) or {}))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error running query")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/query/metrics', methods=['GET'])
+def get_query_metrics():
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(query_engine.cache_stats())
+
+@app.route('/api/admin/cache/metrics', methods=['GET'])
+def get_cache_metrics():
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({cache.name: cache.stats() for cache in (profile_cache, stats_cache, projection_cache)})
+
+@app.route('/api/admin/timeseries', methods=['GET'])
+def get_timeseries():
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        # Offsets are converted to UTC, so bounds with and without one can be mixed
+        end = naive_utc(datetime.fromisoformat(request.args['to'])) if 'to' in request.args else datetime.now()
+        start = (naive_utc(datetime.fromisoformat(request.args['from'])) if 'from' in request.args
+                 else end - timedelta(days=1))
+        metrics = request.args['metrics'].split(',') if request.args.get('metrics') else None
+        series = timeseries.query(start, end, request.args.get('resolution'), metrics)
+        if request.args.get('approx', '').lower() == 'true':
+            # Distinct users over the whole range, which per-bucket active_users cannot add up to
+            series['range'] = stat_sketches.distinct_users(start.date(), end.date())
+        return jsonify(series)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error getting time series")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/sketches', methods=['GET'])
+def export_sketches():
+    """This node's own sketches as an .npz, for loading into another node with POST."""
+    if not (is_admin() or is_cluster_node()):
+        return jsonify({'error': 'Forbidden'}), 403
+    return Response(stat_sketches.export_bytes(), mimetype='application/octet-stream',
+                    headers={'Content-Disposition': 'attachment; filename=sketches.npz'})
+
+@app.route('/api/admin/sketches', methods=['POST'])
+def merge_sketches():
+    """Keep another shard's exported sketches, named by ``?shard=``; sending them again replaces them."""
+    if not (is_admin() or is_cluster_node()):
+        return jsonify({'error': 'Forbidden'}), 403
+    shard = request.args.get('shard', '')
+    if not shard:
+        return jsonify({'error': 'shard is required'}), 400
+    try:
+        stat_sketches.put_shard(shard, request.get_data())
+        return jsonify(stat_sketches.stats())
+    except (ValueError, KeyError, OSError) as e:
+        return jsonify({'error': f'Invalid sketch file: {e}'}), 400
+    except Exception as e:
+        logger.exception("Error merging sketches")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/sketches', methods=['DELETE'])
+def remove_sketches():
+    if not (is_admin() or is_cluster_node()):
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        if not stat_sketches.remove_shard(request.args.get('shard', '')):
+            return jsonify({'error': 'Shard not found'}), 404
+        return jsonify(stat_sketches.stats())
+    except Exception as e:
+        logger.exception("Error removing sketches")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/problems/duplicates', methods=['GET'])
+def get_duplicate_report():
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        threshold = float(request.args.get('threshold', DUPLICATE_THRESHOLD))
+        return jsonify(problem_dedupe.report(threshold))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error building duplicate report")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/problems/duplicates/check', methods=['POST'])
+def check_duplicates():
+    """Validate a batch of problems against the catalog before importing it."""
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    try:
+        problems = request.get_json()
+        if not isinstance(problems, list):
+            return jsonify({'error': 'Expected a JSON list of problems'}), 400
+        threshold = float(request.args.get('threshold', DUPLICATE_THRESHOLD))
+        matches = problem_dedupe.find_duplicates_batch(problems, threshold)
+        return jsonify([{'index': i, 'duplicates': m} for i, m in enumerate(matches) if m])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error checking duplicates")
+        return jsonify({'error': str(e)}), 500
+
+# Partition handoff routes, used by router.py when nodes join or leave
+@app.route('/api/admin/partition/users', methods=['GET'])
+def get_partition_users():
+    try:
+        return jsonify(partition_service.list_users())
+    except Exception as e:
+        logger.exception("Error listing partition users")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/partition/catalog', methods=['GET'])
+def get_partition_catalog():
+    try:
+        return jsonify(partition_service.catalog())
+    except Exception as e:
+        logger.exception("Error exporting catalog")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/partition/catalog', methods=['PUT'])
+def put_partition_catalog():
+    try:
+        return jsonify({'problems': partition_service.import_catalog(request.get_json() or [])})
+    except Exception as e:
+        logger.exception("Error importing catalog")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/partition/export', methods=['POST'])
+def export_partition():
+    user_ids = (request.get_json() or {}).get('users', [])
+    return Response(stream_with_context(partition_service.export(user_ids)), mimetype='application/x-ndjson')
+
+@app.route('/api/admin/partition/import', methods=['POST'])
+def import_partition():
+    try:
+        return jsonify(partition_service.import_records(request.stream))
+    except (ValueError, KeyError) as e:
+        return jsonify({'error': f'Bad partition record: {e}'}), 400
+    except Exception as e:
+        logger.exception("Error importing partition")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/partition/drop', methods=['POST'])
+def drop_partition():
+    try:
+        return jsonify({'dropped': partition_service.drop((request.get_json() or {}).get('users', []))})
+    except Exception as e:
+        logger.exception("Error dropping partition users")
+        return jsonify({'error': str(e)}), 500
+
+# Replication routes: the primary serves snapshot and stream to replicas, both report status
+@app.route('/api/replication/status', methods=['GET'])
+def get_replication_status():
+    if replica is not None:
+        return jsonify(replica.status())
+    return jsonify({'role': 'primary', 'position': replication_primary.position()})
+
+@app.route('/api/replication/snapshot', methods=['GET'])
+def get_replication_snapshot():
+    try:
+        return jsonify(replication_primary.snapshot())
+    except Exception as e:
+        logger.exception("Error building replication snapshot")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/replication/stream', methods=['GET'])
+def stream_replication_log():
+    try:
+        submissions = int(request.args.get('submissions', 0))
+        state = int(request.args.get('state', 0))
+        generation = int(request.args.get('generation', 0))
+    except ValueError:
+        return jsonify({'error': 'submissions, state and generation must be integers'}), 400
+    return Response(stream_with_context(replication_primary.stream(submissions, state, generation)),
+                    mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
 # Stats and Reviews routes
 @app.route('/problem_stats/<int:problem_id>', methods=['GET'])
 def get_problem_stats(problem_id):
     try:
-        stats = problem_service.get_problem_stats(problem_id)
+        approx = request.args.get('approx', '').lower() == 'true'
+        stats = problem_service.get_problem_stats(problem_id, approx)
         if stats:
+            if request.args.get('digest', '').lower() == 'true':
+                stats['solve_time'] = stat_sketches.problem_solve_times(problem_id, with_digest=True)
             return jsonify(stats)
         return jsonify({'error': 'Problem stats not found'}), 404
     except Exception as e:
-        print(f"Error getting problem stats: {e}")
+        logger.exception("Error getting problem stats")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/problems/<int:problem_id>/submissions', methods=['GET'])
@@ -313,9 +842,30 @@ def get_problem_submissions(problem_id):
         problem_submissions = [s for s in submissions if s['problem_id'] == problem_id]
         return jsonify(problem_submissions)
     except Exception as e:
-        print(f"Error getting submissions: {e}")
+        logger.exception("Error getting submissions")
         return jsonify({'error': str(e)}), 500
 
+# Live event streams (Server-Sent Events)
+def event_stream_response(subscription):
+    response = Response(stream_with_context(broadcaster.stream(subscription)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/stream/problems/<int:problem_id>', methods=['GET'])
+def stream_problem_events(problem_id):
+    # Clients load the stats with /problem_stats and apply the deltas on top
+    return event_stream_response(broadcaster.subscribe(problem_channel(problem_id)))
+
+@app.route('/api/stream/users/<user_id>', methods=['GET'])
+def stream_user_events(user_id):
+    return event_stream_response(broadcaster.subscribe(user_channel(user_id)))
+
+@app.route('/api/stream/stats', methods=['GET'])
+def get_stream_stats():
+    return jsonify(broadcaster.stats())
+
 @app.route('/users/<user_id>/submit_review/<int:problem_id>', methods=['POST'])
 def submit_review(user_id, problem_id):
     try:
@@ -328,62 +878,140 @@ def submit_review(user_id, problem_id):
         result = scoring_service.submit_review(user_id, problem_id, review)
         return jsonify(result)
     except Exception as e:
-        print(f"Error submitting review: {e}")
+        logger.exception("Error submitting review")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/problems/<int:problem_id>/reviews', methods=['GET'])
 def get_problem_reviews(problem_id):
     try:
-        # Load reviews from file
-        reviews = []
-        if os.path.exists(REVIEWS_FILE):
-            with open(REVIEWS_FILE, 'r') as f:
-                reviews_data = json.load(f)
-                # Get reviews for this problem
-                problem_reviews = reviews_data.get(str(problem_id), [])
-                
-                # Format the response
-                formatted_reviews = [{
-                    'id': str(uuid.uuid4()),  # Generate ID for existing reviews
-                    'content': r.get('review', ''),
-                    'media': r.get('media'),
-                    'author': r.get('user_id', 'Anonymous'),
-                    'timestamp': r.get('timestamp')
-                } for r in problem_reviews]
-                
-                return jsonify(formatted_reviews)
-    except Exception as e:
-        print(f"Error getting reviews: {e}")
+        limit = max(1, min(request.args.get('limit', default=50, type=int), 200))
+        cursor = request.args.get('cursor')
+        reviews, next_cursor = review_store.get_reviews(problem_id, limit=limit, cursor=cursor)
+        response = jsonify([format_review(r) for r in reviews])
+        # Pagination metadata goes in headers so the body stays a plain list
+        response.headers['X-Total-Count'] = str(review_store.count(problem_id))
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    except Exception as e:
+        logger.exception("Error getting reviews")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/problems/<int:problem_id>/reviews/count', methods=['GET'])
+def get_problem_review_count(problem_id):
+    try:
+        return jsonify({'problem_id': problem_id, 'count': review_store.count(problem_id)})
+    except Exception as e:
+        logger.exception("Error counting reviews")
         return jsonify({'error': str(e)}), 500
 
 # Serve uploaded files
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    blob_path = media_store.resolve(filename)
+    if blob_path is None:
+        filename = secure_filename(filename)
+        path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    else:
+        path = blob_path
+    if not filename or not os.path.isfile(path):
+        return jsonify({'error': 'File not found'}), 404
+    # Content-addressed originals never change, so their digest is the ETag and they cache forever
+    is_original = blob_path is not None and filename.count('.') == 1
+    return serve_file(
+        path,
+        etag=filename.split('.', 1)[0] if is_original else None,
+        immutable=is_original,
+        accel_prefix=app.config['UPLOADS_X_ACCEL_PREFIX'],
+        accel_path=os.path.relpath(path, app.config['UPLOAD_FOLDER'])
+    )
 
 # Helper function to handle file upload
-def handle_file_upload(file, filename):
+def handle_file_upload(file, filename, attached=False):
     if file and allowed_file(filename):
-        # Create unique filename
-        filename = secure_filename(f"{uuid.uuid4()}_{filename}")
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        return f"/uploads/{filename}"
+        # Streamed to a content-addressed blob; identical files are stored once
+        stored = media_store.save_stream(file.stream, filename, attached)
+        if not stored['deduplicated']:
+            thumbnailer.enqueue(stored['filename'])
+        return stored['path']
     return None
 
 # File upload route
 @app.route('/upload_image', methods=['POST'])
 def upload_image():
+    """Small files only: Werkzeug parses the multipart body and MAX_CONTENT_LENGTH caps it.
+
+    Larger files go through the resumable /api/uploads routes, which stream each
+    chunk to disk and accept up to media_service.MAX_UPLOAD_SIZE.
+    """
     if 'image' not in request.files:
         return jsonify({'error': 'No image part'}), 400
     
     file = request.files['image']
     filename = file.filename
-    media_url = handle_file_upload(file, filename)
+    try:
+        media_url = handle_file_upload(file, filename)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
     if media_url:
         return jsonify({'filename': filename, 'path': media_url})
     return jsonify({'error': 'Invalid file type'}), 400
 
+# Resumable upload routes
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    try:
+        data = request.get_json() or {}
+        session = media_store.create_session(data.get('filename', ''), data.get('size'))
+        return jsonify(session), 201
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error creating upload")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    try:
+        return jsonify(media_store.get_session(upload_id))
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT', 'PATCH'])
+def append_upload(upload_id):
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({'error': 'Missing offset'}), 400
+        session = media_store.append_chunk(upload_id, offset, request.stream)
+        return jsonify(session)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        logger.exception("Error appending upload chunk")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    try:
+        stored = media_store.complete_session(upload_id)
+        if not stored['deduplicated']:
+            thumbnailer.enqueue(stored['filename'])
+        return jsonify(stored)
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error completing upload")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/media/metrics', methods=['GET'])
+def get_media_metrics():
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(thumbnailer.metrics())
+
 # Review routes
 @app.route('/api/problems/<int:problem_id>/reviews', methods=['POST'])
 def add_review(problem_id):
@@ -392,52 +1020,34 @@ def add_review(problem_id):
         if not content:
             return jsonify({'error': 'Review content is required'}), 400
 
-        # Handle media file if present
+        # Handle media file if present; the review holds a reference to the blob it shows
         media_url = None
+        from_upload = False
         if 'media' in request.files:
             file = request.files['media']
             filename = file.filename
-            media_url = handle_file_upload(file, filename)
-
-        # Create review object
-        review = {
-            'user_id': 'user1',  # TODO: Get from auth
-            'review': content,
-            'timestamp': datetime.now().isoformat(),
-            'problem_id': problem_id,
-            'media': media_url
-        }
+            media_url = handle_file_upload(file, filename, attached=True)
+        elif request.form.get('media_url'):
+            # Media already sent through the resumable upload API
+            media_url = request.form['media_url']
+            if not media_url.startswith('/uploads/') or not media_store.acquire(media_url.rsplit('/', 1)[-1]):
+                return jsonify({'error': 'Unknown media'}), 400
+            from_upload = True
 
-        # Load existing reviews
-        reviews_data = {}
-        if os.path.exists(REVIEWS_FILE):
-            with open(REVIEWS_FILE, 'r') as f:
-                reviews_data = json.load(f)
-
-        # Initialize problem reviews list if it doesn't exist
-        problem_id_str = str(problem_id)
-        if problem_id_str not in reviews_data:
-            reviews_data[problem_id_str] = []
-
-        # Add new review
-        reviews_data[problem_id_str].append(review)
-
-        # Save updated reviews
-        with open(REVIEWS_FILE, 'w') as f:
-            json.dump(reviews_data, f, indent=2)
-
-        # Format the response
-        formatted_review = {
-            'id': str(uuid.uuid4()),
-            'content': review['review'],
-            'media': review['media'],
-            'author': review['user_id'],
-            'timestamp': review['timestamp']
-        }
+        try:
+            review = review_store.add_review(problem_id, 'user1', content, media=media_url)  # TODO: Get user from auth
+        except Exception:
+            if media_url:
+                media_store.release(media_url.rsplit('/', 1)[-1])
+            raise
+        if from_upload:
+            # The review now holds the blob, so the upload lets go of it
+            media_store.attach(media_url.rsplit('/', 1)[-1])
+        formatted_review = format_review(review)
 
         return jsonify(formatted_review)
     except Exception as e:
-        print(f"Error adding review: {e}")
+        logger.exception("Error adding review")
         return jsonify({'error': str(e)}), 500
 
 # Helper function to load JSON data
@@ -450,7 +1060,7 @@ def load_data(file_path):
 
 if __name__ == '__main__':
     # Ensure data directory exists
-    os.makedirs(os.path.join(current_dir, 'data'), exist_ok=True)
+    os.makedirs(DATA_DIR, exist_ok=True)
     # Ensure uploads directory exists
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5001)), debug=True)
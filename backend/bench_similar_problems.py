@@ -0,0 +1,81 @@
+"""Measure build time and memory of the similar-problems index.
+
+Problems are generated like data.py's bank, with descriptions and options
+drawn from a Zipf-distributed vocabulary so word frequencies look like real
+text rather than a handful of repeated templates.
+
+Usage: python bench_similar_problems.py [problems] [vocabulary]
+"""
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from services.similarity_service import SimilarProblemIndex
+
+TOPICS = {
+    'Physics': ['Mechanics', 'Electrostatics', 'Thermodynamics', 'Modern Physics', 'Optics', 'Magnetism'],
+    'Chemistry': ['Organic Chemistry', 'Inorganic Chemistry', 'Physical Chemistry', 'Chemical Bonding',
+                  'Electrochemistry', 'Chemical Kinetics'],
+    'Mathematics': ['Calculus', 'Algebra', 'Coordinate Geometry', 'Trigonometry', 'Vectors', 'Probability']
+}
+
+
+def make_problems(count, vocabulary):
+    rng = np.random.default_rng(0)
+    words = np.array([f'w{i}' for i in range(vocabulary)])
+    ranks = np.arange(1, vocabulary + 1)
+    weights = 1 / ranks ** 1.1
+    weights /= weights.sum()
+    subjects = list(TOPICS)
+    problems = []
+    for i in range(count):
+        subject = subjects[rng.integers(len(subjects))]
+        topic = TOPICS[subject][rng.integers(len(TOPICS[subject]))]
+        drawn = words[rng.choice(vocabulary, size=rng.integers(20, 45), p=weights)]
+        problems.append({
+            'id': i + 1,
+            'title': f'{topic} Problem {i + 1}',
+            'description': ' '.join(drawn[:-12]),
+            'options': [{'id': letter, 'text': ' '.join(drawn[-12:][3 * k:3 * k + 3])}
+                        for k, letter in enumerate('ABCD')],
+            'subject': subject,
+            'topic': topic
+        })
+    return problems
+
+
+def run(count=100000, vocabulary=30000):
+    problems = make_problems(count, vocabulary)
+    index = SimilarProblemIndex()
+
+    started = time.perf_counter()
+    index.rebuild(problems)
+    elapsed = time.perf_counter() - started
+    # Tracing slows allocation-heavy code down, so memory is measured on a second build
+    tracemalloc.start()
+    index.rebuild(problems)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = index.stats()
+    print(f"{count} problems, {stats['vocabulary']} words, {stats['nonzeros']} nonzeros")
+    print(f'build                  {elapsed:9.1f} s')
+    print(f"index arrays           {stats['array_bytes'] / 2 ** 20:9.1f} MiB")
+    print(f'peak traced during build {peak / 2 ** 20:7.1f} MiB')
+
+    extra = make_problems(count + 100, vocabulary)[count:]
+    started = time.perf_counter()
+    for problem in extra:
+        index.add_problem(problem)
+    print(f'add_problem            {(time.perf_counter() - started) / len(extra) * 1000:9.2f} ms each')
+
+    started = time.perf_counter()
+    for problem_id in range(1, 1001):
+        index.similar(problem_id)
+    print(f'similar                {(time.perf_counter() - started) * 1000:9.3f} us each')
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    run(*args)
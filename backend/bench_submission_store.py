@@ -0,0 +1,78 @@
+"""Measure vectorized scan speed of the columnar submission store.
+
+Usage: python bench_submission_store.py [rows] [problems] [users]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from database.submission_store import COLUMNS, SubmissionColumns
+
+
+def make_store(tmp_dir, rows, problems, users):
+    store = SubmissionColumns()
+    os.makedirs(os.path.join(tmp_dir, 'data'), exist_ok=True)
+    store.submissions_file = os.path.join(tmp_dir, 'data', 'submissions.json')
+    store.root = os.path.join(tmp_dir, 'data', 'columnar')
+    store.manifest_file = os.path.join(store.root, 'manifest.json')
+    store.load()
+
+    # Write segments directly; going through append() would measure JSON-shaped ingestion instead
+    rng = np.random.default_rng(0)
+    segment_rows = 8 * 1024 * 1024
+    names = []
+    for start in range(0, rows, segment_rows):
+        n = min(segment_rows, rows - start)
+        name = f'seg-{len(names) + 1:06d}'
+        path = os.path.join(store.root, name)
+        os.makedirs(path)
+        columns = {
+            'user': rng.integers(0, users, n, dtype=np.int32),
+            'problem': rng.integers(1, problems + 1, n, dtype=np.int32),
+            'timestamp': np.arange(start, start + n, dtype=np.int64) * 1000000,
+            'correct': rng.random(n) < 0.4,
+            'time_taken': rng.integers(5, 600, n, dtype=np.int32),
+            'attempt': rng.integers(1, 5, n, dtype=np.int32),
+            'answer': rng.integers(0, 4, n, dtype=np.int32)
+        }
+        for column, dtype in COLUMNS.items():
+            np.save(os.path.join(path, f'{column}.npy'), columns[column].astype(dtype))
+        names.append({'name': name, 'rows': n})
+    store._manifest['segments'] = names
+    store._manifest['users'] = [f'user{i}' for i in range(users)]
+    store._manifest['answers'] = ['A', 'B', 'C', 'D']
+    store._user_codes = {user: i for i, user in enumerate(store._manifest['users'])}
+    store._answer_codes = {answer: i for i, answer in enumerate(store._manifest['answers'])}
+    store._segments = [store._open_segment(segment['name']) for segment in names]
+    return store
+
+
+def timed(label, rows, fn, repeat=5):
+    fn()
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    print(f'{label:<22} {best * 1000:9.1f} ms  {rows / best / 1e6:8.0f} M rows/s')
+
+
+def run(rows=50000000, problems=2000, users=100000):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        store = make_store(tmp_dir, rows, problems, users)
+        print(f'{rows} rows, {problems} problems, {users} users')
+        timed('problem_accuracy', rows, store.problem_accuracy)
+        timed('problem_summary', rows, lambda: store.problem_summary(problems // 2))
+        timed('user_summary', rows, lambda: store.user_summary('user42'))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
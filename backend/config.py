@@ -1,3 +1,26 @@
+import os
+
+# Root of all persistent state; point several processes at different directories
+# to run them side by side, e.g. DATA_DIR=data/node1 PORT=5002 python app.py
+DATA_DIR = os.environ.get('DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Shared by every node, replica and router of one deployment. Node-to-node routes
+# (partition handoff, replication) only answer requests that carry it in this header,
+# and are disabled while it is unset
+CLUSTER_SECRET = os.environ.get('CLUSTER_SECRET', '')
+CLUSTER_SECRET_HEADER = 'X-Cluster-Secret'
+INTERNAL_PATHS = ('/api/admin/partition/', '/api/replication/snapshot', '/api/replication/stream')
+
+# Operators send this in the header to use the /api/admin routes, to create
+# contests, to see frozen scoreboards live and to unfreeze them (nodes may load
+# each other's sketches with CLUSTER_SECRET instead); those are refused while it is unset
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+
+def cluster_headers() -> dict:
+    return {CLUSTER_SECRET_HEADER: CLUSTER_SECRET}
+
 class Config:
     DEBUG = True
     SECRET_KEY = 'your-secret-key-here'
@@ -0,0 +1,327 @@
+"""Hash-sharded per-user answer storage.
+
+Each user's answers live in their own small JSON file, placed in one of N
+shard directories chosen by a stable hash of the user id::
+
+    data/answers/directory.json
+    data/answers/<layout>/<shard>/<quoted user id>.json
+
+Saving an answer rewrites only that user's file. Cross-user scans walk the
+shard directories in parallel. The shard count can be changed while the server
+is running with::
+
+    python -m database.answer_store reshard <num_shards>
+
+Writers in every process hold a shared ``flock`` on ``answers/writers.lock``
+and resharding takes it exclusively, so the two coordinate across processes.
+Where ``fcntl`` is unavailable, stop the server before resharding.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+import json
+import os
+import shutil
+import sys
+import threading
+import uuid
+import zlib
+from config import DATA_DIR
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+DEFAULT_SHARDS = 16
+LOCK_STRIPES = 64
+SCAN_WORKERS = 8
+# Users copied per exclusive hold of the writers' lock while resharding
+RESHARD_BATCH = 256
+
+
+def shard_for(user_id: str, num_shards: int) -> int:
+    return zlib.crc32(str(user_id).encode('utf-8')) % num_shards
+
+
+class AnswerStore:
+    def __init__(self, base_path: Optional[str] = None):
+        self.base_path = base_path or DATA_DIR
+        self.root = os.path.join(self.base_path, 'answers')
+        self.directory_file = os.path.join(self.root, 'directory.json')
+        self.legacy_file = os.path.join(self.base_path, 'user_answers.json')
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._init_lock = threading.Lock()
+        self._directory: Optional[Dict] = None
+        self._directory_mtime = None
+        # Each thread needs its own open file for flock() locks to be its own
+        self._lock_files = threading.local()
+
+    # Shard directory
+    def _read_directory(self) -> Dict:
+        """Current layout, re-read when a resharding run has changed it."""
+        try:
+            mtime = os.stat(self.directory_file).st_mtime_ns
+        except FileNotFoundError:
+            self._initialize()
+            mtime = os.stat(self.directory_file).st_mtime_ns
+        if self._directory is None or mtime != self._directory_mtime:
+            with open(self.directory_file, 'r') as f:
+                self._directory = json.load(f)
+            self._directory_mtime = mtime
+        return self._directory
+
+    def _write_directory(self, directory: Dict) -> None:
+        tmp_file = self.directory_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(directory, f, indent=2)
+        os.replace(tmp_file, self.directory_file)
+
+    def _initialize(self) -> None:
+        """Create the first layout, importing the legacy single-file user_answers.json."""
+        with self._init_lock:
+            if os.path.exists(self.directory_file):
+                return
+            os.makedirs(self.root, exist_ok=True)
+            layout = {'layout': 'v1', 'shards': DEFAULT_SHARDS}
+            for user_id, answers in self._read_legacy().items():
+                self._write_user(layout, user_id, answers)
+            self._write_directory(dict(layout, next=None))
+
+    def _read_legacy(self) -> Dict[str, Dict]:
+        try:
+            with open(self.legacy_file, 'r') as f:
+                legacy = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if not isinstance(legacy, dict):
+            return {}
+        merged: Dict[str, Dict] = {}
+        # Writers disagreed on whether users sit at the top level or under "answers"; keep the latest of each
+        sources = [(k, v) for k, v in legacy.items() if k != 'answers']
+        sources += list(legacy.get('answers', {}).items())
+        for user_id, answers in sources:
+            if not isinstance(answers, dict):
+                continue
+            user_answers = merged.setdefault(str(user_id), {})
+            for problem_id, answer in answers.items():
+                current = user_answers.get(problem_id)
+                if current is None or answer.get('timestamp', '') > current.get('timestamp', ''):
+                    user_answers[problem_id] = answer
+        return merged
+
+    # Per-user files
+    def _user_path(self, layout: Dict, user_id: str) -> str:
+        shard = shard_for(user_id, layout['shards'])
+        return os.path.join(self.root, layout['layout'], f'{shard:04d}', quote(str(user_id), safe='') + '.json')
+
+    def _write_user(self, layout: Dict, user_id: str, answers: Dict, exclusive: bool = False) -> bool:
+        path = self._user_path(layout, user_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(answers, f, separators=(',', ':'))
+        if not exclusive:
+            os.replace(tmp_file, path)
+            return True
+        # Used by resharding: never overwrite a copy the live server already wrote
+        try:
+            os.link(tmp_file, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_file)
+
+    def _read_user(self, layout: Dict, user_id: str) -> Dict:
+        try:
+            with open(self._user_path(layout, user_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _lock_for(self, user_id: str) -> threading.Lock:
+        return self._locks[shard_for(user_id, LOCK_STRIPES)]
+
+    # Cross-process locking
+    def _lock_fds(self) -> Tuple[int, int]:
+        fds = getattr(self._lock_files, 'fds', None)
+        if fds is None:
+            os.makedirs(self.root, exist_ok=True)
+            fds = tuple(os.open(os.path.join(self.root, name), os.O_RDWR | os.O_CREAT, 0o644)
+                        for name in ('reshard.lock', 'writers.lock'))
+            self._lock_files.fds = fds
+        return fds
+
+    @contextmanager
+    def _writing(self):
+        """Hold the writers' lock shared for one write."""
+        if fcntl is None:
+            yield
+            return
+        turnstile, writers = self._lock_fds()
+        # A resharding run holds the turnstile while it waits, so a steady stream of writers cannot starve it
+        fcntl.flock(turnstile, fcntl.LOCK_EX)
+        try:
+            fcntl.flock(writers, fcntl.LOCK_SH)
+        finally:
+            fcntl.flock(turnstile, fcntl.LOCK_UN)
+        try:
+            yield
+        finally:
+            fcntl.flock(writers, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writes_stopped(self):
+        """Hold the writers' lock exclusively: no write is in flight in any process."""
+        if fcntl is None:
+            yield
+            return
+        turnstile, writers = self._lock_fds()
+        fcntl.flock(turnstile, fcntl.LOCK_EX)
+        try:
+            fcntl.flock(writers, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(writers, fcntl.LOCK_UN)
+        finally:
+            fcntl.flock(turnstile, fcntl.LOCK_UN)
+
+    # Public API
+    def get_user_answers(self, user_id: str) -> Dict[str, Dict]:
+        return self._read_user(self._read_directory(), str(user_id))
+
+    def get_answer(self, user_id: str, problem_id) -> Optional[Dict]:
+        return self.get_user_answers(user_id).get(str(problem_id))
+
+    def update_user_answers(self, user_id: str, update: Callable[[Dict], None]) -> Dict:
+        """Apply ``update`` to one user's answers in place and persist only that user."""
+        user_id = str(user_id)
+        with self._lock_for(user_id), self._writing():
+            directory = self._read_directory()
+            answers = self._read_user(directory, user_id)
+            update(answers)
+            self._write_user(directory, user_id, answers)
+            if directory.get('next'):
+                # Resharding in progress: keep the new layout current too
+                self._write_user(directory['next'], user_id, answers)
+            return answers
+
+    def save_answer(self, user_id: str, problem_id, answer_data: Dict) -> Dict:
+        def update(answers):
+            answers[str(problem_id)] = answer_data
+        return self.update_user_answers(user_id, update)
+
+    def replace_answer(self, user_id: str, problem_id, answer_data: Dict) -> Optional[Dict]:
+        """Save one answer and return the one it replaced, read under the same lock."""
+        previous = []
+
+        def update(answers):
+            previous.append(answers.get(str(problem_id)))
+            answers[str(problem_id)] = answer_data
+        self.update_user_answers(user_id, update)
+        return previous[0]
+
+    def delete_user(self, user_id: str) -> None:
+        """Remove every answer of one user."""
+        user_id = str(user_id)
+        with self._lock_for(user_id), self._writing():
+            directory = self._read_directory()
+            for layout in (directory, directory.get('next')):
+                if layout:
+                    try:
+                        os.remove(self._user_path(layout, user_id))
+                    except FileNotFoundError:
+                        pass
+
+    def shard_dirs(self) -> List[str]:
+        """Directories of the current layout, one per shard, for external scans."""
+        if not os.path.exists(self.directory_file):
+            return []
+        return self._shard_dirs(self._read_directory())
+
+    def _shard_dirs(self, layout: Dict) -> List[str]:
+        base = os.path.join(self.root, layout['layout'])
+        return [os.path.join(base, f'{shard:04d}') for shard in range(layout['shards'])]
+
+    @staticmethod
+    def iter_shard(shard_dir: str) -> Iterator[Tuple[str, Dict]]:
+        if not os.path.isdir(shard_dir):
+            return
+        for name in os.listdir(shard_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(shard_dir, name), 'r') as f:
+                    yield unquote(name[:-len('.json')]), json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+
+    def iter_users(self) -> Iterator[Tuple[str, Dict]]:
+        """Yield ``(user_id, answers)`` for every user, one shard at a time."""
+        for shard_dir in self._shard_dirs(self._read_directory()):
+            yield from self.iter_shard(shard_dir)
+
+    def map_shards(self, fn: Callable[[Iterator[Tuple[str, Dict]]], object]) -> List:
+        """Run ``fn`` over each shard's users in parallel and return the per-shard results."""
+        shard_dirs = self._shard_dirs(self._read_directory())
+        with ThreadPoolExecutor(max_workers=min(SCAN_WORKERS, len(shard_dirs))) as pool:
+            return list(pool.map(lambda d: fn(self.iter_shard(d)), shard_dirs))
+
+    def get_problem_answers(self, problem_id) -> List[Tuple[str, Dict]]:
+        """Every user's answer to one problem, gathered across shards in parallel."""
+        key = str(problem_id)
+
+        def collect(users):
+            return [(user_id, answers[key]) for user_id, answers in users if key in answers]
+
+        results = []
+        for part in self.map_shards(collect):
+            results.extend(part)
+        return results
+
+    # Resharding
+    def reshard(self, num_shards: int) -> Dict:
+        """Move every user into a new layout with ``num_shards`` shards while serving traffic.
+
+        The new layout is announced with writes stopped, so every later write
+        updates both layouts. Existing users are then copied in batches, each
+        with writes stopped so a copy is never staler than the file it reads
+        and a user deleted meanwhile is not brought back; copies live writers
+        already made are kept. Finally the directory is switched over and the
+        old layout removed.
+        """
+        with self._writes_stopped():
+            directory = self._read_directory()
+            if directory.get('next'):
+                raise ValueError('A resharding run is already in progress')
+            version = int(directory['layout'].lstrip('v')) + 1
+            new_layout = {'layout': f'v{version}', 'shards': int(num_shards)}
+            self._write_directory(dict(directory, next=new_layout))
+        copied = 0
+        for shard_dir in self._shard_dirs(directory):
+            if not os.path.isdir(shard_dir):
+                continue
+            user_ids = [unquote(name[:-len('.json')]) for name in os.listdir(shard_dir) if name.endswith('.json')]
+            for start in range(0, len(user_ids), RESHARD_BATCH):
+                with self._writes_stopped():
+                    for user_id in user_ids[start:start + RESHARD_BATCH]:
+                        answers = self._read_user(directory, user_id)
+                        if answers and self._write_user(new_layout, user_id, answers, exclusive=True):
+                            copied += 1
+        with self._writes_stopped():
+            self._write_directory(dict(new_layout, next=None))
+        shutil.rmtree(os.path.join(self.root, directory['layout']), ignore_errors=True)
+        return {'layout': new_layout['layout'], 'shards': new_layout['shards'], 'copied': copied}
+
+answer_store = AnswerStore()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'reshard':
+        print('Usage: python -m database.answer_store reshard <num_shards>')
+        print('Safe while the server is running, except where fcntl is unavailable: stop the server first there.')
+        sys.exit(1)
+    print(answer_store.reshard(int(sys.argv[2])))
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import copy
+import threading
+import time
+
+# Stored for keys whose loader found nothing, so repeated misses stay cheap
+_ABSENT = object()
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after ``ttl`` seconds.
+
+    Values are copied on the way in and out with ``copier`` (a deep copy by
+    default), so callers may modify what they get. Loaders that return None
+    are remembered for ``negative_ttl`` seconds.
+    ``invalidate`` is meant to be called write-through by whatever changes the
+    underlying record; a load that races with an invalidation is not cached.
+    """
+
+    def __init__(self, name: str, max_entries: int = 10000, ttl: Optional[float] = 60.0,
+                 negative_ttl: Optional[float] = 5.0, copier: Callable[[Any], Any] = copy.deepcopy):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.copier = copier
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, Optional[float]]]' = OrderedDict()
+        # Bumped by every invalidation; a load only stores its result if this did not move
+        self._generation = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Optional[Any]]) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    if value is _ABSENT:
+                        self.negative_hits += 1
+                        return None
+                    self.hits += 1
+                    return self.copier(value)
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+
+        ttl = self.ttl if value is not None else self.negative_ttl
+        if value is None and not self.negative_ttl:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (_ABSENT if value is None else self.copier(value),
+                                      now + ttl if ttl else None)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
@@ -2,16 +2,24 @@ import json
 import os
 from datetime import datetime
 from typing import Dict, List, Optional, Any
+from database.answer_store import answer_store
+from database.cache import TTLCache
+from database.state_store import state_store
+from config import DATA_DIR
+
+# Formatted profiles and stats documents served by UserService; the write
+# methods below invalidate them so every writer goes through here
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60)) or None
+# Profiles are flat apart from the stats dict, so copying two levels is enough
+profile_cache = TTLCache('user_profiles', USER_CACHE_SIZE, USER_CACHE_TTL,
+                         copier=lambda user: dict(user, stats=dict(user.get('stats') or {})))
+stats_cache = TTLCache('user_stats', USER_CACHE_SIZE, USER_CACHE_TTL)
 
 class DatabaseHandler:
     def __init__(self):
-        self.base_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
-        self.problems_file = os.path.join(self.base_path, 'problems.json')
-        self.users_file = os.path.join(self.base_path, 'users.json')
-        self.answers_file = os.path.join(self.base_path, 'user_answers.json')
-        self.stats_file = os.path.join(self.base_path, 'user_stats.json')
+        self.base_path = DATA_DIR
         self.reviews_file = os.path.join(self.base_path, 'reviews.json')
-        self.problem_stats_file = os.path.join(self.base_path, 'problem_stats.json')
 
     def _read_json(self, filepath: str) -> Dict:
         try:
@@ -27,71 +35,53 @@ class DatabaseHandler:
 
     # Problem Operations
     def get_all_problems(self) -> List[Dict]:
-        data = self._read_json(self.problems_file)
-        return data.get('problems', [])
+        return sorted(state_store.values('problems'), key=lambda p: int(p['id']))
 
     def get_problem_by_id(self, problem_id: int) -> Optional[Dict]:
-        problems = self.get_all_problems()
-        return next((p for p in problems if int(p['id']) == problem_id), None)
+        return state_store.get('problems', int(problem_id))
 
     def add_problem(self, problem_data: Dict) -> Dict:
-        data = self._read_json(self.problems_file)
-        problems = data.get('problems', [])
-        
-        # Generate new ID
-        max_id = max([p['id'] for p in problems]) if problems else 0
-        problem_data['id'] = max_id + 1
-        
-        problems.append(problem_data)
-        data['problems'] = problems
-        self._write_json(self.problems_file, data)
+        with state_store.lock:
+            # Generate new ID
+            problem_ids = [int(k) for k in state_store.keys('problems')]
+            problem_data['id'] = max(problem_ids) + 1 if problem_ids else 1
+            state_store.put('problems', problem_data['id'], problem_data)
         return problem_data
 
     # User Operations
     def get_all_users(self) -> Dict[str, Dict]:
-        data = self._read_json(self.users_file)
-        return data.get('users', {})
+        return state_store.items('users')
 
     def get_user_by_id(self, user_id: str) -> Optional[Dict]:
-        data = self._read_json(self.users_file)
-        users = data.get('users', {})
-        return users.get(user_id)
+        return state_store.get('users', user_id)
 
     def update_user(self, user_id: str, user_data: Dict) -> Optional[Dict]:
-        data = self._read_json(self.users_file)
-        users = data.get('users', {})
-        if user_id in users:
-            users[user_id].update(user_data)
-        else:
-            users[user_id] = user_data
-        data['users'] = users
-        self._write_json(self.users_file, data)
-        return users.get(user_id)
+        state_store.merge('users', user_id, user_data)
+        profile_cache.invalidate(str(user_id))
+        return state_store.get('users', user_id)
+
+    def delete_user(self, user_id: str) -> None:
+        """Remove a user's profile and stats, e.g. after handing the user to another node."""
+        with state_store.lock:
+            state_store.delete('users', user_id)
+            state_store.delete('stats', user_id)
+        profile_cache.invalidate(str(user_id))
+        stats_cache.invalidate(str(user_id))
 
     # User Answers Operations
     def get_user_answers(self, user_id: str) -> Dict:
-        data = self._read_json(self.answers_file)
-        return data.get(user_id, {})
+        return answer_store.get_user_answers(user_id)
 
     def save_answer(self, user_id: str, problem_id: int, answer_data: Dict) -> None:
         """Save a user's answer for a problem"""
-        data = self._read_json(self.answers_file)
-        if user_id not in data:
-            data[user_id] = {}
-        
-        data[user_id][str(problem_id)] = answer_data
-        self._write_json(self.answers_file, data)
-        
-        # Update problem stats after saving answer
-        stats = self.get_problem_stats(problem_id)
-        problem_stats = self._read_json(self.problem_stats_file)
-        problem_stats[str(problem_id)] = stats
-        self._write_json(self.problem_stats_file, problem_stats)
+        answer_store.save_answer(user_id, problem_id, answer_data)
 
     # User Stats Operations
     def get_user_stats(self, user_id: str) -> Optional[Dict]:
-        data = self._read_json(self.stats_file)
-        return data.get(user_id, {
+        stats = state_store.get('stats', user_id)
+        if stats is not None:
+            return stats
+        return {
             'stats': {
                 'problemsSolved': 0,
                 'accuracyRate': 0,
@@ -102,28 +92,26 @@ class DatabaseHandler:
                 'lastUpdated': datetime.now().isoformat()
             },
             'achievements': []
-        })
+        }
 
     def update_user_stats(self, user_id: str, stats: Dict) -> Dict:
-        data = self._read_json(self.stats_file)
-        if user_id not in data:
-            data[user_id] = {}
-        data[user_id]['stats'] = stats
-        data[user_id]['achievements'] = data[user_id].get('achievements', [])
-        self._write_json(self.stats_file, data)
-        return data[user_id]
+        def update(entry):
+            entry['stats'] = stats
+            entry['achievements'] = entry.get('achievements', [])
+        try:
+            return state_store.update('stats', user_id, update)
+        finally:
+            stats_cache.invalidate(str(user_id))
 
     def get_problem_stats(self, problem_id: int) -> Dict:
         """Get statistics for a specific problem"""
-        answers = self._read_json(self.answers_file)
         total_attempts = 0
         correct_attempts = 0
         
-        for user_answers in answers.values():
-            if str(problem_id) in user_answers:
-                total_attempts += 1
-                if user_answers[str(problem_id)].get('is_correct'):
-                    correct_attempts += 1
+        for _, answer in answer_store.get_problem_answers(problem_id):
+            total_attempts += 1
+            if answer.get('is_correct'):
+                correct_attempts += 1
         
         return {
             'total_attempts': total_attempts,
@@ -132,9 +120,7 @@ class DatabaseHandler:
         }
 
     def get_specific_answer(self, user_id: str, problem_id: int) -> Optional[Dict]:
-        data = self._read_json(self.answers_file)
-        user_answers = data.get(user_id, {})
-        return user_answers.get(str(problem_id))
+        return answer_store.get_answer(user_id, problem_id)
 
     def get_reviews(self, problem_id: int) -> List[Dict]:
         """Get all reviews for a problem"""
@@ -156,19 +142,16 @@ class DatabaseHandler:
 
     def get_problem_submissions(self, problem_id: int) -> List[Dict]:
         """Get all submissions for a problem"""
-        answers = self._read_json(self.answers_file)
         submissions = []
         
-        for user_id, user_answers in answers.items():
-            if str(problem_id) in user_answers:
-                answer = user_answers[str(problem_id)]
-                submission = {
-                    'username': user_id,
-                    'answer': answer.get('answer'),
-                    'is_correct': answer.get('is_correct'),
-                    'timestamp': answer.get('timestamp')
-                }
-                submissions.append(submission)
+        for user_id, answer in answer_store.get_problem_answers(problem_id):
+            submission = {
+                'username': user_id,
+                'answer': answer.get('answer'),
+                'is_correct': answer.get('is_correct'),
+                'timestamp': answer.get('timestamp')
+            }
+            submissions.append(submission)
         
         # Sort by timestamp, most recent first
         submissions.sort(key=lambda x: x['timestamp'], reverse=True)
@@ -0,0 +1,341 @@
+"""In-memory primary store for problems, users and user stats.
+
+The whole dataset is held in dictionaries, so reads never touch disk.
+Mutations are appended to a write-ahead log before they are applied, and the
+log is periodically compacted into a snapshot::
+
+    data/state/snapshot.json      {"seq": N, "collections": {...}, "sources": {...}}
+    data/state/wal-<seq>.log      one JSON record per mutation
+
+On boot the snapshot is loaded and the WAL records after its sequence number
+are replayed, so start-up cost follows the snapshot size, not the history.
+The first boot imports the legacy problems.json, users.json and
+user_stats.json. One of those files is imported again if it changes
+afterwards, for example when data.py regenerates problems.json. A reimport
+is written through the WAL as puts and deletes, so listeners and replicas
+see it. It is refused, with a warning, once the collection has taken writes
+since its last import, because the file would silently overwrite them.
+
+How often the WAL is fsynced is set with the ``STATE_FSYNC`` environment
+variable:
+
+    always    fsync every record before the write returns
+    interval  fsync from a background thread every second (default)
+    never     leave flushing to the OS
+"""
+from typing import Any, Callable, Dict, List, Optional
+import copy
+import json
+import os
+import threading
+import time
+from logger import get_logger
+from config import DATA_DIR
+
+logger = get_logger(__name__)
+
+COLLECTIONS = ('problems', 'users', 'stats')
+FSYNC_POLICIES = ('always', 'interval', 'never')
+FSYNC_INTERVAL = 1.0
+SNAPSHOT_INTERVAL = 300.0
+# Compact early once this many bytes of WAL have built up
+SNAPSHOT_WAL_BYTES = 8 * 1024 * 1024
+
+
+def _import_problems(data) -> Dict[str, Dict]:
+    problems = data.get('problems', []) if isinstance(data, dict) else data
+    return {str(p['id']): p for p in problems if isinstance(p, dict) and 'id' in p}
+
+
+def _import_users(data) -> Dict[str, Dict]:
+    users = data.get('users', {}) if isinstance(data, dict) else data
+    # users.json has been written both as an id -> user mapping and as a list of users
+    if isinstance(users, list):
+        return {str(u['id']): u for u in users if isinstance(u, dict) and 'id' in u}
+    return {str(user_id): u for user_id, u in users.items() if isinstance(u, dict)}
+
+
+def _import_stats(data) -> Dict[str, Dict]:
+    return {str(k): v for k, v in data.items() if isinstance(v, dict)} if isinstance(data, dict) else {}
+
+
+LEGACY_SOURCES = {
+    'problems': ('problems.json', _import_problems),
+    'users': ('users.json', _import_users),
+    'stats': ('user_stats.json', _import_stats)
+}
+
+
+class StateStore:
+    def __init__(self, base_path: Optional[str] = None, fsync_policy: Optional[str] = None,
+                 read_only: bool = False):
+        self.base_path = base_path or DATA_DIR
+        self.state_dir = os.path.join(self.base_path, 'state')
+        self.snapshot_file = os.path.join(self.state_dir, 'snapshot.json')
+        self.fsync_policy = fsync_policy or os.environ.get('STATE_FSYNC', 'interval')
+        if self.fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"STATE_FSYNC must be one of {', '.join(FSYNC_POLICIES)}")
+        # Re-entrant so callers can hold it across a read-modify-write
+        self.lock = threading.RLock()
+        # Read-only stores (offline jobs beside a live server) recover state but never write
+        self.read_only = read_only
+        self._snapshot_lock = threading.Lock()
+        self._loaded = False
+        self._data: Dict[str, Dict[str, Any]] = {name: {} for name in COLLECTIONS}
+        # filename -> [mtime_ns, size, seq right after it was imported]
+        self._sources: Dict[str, List[int]] = {}
+        # collection -> seq of the last record applied to it
+        self._last_write: Dict[str, int] = {}
+        self._seq = 0
+        self._wal = None
+        self._wal_bytes = 0
+        self._dirty = False
+        self._last_snapshot = time.time()
+        self._listeners: List[Callable[[Dict], None]] = []
+
+    # Recovery
+    def load(self) -> None:
+        if self._loaded:
+            return
+        with self.lock:
+            if self._loaded:
+                return
+            if not self.read_only:
+                os.makedirs(self.state_dir, exist_ok=True)
+            snapshot_seq = 0
+            if os.path.exists(self.snapshot_file):
+                with open(self.snapshot_file, 'r') as f:
+                    snapshot = json.load(f)
+                snapshot_seq = snapshot['seq']
+                self._data.update(snapshot['collections'])
+                self._sources = snapshot.get('sources', {})
+                self._last_write = snapshot.get('last_write', {})
+            self._seq = snapshot_seq
+            for path in self._wal_segments():
+                self._replay(path, snapshot_seq)
+
+            if self.read_only:
+                # The live server reimports changed legacy files through the WAL, so replaying it is enough
+                self._loaded = True
+                return
+            self._open_wal()
+            self._loaded = True
+            reimported = self._import_changed_sources()
+            if reimported or not os.path.exists(self.snapshot_file):
+                self.snapshot()
+            threading.Thread(target=self._background_loop, daemon=True).start()
+
+    def _wal_segments(self) -> List[str]:
+        if not os.path.isdir(self.state_dir):
+            return []
+        names = sorted(n for n in os.listdir(self.state_dir) if n.startswith('wal-') and n.endswith('.log'))
+        return [os.path.join(self.state_dir, n) for n in names]
+
+    def _replay(self, path: str, after_seq: int) -> None:
+        good_offset = 0
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            # Compacted away by a live server while a read-only store was loading
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if self.read_only:
+                        break
+                    # Torn write at the tail from a crash; drop it so appends start clean
+                    logger.warning(f"Truncating partial WAL record in {os.path.basename(path)}")
+                    break
+                good_offset += len(line)
+                if record['seq'] > after_seq:
+                    self._apply(record)
+                    self._seq = record['seq']
+        if not self.read_only and good_offset != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good_offset)
+
+    def _import_changed_sources(self) -> List[str]:
+        reimported = []
+        for collection, (filename, importer) in LEGACY_SOURCES.items():
+            path = os.path.join(self.base_path, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            fingerprint = [stat.st_mtime_ns, stat.st_size]
+            previous = self._sources.get(filename)
+            if previous is not None and previous[:2] == fingerprint:
+                continue
+            imported_at = previous[2] if previous is not None and len(previous) > 2 else 0
+            if previous is not None and self._last_write.get(collection, 0) > imported_at:
+                logger.warning(f"{filename} changed but {collection} has been written since it was imported; "
+                               f"not reimporting it over those writes")
+                self._sources[filename] = fingerprint + [imported_at]
+                continue
+            try:
+                with open(path, 'r') as f:
+                    records = importer(json.load(f))
+            except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+                logger.exception(f"Error importing {filename}")
+                continue
+            current = self._data[collection]
+            for key, value in records.items():
+                if current.get(key) != value:
+                    self.put(collection, key, value)
+            for key in [key for key in current if key not in records]:
+                self.delete(collection, key)
+            self._sources[filename] = fingerprint + [self._seq]
+            reimported.append(collection)
+            logger.info(f"Imported {len(records)} {collection} from {filename}")
+        return reimported
+
+    # Write-ahead log
+    def _open_wal(self) -> None:
+        path = os.path.join(self.state_dir, f'wal-{self._seq + 1:012d}.log')
+        self._wal = open(path, 'ab')
+        self._wal_bytes = self._wal.tell()
+
+    def _apply(self, record: Dict) -> None:
+        collection = self._data[record['c']]
+        self._last_write[record['c']] = record['seq']
+        op = record['op']
+        if op == 'put':
+            collection[record['k']] = record['v']
+        elif op == 'merge':
+            collection[record['k']] = dict(collection.get(record['k'], {}), **record['v'])
+        elif op == 'delete':
+            collection.pop(record['k'], None)
+
+    def _log(self, op: str, collection: str, key, value=None) -> None:
+        if collection not in self._data:
+            raise KeyError(f'Unknown collection {collection}')
+        if self.read_only:
+            raise RuntimeError('State store was opened read-only')
+        self.load()
+        with self.lock:
+            record = {'seq': self._seq + 1, 'op': op, 'c': collection, 'k': str(key)}
+            if value is not None:
+                record['v'] = value
+            line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+            self._wal.write(line)
+            self._wal.flush()
+            if self.fsync_policy == 'always':
+                os.fsync(self._wal.fileno())
+            self._seq += 1
+            self._wal_bytes += len(line)
+            self._dirty = True
+            # The WAL holds its own serialized copy, so the in-memory value must not alias the caller's
+            record = json.loads(line)
+            self._apply(record)
+            for listener in self._listeners:
+                listener(record)
+
+    # Snapshots
+    def snapshot(self) -> None:
+        """Write a compact snapshot and drop the WAL segments it covers.
+
+        Only serialization and WAL rotation happen under the store lock; the
+        snapshot is written while writers carry on into the new WAL segment.
+        """
+        with self._snapshot_lock:
+            with self.lock:
+                payload = json.dumps({'seq': self._seq, 'collections': self._data, 'sources': self._sources,
+                                      'last_write': self._last_write}, separators=(',', ':'))
+                old_segments = self._wal_segments()
+                if self._wal is not None:
+                    if self.fsync_policy != 'never':
+                        os.fsync(self._wal.fileno())
+                    self._wal.close()
+                self._open_wal()
+                current = self._wal.name
+                self._last_snapshot = time.time()
+
+            tmp_file = self.snapshot_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.snapshot_file)
+            for path in old_segments:
+                if path != current:
+                    os.remove(path)
+
+    def _background_loop(self) -> None:
+        while True:
+            time.sleep(FSYNC_INTERVAL)
+            try:
+                with self.lock:
+                    if self.fsync_policy == 'interval' and self._dirty:
+                        os.fsync(self._wal.fileno())
+                        self._dirty = False
+                    due = self._wal_bytes >= SNAPSHOT_WAL_BYTES or (
+                        self._wal_bytes > 0 and time.time() - self._last_snapshot >= SNAPSHOT_INTERVAL)
+                if due:
+                    self.snapshot()
+            except Exception:
+                logger.exception("Error persisting state store")
+
+    # Public API
+    def add_listener(self, listener: Callable[[Dict], None]) -> None:
+        """Call ``listener`` with every WAL record as it is applied, under the store lock."""
+        self._listeners.append(listener)
+
+    def export(self) -> Dict:
+        """Consistent copy of every collection with the sequence number it reflects."""
+        self.load()
+        with self.lock:
+            return {'seq': self._seq, 'collections': copy.deepcopy(self._data)}
+
+    @property
+    def version(self) -> int:
+        """Sequence number of the last applied mutation."""
+        return self._seq
+
+    def get(self, collection: str, key) -> Optional[Dict]:
+        self.load()
+        with self.lock:
+            value = self._data[collection].get(str(key))
+            return copy.deepcopy(value) if value is not None else None
+
+    def values(self, collection: str) -> List[Dict]:
+        """Every record in a collection, for read-only use.
+
+        Records are shallow copies, so listing stays cheap; nested values are
+        shared with the store and must not be modified.
+        """
+        self.load()
+        with self.lock:
+            return [dict(value) for value in self._data[collection].values()]
+
+    def items(self, collection: str) -> Dict[str, Dict]:
+        self.load()
+        with self.lock:
+            return copy.deepcopy(self._data[collection])
+
+    def keys(self, collection: str) -> List[str]:
+        self.load()
+        with self.lock:
+            return list(self._data[collection])
+
+    def put(self, collection: str, key, value: Dict) -> None:
+        self._log('put', collection, key, value)
+
+    def merge(self, collection: str, key, fields: Dict) -> None:
+        """Shallow-update one record, creating it if needed."""
+        self._log('merge', collection, key, fields)
+
+    def delete(self, collection: str, key) -> None:
+        self._log('delete', collection, key)
+
+    def update(self, collection: str, key, update: Callable[[Dict], Optional[Dict]]) -> Dict:
+        """Read-modify-write one record atomically; ``update`` edits a copy in place."""
+        with self.lock:
+            value = self.get(collection, key) or {}
+            update(value)
+            self.put(collection, key, value)
+            return value
+
+
+state_store = StateStore()
@@ -0,0 +1,567 @@
+"""Columnar, memory-mapped copy of submissions.json for analytics.
+
+Submissions are kept as fixed-width NumPy columns so aggregations are
+vectorized scans instead of per-object JSON parsing::
+
+    data/columnar/manifest.json
+    data/columnar/seg-<seq>/<column>.npy
+
+New submissions go into an in-memory write buffer which is sealed into an
+immutable segment once it is large enough or old enough. Sealed segments are
+opened read-only with ``mmap``. submissions.json stays the source of truth: the
+manifest records how many of its records have been sealed, and anything after
+that is re-read into the buffer on startup. ``write`` appends new submissions
+to both, rewriting only the end of submissions.json, so a write costs the same
+however long the history is.
+
+Rows are only ever removed all at once for a set of users, when they are
+handed off to another node (``remove_users``). That rewrites the affected
+segments and bumps ``generation``, so anything holding row positions, such as
+a replica or an aggregate's watermark, knows to start over.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from logger import get_logger
+from config import DATA_DIR
+
+logger = get_logger(__name__)
+
+COLUMNS = {
+    'user': np.int32,        # index into the user dictionary
+    'problem': np.int32,
+    'timestamp': np.int64,   # microseconds since the epoch
+    'correct': np.bool_,
+    'time_taken': np.int32,  # seconds, MISSING when not recorded
+    'attempt': np.int32,     # attempt number, MISSING when not recorded
+    'answer': np.int32       # index into the answer dictionary
+}
+MISSING = -1
+INT32 = np.iinfo(np.int32)
+SEAL_ROWS = 65536
+SEAL_INTERVAL = 60.0
+EPOCH = datetime(1970, 1, 1)
+
+
+def naive_utc(dt: datetime) -> datetime:
+    """``dt`` without its timezone, converted to UTC first if it had one."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def to_micros(timestamp: str) -> int:
+    return (naive_utc(datetime.fromisoformat(timestamp)) - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros: int) -> str:
+    return (EPOCH + timedelta(microseconds=int(micros))).isoformat()
+
+
+def append_json_array(path: str, items: List[Dict]) -> None:
+    """Append ``items`` to the JSON array in ``path``, formatted as ``json.dump(indent=2)`` would.
+
+    Only the closing bracket and what follows it are rewritten. A file that does
+    not end in a JSON array is read and rewritten whole instead.
+    """
+    if not items:
+        return
+    encoded = b',\n  '.join(json.dumps(item, indent=2).replace('\n', '\n  ').encode('utf-8') for item in items)
+    try:
+        with open(path, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            start = max(0, end - 4096)
+            f.seek(start)
+            body = f.read().rstrip()
+            if body.endswith(b']'):
+                body = body[:-1].rstrip()
+                if body:
+                    # A value never ends in '[', so that is the array's own opening bracket
+                    separator = b'\n  ' if body.endswith(b'[') else b',\n  '
+                    f.seek(start + len(body))
+                    f.write(separator + encoded + b'\n]')
+                    f.truncate()
+                    return
+    except FileNotFoundError:
+        pass
+    existing = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            existing = json.load(f)
+    with open(path, 'w') as f:
+        json.dump(existing + list(items), f, indent=2)
+
+
+class SubmissionColumns:
+    def __init__(self):
+        self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.submissions_file = os.path.join(DATA_DIR, 'submissions.json')
+        self.root = os.path.join(DATA_DIR, 'columnar')
+        self.manifest_file = os.path.join(self.root, 'manifest.json')
+        self._lock = threading.Lock()
+        # Held by every writer across its change to submissions.json, then its append here
+        self.source_lock = threading.RLock()
+        self._loaded = False
+        self._manifest = {'segments': [], 'next_segment': 1, 'source_offset': 0, 'users': [], 'answers': [],
+                          'generation': 0, 'removals': []}
+        self._segments: List[Dict[str, np.ndarray]] = []
+        self._user_codes: Dict[str, int] = {}
+        self._answer_codes: Dict[str, int] = {}
+        self._buffer: Dict[str, List] = {name: [] for name in COLUMNS}
+        self._buffer_started: Optional[float] = None
+        # Source records taken into the buffer but not yet sealed
+        self._buffered_source_rows = 0
+        self._buffer_arrays: Optional[Dict[str, np.ndarray]] = None
+        # Bumped on every change, for caches of query results
+        self.version = 0
+        # Bumped whenever rows are removed, which invalidates row positions taken before
+        self.generation = 0
+        # Sealed segments never change, so their per-problem tallies are computed once
+        self._segment_problem_counts: Dict[str, np.ndarray] = {}
+        self._listeners: List[Callable[[], None]] = []
+
+    # Loading
+    def load(self) -> None:
+        """Open sealed segments and buffer the submissions written since; call before new submissions land."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            if os.path.exists(self.manifest_file):
+                with open(self.manifest_file, 'r') as f:
+                    self._manifest = json.load(f)
+            self.generation = self._manifest.get('generation', 0)
+            self._user_codes = {user: i for i, user in enumerate(self._manifest['users'])}
+            self._answer_codes = {answer: i for i, answer in enumerate(self._manifest['answers'])}
+            self._segments = [self._open_segment(segment['name']) for segment in self._manifest['segments']]
+
+            try:
+                with open(self.submissions_file, 'r') as f:
+                    submissions = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                submissions = []
+            if not isinstance(submissions, list):
+                submissions = []
+            offset = self._manifest['source_offset']
+            if offset > len(submissions):
+                logger.warning("submissions.json is shorter than the columnar store, rebuilding it")
+                self._reset_locked()
+                offset = 0
+            for submission in submissions[offset:]:
+                self._append_locked(submission)
+            if self._buffered_source_rows >= SEAL_ROWS:
+                self._seal_locked()
+
+            threading.Thread(target=self._sealer_loop, daemon=True).start()
+            self._loaded = True
+
+    def _reset_locked(self) -> None:
+        for segment in self._manifest['segments']:
+            shutil.rmtree(os.path.join(self.root, segment['name']), ignore_errors=True)
+        self._manifest = {'segments': [], 'next_segment': 1, 'source_offset': 0, 'users': [], 'answers': [],
+                          'generation': self.generation, 'removals': self._manifest.get('removals', [])}
+        self._segments = []
+        self._user_codes = {}
+        self._answer_codes = {}
+        self._segment_problem_counts = {}
+        self.version += 1
+
+    def _open_segment(self, name: str) -> Dict[str, np.ndarray]:
+        path = os.path.join(self.root, name)
+        return {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r') for column in COLUMNS}
+
+    # Writes
+    def _encode(self, dictionary: List[str], codes: Dict[str, int], value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = len(dictionary)
+            dictionary.append(value)
+            codes[value] = code
+        return code
+
+    @staticmethod
+    def _optional_int(value) -> int:
+        # Anything an int32 column cannot hold (huge ints, inf, NaN) is not recorded
+        try:
+            number = int(value) if value is not None else MISSING
+        except (TypeError, ValueError, OverflowError):
+            return MISSING
+        return number if INT32.min <= number <= INT32.max else MISSING
+
+    def _append_locked(self, submission: Dict) -> None:
+        self._buffered_source_rows += 1
+        self.version += 1
+        if self._buffer_started is None:
+            self._buffer_started = time.time()
+        try:
+            problem_id = int(submission['problem_id'])
+            timestamp = to_micros(submission['timestamp'])
+            if not 0 <= problem_id <= INT32.max:
+                raise ValueError(problem_id)
+        except (KeyError, TypeError, ValueError):
+            # Not analysable; it still counts as consumed from the source
+            return
+        buffer = self._buffer
+        buffer['user'].append(self._encode(self._manifest['users'], self._user_codes, str(submission.get('user_id', ''))))
+        buffer['problem'].append(problem_id)
+        buffer['timestamp'].append(timestamp)
+        buffer['correct'].append(bool(submission.get('is_correct', False)))
+        buffer['time_taken'].append(self._optional_int(submission.get('time_taken')))
+        buffer['attempt'].append(self._optional_int(submission.get('attempts')))
+        buffer['answer'].append(self._encode(self._manifest['answers'], self._answer_codes, str(submission.get('answer', ''))))
+        self._buffer_arrays = None
+
+    def append(self, submission: Dict) -> None:
+        """Add a submission that has just been appended to submissions.json."""
+        self.load()
+        with self._lock:
+            self._append_locked(submission)
+            if self._buffered_source_rows >= SEAL_ROWS:
+                self._seal_locked()
+        for listener in self._listeners:
+            listener()
+
+    def write(self, submissions: List[Dict]) -> None:
+        """Append new submissions to submissions.json, then to the columnar store."""
+        with self.source_lock:
+            append_json_array(self.submissions_file, submissions)
+            for submission in submissions:
+                self.append(submission)
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Call ``listener`` after every append, e.g. to wake replication streams."""
+        self._listeners.append(listener)
+
+    def seal(self) -> None:
+        with self._lock:
+            self._seal_locked()
+
+    def _seal_locked(self) -> None:
+        """Write the buffer out as an immutable segment.
+
+        A small trailing segment is merged into the new one instead of kept, so
+        periodic seals under light traffic do not pile up tiny segments.
+        """
+        if self._buffered_source_rows == 0:
+            return
+        columns = self._buffer_as_arrays()
+        segments = list(self._manifest['segments'])
+        replaced = None
+        if segments and segments[-1]['rows'] < SEAL_ROWS:
+            replaced = segments.pop()
+            tail = self._segments[-1]
+            columns = {name: np.concatenate([tail[name], columns[name]]) for name in COLUMNS}
+
+        rows = len(columns['problem'])
+        new_segments = self._segments[:-1] if replaced else list(self._segments)
+        if rows:
+            segment, opened = self._write_segment(columns)
+            segments.append(segment)
+            new_segments.append(opened)
+
+        manifest = dict(self._manifest, segments=segments,
+                        source_offset=self._manifest['source_offset'] + self._buffered_source_rows)
+        self._save_manifest(manifest)
+
+        self._manifest = manifest
+        self._segments = new_segments
+        if replaced:
+            # Open maps of the old segment stay valid after the files are unlinked
+            shutil.rmtree(os.path.join(self.root, replaced['name']), ignore_errors=True)
+            self._segment_problem_counts.pop(replaced['name'], None)
+        self._buffer = {name: [] for name in COLUMNS}
+        self._buffer_arrays = None
+        self._buffer_started = None
+        self._buffered_source_rows = 0
+
+    def _sealer_loop(self) -> None:
+        while True:
+            time.sleep(SEAL_INTERVAL)
+            try:
+                with self._lock:
+                    if self._buffer_started is not None and time.time() - self._buffer_started >= SEAL_INTERVAL:
+                        self._seal_locked()
+            except Exception:
+                logger.exception("Error sealing submission segment")
+
+    def _write_segment(self, columns: Dict[str, np.ndarray]) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        name = f"seg-{self._manifest['next_segment']:06d}"
+        tmp_path = os.path.join(self.root, name + '.tmp')
+        os.makedirs(tmp_path, exist_ok=True)
+        for column, values in columns.items():
+            np.save(os.path.join(tmp_path, f'{column}.npy'), values)
+        os.replace(tmp_path, os.path.join(self.root, name))
+        self._manifest['next_segment'] += 1
+        return {'name': name, 'rows': len(columns['problem'])}, self._open_segment(name)
+
+    def _save_manifest(self, manifest: Dict) -> None:
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_file, self.manifest_file)
+
+    def remove_users(self, user_ids: Iterable[str], generation: Optional[int] = None) -> int:
+        """Delete every submission by ``user_ids`` from submissions.json and the columnar store.
+
+        Used once users have been handed off to another node. Segments holding
+        their rows are rewritten, so row positions change: ``generation`` goes
+        up (or is set to the primary's, on a replica) and the removal is kept
+        in the manifest for replicas that have not applied it yet. Returns the
+        number of submissions removed.
+        """
+        self.load()
+        users = {str(u) for u in user_ids}
+        with self.source_lock:
+            try:
+                with open(self.submissions_file, 'r') as f:
+                    submissions = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                submissions = []
+            with self._lock:
+                sealed = self._manifest['source_offset']
+                removed = [i for i, s in enumerate(submissions) if str(s.get('user_id', '')) in users]
+                removed_sealed = sum(1 for i in removed if i < sealed)
+                if removed:
+                    tmp_file = self.submissions_file + '.tmp'
+                    with open(tmp_file, 'w') as f:
+                        json.dump([s for s in submissions if str(s.get('user_id', '')) not in users], f, indent=2)
+                    os.replace(tmp_file, self.submissions_file)
+
+                codes = np.array([c for c in (self._user_codes.get(u) for u in users) if c is not None], dtype=np.int32)
+                segments, opened, dropped = [], [], []
+                for segment, columns in zip(self._manifest['segments'], self._segments):
+                    keep = ~np.isin(columns['user'], codes)
+                    if keep.all():
+                        segments.append(segment)
+                        opened.append(columns)
+                        continue
+                    dropped.append(segment['name'])
+                    if keep.any():
+                        segment, columns = self._write_segment({name: values[keep] for name, values in columns.items()})
+                        segments.append(segment)
+                        opened.append(columns)
+                keep = ~np.isin(np.array(self._buffer['user'], dtype=np.int32), codes)
+                if generation is None and not removed and not dropped and keep.all():
+                    return 0
+                self._buffer = {name: [v for v, k in zip(values, keep.tolist()) if k]
+                                for name, values in self._buffer.items()}
+                self._buffer_arrays = None
+                self._buffered_source_rows -= len(removed) - removed_sealed
+
+                self.generation = self._manifest.get('generation', 0) + 1 if generation is None else generation
+                removals = self._manifest.get('removals', []) + [{'generation': self.generation, 'users': sorted(users)}]
+                manifest = dict(self._manifest, segments=segments, source_offset=sealed - removed_sealed,
+                                generation=self.generation, removals=removals)
+                self._save_manifest(manifest)
+                self._manifest = manifest
+                self._segments = opened
+                for name in dropped:
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                    self._segment_problem_counts.pop(name, None)
+                self.version += 1
+        for listener in self._listeners:
+            listener()
+        return len(removed)
+
+    def removals_since(self, generation: int) -> List[Dict]:
+        """Removals made after ``generation``, oldest first."""
+        self.load()
+        with self._lock:
+            return [r for r in self._manifest.get('removals', []) if r['generation'] > generation]
+
+    # Reads
+    def _buffer_as_arrays(self) -> Dict[str, np.ndarray]:
+        if self._buffer_arrays is None:
+            self._buffer_arrays = {name: np.array(values, dtype=dtype)
+                                   for (name, dtype), values in zip(COLUMNS.items(), self._buffer.values())}
+        return self._buffer_arrays
+
+    def chunks(self) -> List[Dict[str, np.ndarray]]:
+        """Consistent view of every segment plus the write buffer, as column arrays."""
+        return [chunk for _, chunk in self.named_chunks()]
+
+    def named_chunks(self) -> List[Tuple[Optional[str], Dict[str, np.ndarray]]]:
+        """Like ``chunks`` but paired with the segment name, or None for the write buffer."""
+        self.load()
+        with self._lock:
+            chunks = [(segment['name'], columns) for segment, columns in zip(self._manifest['segments'], self._segments)]
+            if self._buffer['problem']:
+                chunks.append((None, self._buffer_as_arrays()))
+            return chunks
+
+    def row_count(self) -> int:
+        return sum(len(chunk['problem']) for chunk in self.chunks())
+
+    def submission_at(self, chunk: Dict[str, np.ndarray], row: int) -> Dict:
+        """Rebuild the submission record behind one row of a chunk."""
+        submission = {
+            'user_id': self.user_name(int(chunk['user'][row])),
+            'problem_id': int(chunk['problem'][row]),
+            'answer': self.answer_text(int(chunk['answer'][row])),
+            'is_correct': bool(chunk['correct'][row]),
+            'timestamp': from_micros(int(chunk['timestamp'][row]))
+        }
+        if chunk['time_taken'][row] != MISSING:
+            submission['time_taken'] = int(chunk['time_taken'][row])
+        if chunk['attempt'][row] != MISSING:
+            submission['attempts'] = int(chunk['attempt'][row])
+        return submission
+
+    def iter_submissions(self, start: int = 0, limit: Optional[int] = None) -> Iterator[Dict]:
+        """Submission records from row ``start`` on, in the order they were stored."""
+        offset = 0
+        for chunk in self.chunks():
+            size = len(chunk['problem'])
+            if offset + size > start:
+                for row in range(max(start - offset, 0), size):
+                    if limit is not None:
+                        if limit <= 0:
+                            return
+                        limit -= 1
+                    yield self.submission_at(chunk, row)
+            offset += size
+
+    def submission_keys(self, user_ids) -> Set[Tuple[str, int, int]]:
+        """``(user_id, problem_id, timestamp in microseconds)`` of every stored submission by ``user_ids``."""
+        codes = [c for c in (self.user_code(u) for u in user_ids) if c is not None]
+        keys: Set[Tuple[str, int, int]] = set()
+        if not codes:
+            return keys
+        codes = np.array(codes, dtype=np.int32)
+        for chunk in self.chunks():
+            rows = np.flatnonzero(np.isin(chunk['user'], codes))
+            keys.update((self.user_name(user), problem, timestamp) for user, problem, timestamp in zip(
+                chunk['user'][rows].tolist(), chunk['problem'][rows].tolist(), chunk['timestamp'][rows].tolist()))
+        return keys
+
+    def latest_answers(self, user_ids) -> Dict[Tuple[str, int], Dict]:
+        """The last stored answer of each ``(user_id, problem_id)`` among ``user_ids``."""
+        codes = [c for c in (self.user_code(u) for u in user_ids) if c is not None]
+        latest: Dict[Tuple[str, int], Dict] = {}
+        if not codes:
+            return latest
+        codes = np.array(codes, dtype=np.int32)
+        for chunk in self.chunks():
+            rows = np.flatnonzero(np.isin(chunk['user'], codes))
+            for user, problem, answer, correct in zip(chunk['user'][rows].tolist(), chunk['problem'][rows].tolist(),
+                                                      chunk['answer'][rows].tolist(), chunk['correct'][rows].tolist()):
+                latest[(self.user_name(user), problem)] = {'answer': self.answer_text(answer), 'is_correct': correct}
+        return latest
+
+    def user_code(self, user_id: str) -> Optional[int]:
+        self.load()
+        return self._user_codes.get(str(user_id))
+
+    def user_name(self, code: int) -> str:
+        return self._manifest['users'][code]
+
+    def answer_text(self, code: int) -> str:
+        return self._manifest['answers'][code]
+
+    def problem_accuracy(self) -> Dict[int, Dict]:
+        """Attempts, correct count and accuracy for every problem in a single scan."""
+        counts = np.zeros(0, dtype=np.int64)
+        for name, chunk in self.named_chunks():
+            chunk_counts = self._segment_problem_counts.get(name) if name else None
+            if chunk_counts is None:
+                # problem * 2 + correct keeps both tallies in one bincount
+                chunk_counts = np.bincount((chunk['problem'] << 1) | chunk['correct'])
+                if name:
+                    self._segment_problem_counts[name] = chunk_counts
+            if len(chunk_counts) > len(counts):
+                chunk_counts = chunk_counts.copy()
+                chunk_counts[:len(counts)] += counts
+                counts = chunk_counts
+            else:
+                counts[:len(chunk_counts)] += chunk_counts
+        if len(counts) % 2:
+            counts = np.append(counts, 0)
+        pairs = counts.reshape(-1, 2)
+        result = {}
+        for problem_id in np.nonzero(pairs.sum(axis=1))[0]:
+            wrong, correct = int(pairs[problem_id, 0]), int(pairs[problem_id, 1])
+            attempts = wrong + correct
+            result[int(problem_id)] = {
+                'attempts': attempts,
+                'correct': correct,
+                'accuracy': round(correct / attempts * 100, 2)
+            }
+        return result
+
+    def problem_summary(self, problem_id: int) -> Dict:
+        attempts = correct = 0
+        time_total = time_count = attempt_total = attempt_count = 0
+        users = []
+        answer_counts = np.zeros(0, dtype=np.int64)
+        for chunk in self.chunks():
+            mask = chunk['problem'] == problem_id
+            if not mask.any():
+                continue
+            attempts += int(mask.sum())
+            correct += int(np.count_nonzero(chunk['correct'][mask]))
+            time_taken = chunk['time_taken'][mask]
+            time_taken = time_taken[time_taken != MISSING]
+            time_total += int(time_taken.sum())
+            time_count += len(time_taken)
+            attempt = chunk['attempt'][mask]
+            attempt = attempt[attempt != MISSING]
+            attempt_total += int(attempt.sum())
+            attempt_count += len(attempt)
+            users.append(chunk['user'][mask])
+            chunk_answers = np.bincount(chunk['answer'][mask])
+            if len(chunk_answers) > len(answer_counts):
+                chunk_answers[:len(answer_counts)] += answer_counts
+                answer_counts = chunk_answers
+            else:
+                answer_counts[:len(chunk_answers)] += chunk_answers
+        return {
+            'problem_id': problem_id,
+            'attempts': attempts,
+            'correct': correct,
+            'accuracy': round(correct / attempts * 100, 2) if attempts else 0,
+            'unique_users': int(len(np.unique(np.concatenate(users)))) if users else 0,
+            'avg_time_taken': round(time_total / time_count, 2) if time_count else None,
+            'avg_attempts': round(attempt_total / attempt_count, 2) if attempt_count else None,
+            'answer_distribution': {self.answer_text(code): int(answer_counts[code])
+                                    for code in np.nonzero(answer_counts)[0]}
+        }
+
+    def user_summary(self, user_id: str, recent: int = 5) -> Dict:
+        """Submission totals, solved problems and most recent submissions for one user."""
+        self.load()
+        code = self._user_codes.get(str(user_id))
+        total = correct = 0
+        solved = set()
+        latest: List[Tuple[int, int, bool]] = []
+        if code is not None:
+            for chunk in self.chunks():
+                mask = chunk['user'] == code
+                if not mask.any():
+                    continue
+                problems = chunk['problem'][mask]
+                is_correct = chunk['correct'][mask]
+                timestamps = chunk['timestamp'][mask]
+                total += len(problems)
+                correct += int(np.count_nonzero(is_correct))
+                solved.update(np.unique(problems[is_correct]).tolist())
+                top = np.argsort(timestamps)[-recent:] if recent else []
+                latest.extend(zip(timestamps[top].tolist(), problems[top].tolist(), is_correct[top].tolist()))
+        latest.sort(reverse=True)
+        return {
+            'total': total,
+            'correct': correct,
+            'solved_problems': sorted(solved),
+            'recent': [{'problem_id': problem_id, 'timestamp': from_micros(ts), 'is_correct': ok}
+                       for ts, problem_id, ok in latest[:recent]]
+        }
+
+
+submission_store = SubmissionColumns()
@@ -0,0 +1,275 @@
+"""Offline per-problem, per-topic, per-day and per-cohort reports.
+
+Usage: python generate_reports.py [--full] [--workers N] [--output DIR]
+
+The sealed segments of the columnar submission store are split into row
+ranges, and the answer store is split by shard. A multiprocessing pool
+computes partial aggregates for each piece, and the parent merges them into
+running totals. Those totals are kept in <output>/state.json together with a
+watermark: how many submission rows have been counted so far. The next run
+only scans rows past the watermark. --full starts again from zero.
+
+Per-user answer figures (users who attempted or solved a problem) depend on
+each user's latest answer rather than on history. They are recomputed from
+every shard on each run.
+
+Safe to run next to the live server: the job only reads the stores.
+"""
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from database.answer_store import AnswerStore, answer_store
+from database.state_store import StateStore
+from database.submission_store import EPOCH, MISSING, SubmissionColumns
+from config import DATA_DIR
+
+TASK_ROWS = 1 << 20
+MICROS_PER_DAY = 86400 * 1000000
+UNKNOWN_COHORT = 'unknown'
+# problems: attempts, correct, time_sum, time_count, attempt_sum, attempt_count
+PROBLEM_FIELDS = 6
+
+
+def _add(totals: Dict, key, values) -> None:
+    current = totals.get(key)
+    if current is None:
+        totals[key] = list(values)
+    else:
+        for i, value in enumerate(values):
+            current[i] += value
+
+
+# Workers
+def aggregate_submissions(task: Tuple[str, int, int, str]) -> Dict:
+    """Partial aggregates for rows ``start:stop`` of one sealed segment."""
+    segment_dir, start, stop, cohort_map_path = task
+    load = lambda column: np.load(os.path.join(segment_dir, f'{column}.npy'), mmap_mode='r')[start:stop]
+    problem, correct, timestamp = load('problem'), load('correct'), load('timestamp')
+    time_taken, attempt, user = load('time_taken'), load('attempt'), load('user')
+    cohort_map = np.load(cohort_map_path, mmap_mode='r')
+
+    size = int(problem.max()) + 1
+    has_time = time_taken != MISSING
+    has_attempt = attempt != MISSING
+    columns = [
+        np.bincount(problem, minlength=size),
+        np.bincount(problem[correct], minlength=size),
+        np.bincount(problem[has_time], weights=time_taken[has_time], minlength=size),
+        np.bincount(problem[has_time], minlength=size),
+        np.bincount(problem[has_attempt], weights=attempt[has_attempt], minlength=size),
+        np.bincount(problem[has_attempt], minlength=size)
+    ]
+    problems = {int(p): [int(c[p]) for c in columns] for p in np.nonzero(columns[0])[0]}
+
+    day = timestamp // MICROS_PER_DAY
+    first_day = int(day.min())
+    day = day - first_day
+    day_counts = np.bincount(day)
+    day_correct = np.bincount(day[correct], minlength=len(day_counts))
+    days = {first_day + int(d): [int(day_counts[d]), int(day_correct[d])] for d in np.nonzero(day_counts)[0]}
+
+    # Users newer than the cohort map fall into its last slot, the unknown cohort
+    cohort = cohort_map[np.minimum(user, len(cohort_map) - 1)]
+    cohort_counts = np.bincount(cohort, minlength=len(cohort_map))
+    cohort_correct = np.bincount(cohort[correct], minlength=len(cohort_map))
+    cohorts = {int(c): [int(cohort_counts[c]), int(cohort_correct[c])] for c in np.nonzero(cohort_counts)[0]}
+
+    return {'rows': stop - start, 'problems': problems, 'days': days, 'cohorts': cohorts}
+
+
+def aggregate_answers(shard_dir: str) -> Dict[str, List[int]]:
+    """Users who attempted and solved each problem, from one answer shard."""
+    problems: Dict[str, List[int]] = {}
+    for _, answers in AnswerStore.iter_shard(shard_dir):
+        for problem_id, answer in answers.items():
+            _add(problems, problem_id, [1, 1 if answer.get('is_correct') else 0])
+    return problems
+
+
+# Planning
+def plan_tasks(store: SubmissionColumns, watermark: int, cohort_map_path: str) -> Tuple[List, int]:
+    """Row-range tasks covering sealed rows past ``watermark``, and the new watermark."""
+    try:
+        with open(store.manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        print('No columnar submission store yet; start the server once to build it')
+        return [], watermark
+    tasks = []
+    offset = 0
+    for segment in manifest['segments']:
+        segment_end = offset + segment['rows']
+        start = max(watermark, offset)
+        while start < segment_end:
+            stop = min(start + TASK_ROWS, segment_end)
+            tasks.append((os.path.join(store.root, segment['name']), start - offset, stop - offset, cohort_map_path))
+            start = stop
+        offset = segment_end
+    return tasks, offset
+
+
+def build_cohorts(store: SubmissionColumns, users: Dict[str, Dict], path: str) -> List[str]:
+    """Write the user-code -> cohort-code map for workers; cohorts are join months."""
+    try:
+        with open(store.manifest_file, 'r') as f:
+            user_names = json.load(f)['users']
+    except FileNotFoundError:
+        user_names = []
+    names: List[str] = []
+    codes: Dict[str, int] = {}
+
+    def code_for(cohort: str) -> int:
+        if cohort not in codes:
+            codes[cohort] = len(names)
+            names.append(cohort)
+        return codes[cohort]
+
+    mapping = [code_for(str(users.get(u, {}).get('joinedDate') or '')[:7] or UNKNOWN_COHORT) for u in user_names]
+    mapping.append(code_for(UNKNOWN_COHORT))
+    np.save(path, np.array(mapping, dtype=np.int32))
+    return names
+
+
+# Reports
+def write_report(output: str, name: str, payload: Dict) -> None:
+    tmp_file = os.path.join(output, name + '.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(payload, f, separators=(',', ':'))
+    os.replace(tmp_file, os.path.join(output, name))
+
+
+def accuracy(correct: int, total: int) -> float:
+    return round(correct / total * 100, 2) if total else 0
+
+
+def write_reports(output: str, totals: Dict, answer_totals: Dict, problems: Dict[str, Dict],
+                  users: Dict[str, Dict], header: Dict) -> None:
+    problem_rows = []
+    topics: Dict[Tuple[str, str], List[int]] = {}
+    for problem_id in sorted(set(totals['problems']) | set(answer_totals) | set(problems), key=int):
+        attempts, correct, time_sum, time_n, attempt_sum, attempt_n = totals['problems'].get(problem_id, [0] * PROBLEM_FIELDS)
+        users_attempted, users_solved = answer_totals.get(problem_id, [0, 0])
+        problem = problems.get(problem_id, {})
+        subject = problem.get('subject') or problem.get('category') or 'General'
+        topic = problem.get('topic') or subject
+        problem_rows.append({
+            'id': int(problem_id),
+            'title': problem.get('title', ''),
+            'subject': subject,
+            'topic': topic,
+            'difficulty': problem.get('difficulty'),
+            'attempts': attempts,
+            'correct': correct,
+            'accuracy': accuracy(correct, attempts),
+            'avg_time_taken': round(time_sum / time_n, 2) if time_n else None,
+            'avg_attempts': round(attempt_sum / attempt_n, 2) if attempt_n else None,
+            'users_attempted': users_attempted,
+            'users_solved': users_solved
+        })
+        _add(topics, (subject, topic), [1 if problem else 0, attempts, correct, users_solved])
+
+    topic_rows = [{
+        'subject': subject,
+        'topic': topic,
+        'problems': count,
+        'attempts': attempts,
+        'correct': correct,
+        'accuracy': accuracy(correct, attempts),
+        'solves': solves
+    } for (subject, topic), (count, attempts, correct, solves) in sorted(topics.items())]
+
+    day_rows = [{
+        'date': (EPOCH + timedelta(days=int(day))).date().isoformat(),
+        'submissions': n,
+        'correct': correct,
+        'accuracy': accuracy(correct, n)
+    } for day, (n, correct) in sorted(totals['days'].items(), key=lambda item: int(item[0]))]
+
+    cohort_users: Dict[str, int] = {}
+    for user in users.values():
+        cohort = str(user.get('joinedDate') or '')[:7] or UNKNOWN_COHORT
+        cohort_users[cohort] = cohort_users.get(cohort, 0) + 1
+    cohort_rows = [{
+        'cohort': cohort,
+        'users': cohort_users.get(cohort, 0),
+        'submissions': n,
+        'correct': correct,
+        'accuracy': accuracy(correct, n)
+    } for cohort, (n, correct) in sorted(totals['cohorts'].items())]
+
+    write_report(output, 'problems.json', dict(header, problems=problem_rows))
+    write_report(output, 'topics.json', dict(header, topics=topic_rows))
+    write_report(output, 'daily.json', dict(header, days=day_rows))
+    write_report(output, 'cohorts.json', dict(header, cohorts=cohort_rows))
+
+
+def run(full: bool = False, workers: int = None, output: str = None) -> Dict:
+    store = SubmissionColumns()
+    output = output or os.path.join(DATA_DIR, 'reports')
+    os.makedirs(output, exist_ok=True)
+    state_file = os.path.join(output, 'state.json')
+    state = {'watermark': 0, 'problems': {}, 'days': {}, 'cohorts': {}}
+    if not full and os.path.exists(state_file):
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+
+    started = time.perf_counter()
+    collections = StateStore(read_only=True)
+    problems = {str(p['id']): p for p in collections.values('problems')}
+    users = collections.items('users')
+    cohort_map_path = os.path.join(output, 'cohort_map.npy')
+    cohort_names = build_cohorts(store, users, cohort_map_path)
+
+    tasks, watermark = plan_tasks(store, state['watermark'], cohort_map_path)
+    if watermark < state['watermark']:
+        print('Submission store was rebuilt since the last run, recomputing from scratch')
+        state = {'watermark': 0, 'problems': {}, 'days': {}, 'cohorts': {}}
+        tasks, watermark = plan_tasks(store, 0, cohort_map_path)
+
+    with Pool(workers) as pool:
+        try:
+            partials = pool.map(aggregate_submissions, tasks)
+        except FileNotFoundError:
+            # A small tail segment was merged away while we ran; plan again from the new manifest
+            tasks, watermark = plan_tasks(store, state['watermark'], cohort_map_path)
+            partials = pool.map(aggregate_submissions, tasks)
+        answer_parts = pool.map(aggregate_answers, answer_store.shard_dirs())
+
+    rows = 0
+    for partial in partials:
+        rows += partial['rows']
+        for problem_id, values in partial['problems'].items():
+            _add(state['problems'], str(problem_id), values)
+        for day, values in partial['days'].items():
+            _add(state['days'], str(day), values)
+        for cohort, values in partial['cohorts'].items():
+            _add(state['cohorts'], cohort_names[cohort], values)
+    answer_totals: Dict[str, List[int]] = {}
+    for part in answer_parts:
+        for problem_id, values in part.items():
+            _add(answer_totals, problem_id, values)
+
+    state['watermark'] = watermark
+    header = {'generated_at': datetime.now().isoformat(), 'watermark': watermark}
+    write_reports(output, state, answer_totals, problems, users, header)
+    write_report(output, 'state.json', state)
+    os.remove(cohort_map_path)
+
+    elapsed = time.perf_counter() - started
+    return {'rows': rows, 'tasks': len(tasks), 'watermark': watermark, 'seconds': round(elapsed, 3)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate per-problem, topic, day and cohort reports.')
+    parser.add_argument('--full', action='store_true', help='ignore the watermark and rescan all history')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--output', default=None, help='report directory (default: data/reports)')
+    args = parser.parse_args()
+    print(run(full=args.full, workers=args.workers, output=args.output))
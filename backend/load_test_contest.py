@@ -0,0 +1,101 @@
+"""Simulate a 10k-participant contest against the in-memory scoreboard.
+
+Usage: python load_test_contest.py [participants] [threads]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from services.contest_service import ContestService
+
+
+def make_service(tmp_dir):
+    service = ContestService()
+    os.makedirs(os.path.join(tmp_dir, 'data'), exist_ok=True)
+    service.contests_file = os.path.join(tmp_dir, 'data', 'contests.json')
+    service.state_dir = os.path.join(tmp_dir, 'data', 'contests')
+    return service
+
+
+def run(participants=10000, threads=8):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        service = make_service(tmp_dir)
+        start = datetime.now() - timedelta(minutes=1)
+        contest = service.create_contest({
+            'id': 'load-test',
+            'title': 'Load test',
+            'problem_ids': list(range(1, 9)),
+            'start_time': start.isoformat(),
+            'duration_minutes': 180,
+            'freeze_minutes': 60
+        })
+        answers = service._contests[contest['id']].answers
+        start_ts = start.timestamp()
+
+        # Each participant tries every problem a few times over the contest window.
+        submissions = []
+        for n in range(participants):
+            user_id = f'user{n}'
+            for problem_id in answers:
+                for _ in range(random.randint(1, 3)):
+                    correct = random.random() < 0.4
+                    answer = answers[problem_id] if correct else 'x'
+                    submitted_at = start_ts + random.uniform(0, 170 * 60)
+                    submissions.append((user_id, int(problem_id), answer, submitted_at))
+        submissions.sort(key=lambda s: s[3])
+        print(f"{participants} participants, {len(submissions)} submissions, {threads} threads")
+
+        chunks = [submissions[i::threads] for i in range(threads)]
+
+        def worker(chunk):
+            for user_id, problem_id, answer, submitted_at in chunk:
+                service.submit(contest['id'], user_id, problem_id, answer, submitted_at)
+
+        began = time.perf_counter()
+        workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - began
+        print(f"submit: {len(submissions) / elapsed:,.0f} submissions/s")
+
+        began = time.perf_counter()
+        pages = 0
+        for page in range(1, participants // 50 + 1):
+            service.get_scoreboard(contest['id'], page, 50)
+            pages += 1
+        elapsed = time.perf_counter() - began
+        print(f"scoreboard: {elapsed / pages * 1000:.3f} ms/page (50 rows)")
+
+        began = time.perf_counter()
+        for n in range(0, participants, 10):
+            service.get_standing(contest['id'], f'user{n}', live=True)
+        elapsed = time.perf_counter() - began
+        print(f"standing lookup: {elapsed / (participants // 10) * 1e6:.1f} us")
+
+        live = service._contests[contest['id']].live
+        began = time.perf_counter()
+        service.snapshot(service._contests[contest['id']])
+        print(f"snapshot: {(time.perf_counter() - began) * 1000:.1f} ms")
+
+        recovered = make_service(tmp_dir)
+        began = time.perf_counter()
+        recovered_top = recovered.get_scoreboard(contest['id'], 1, 100, live=True)['rows']
+        print(f"recovery: {(time.perf_counter() - began) * 1000:.1f} ms")
+        expected_top = [live.format_row(key[3], i + 1) for i, key in enumerate(live.index.slice(0, 100))]
+        print("recovered scoreboard matches:", recovered_top == expected_top)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    participants = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    run(participants, threads)
@@ -0,0 +1,168 @@
+"""Non-blocking structured logging for the server and its services.
+
+``get_logger(__name__)`` returns a standard ``logging.Logger``. Its records go
+onto a bounded in-memory queue, so the calling thread only pays for an
+enqueue. A background listener thread formats each record as one JSON line
+and writes it to ``data/logs/app.log`` (rotated by size) and to stdout::
+
+    {"ts": "...", "level": "ERROR", "logger": "services.scoring_service",
+     "msg": "Error in submit_answer", "request_id": "9f1c...", "exc": "Traceback ..."}
+
+Keyword fields passed through ``extra=`` become top-level JSON keys.
+Request handlers set the request id through ``request_id_var``, and every
+record logged while handling that request carries it.
+
+Settings come from environment variables:
+
+    LOG_LEVEL       minimum level, default INFO
+    LOG_SAMPLE      per-level keep ratios, e.g. "debug=0.01,info=0.5";
+                    WARNING and above are always kept unless listed
+    LOG_FILE        log file path, "" to disable; default data/logs/app.log
+    LOG_MAX_BYTES   rotate after this many bytes, default 10 MB
+    LOG_BACKUPS     rotated files to keep, default 5
+    LOG_STDOUT      "0" to stop echoing to stdout
+    LOG_QUEUE_SIZE  records buffered before new ones are dropped, default 10000
+"""
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from config import DATA_DIR
+
+ROOT_LOGGER = 'backend'
+request_id_var: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name[len(ROOT_LOGGER) + 1:] if record.name.startswith(ROOT_LOGGER + '.') else record.name,
+            'msg': record.getMessage()
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep each record with the probability configured for its level."""
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Enqueue records without formatting them; drop them if the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the listener thread; only capture per-request context here
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_sample_rates(spec: str) -> Dict[int, float]:
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        level, _, rate = part.partition('=')
+        levelno = logging.getLevelName(level.strip().upper())
+        if not isinstance(levelno, int):
+            raise ValueError(f'Unknown log level in LOG_SAMPLE: {level}')
+        rates[levelno] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+_setup_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def _setup() -> None:
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter = JsonFormatter()
+        handlers = []
+        default_file = os.path.join(DATA_DIR, 'logs', 'app.log')
+        log_file = os.environ.get('LOG_FILE', default_file)
+        if log_file:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            handlers.append(RotatingFileHandler(log_file, maxBytes=int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+                                                backupCount=int(os.environ.get('LOG_BACKUPS', 5)), encoding='utf-8'))
+        if os.environ.get('LOG_STDOUT', '1') != '0':
+            handlers.append(logging.StreamHandler(sys.stdout))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(int(os.environ.get('LOG_QUEUE_SIZE', 10000))))
+        _queue_handler.addFilter(SamplingFilter(_parse_sample_rates(os.environ.get('LOG_SAMPLE', ''))))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+        root.addHandler(_queue_handler)
+        root.propagate = False
+
+        _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # Drain what is still queued when the process exits
+        atexit.register(lambda: _listener.stop())
+
+
+def _restart_after_fork() -> None:
+    """Give forked workers their own queue and writer; the parent's thread does not survive the fork."""
+    global _listener
+    if _listener is None:
+        return
+    _queue_handler.queue = queue.Queue(_queue_handler.queue.maxsize)
+    _listener = QueueListener(_queue_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger for a module, e.g. ``get_logger(__name__)``."""
+    _setup()
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
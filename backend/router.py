@@ -0,0 +1,539 @@
+"""Consistent-hash router in front of several backend nodes.
+
+Usage: python router.py --nodes http://127.0.0.1:5002,http://127.0.0.1:5003 [--port 5001]
+
+Each node is an ordinary ``app.py`` process with its own ``DATA_DIR`` and
+``PORT``. The router decides where each request goes:
+
+- Requests for one user (``/users/<id>/...``, ``/user_answer/<id>/...``,
+  ``/api/users/<id>/...``, ``/api/unified-stats/<id>``,
+  ``/api/stream/users/<id>``) go to the node that owns the user on the ring.
+  ``/users/<id>/submit_review/...`` is the exception: reviews are kept per
+  problem, so they go to the home node that serves them.
+- Catalog reads (``GET /problems``, ``GET /problems/<id>``) are spread
+  round-robin. Every node holds a full copy of the catalog, and joining
+  nodes are seeded from the home node.
+- ``POST /problems`` creates the problem on the home node, which assigns
+  its id, and then copies it to every other node.
+- Platform-wide reads are asked of every node in parallel and merged as
+  described in ``services.fanout``: problem stats and solve times, topics,
+  ``/problems/<id>/submissions``, ``POST /api/query``, the admin time series
+  and the sketch export. ``/api/stream/problems/<id>`` interleaves the
+  event streams of every node.
+- Everything else (contests, reviews, admin) goes to the home node, the
+  first node in the list.
+- Node-to-node routes (partition handoff, replication) are not routed. The
+  router calls them itself with ``CLUSTER_SECRET``, which must be the same
+  for the router and every node.
+
+Membership is changed at runtime through the router itself::
+
+    curl -X POST   localhost:5001/_router/nodes -d '{"url": "http://127.0.0.1:5004"}'
+    curl -X DELETE localhost:5001/_router/nodes -d '{"url": "http://127.0.0.1:5003"}'
+
+A change only moves the users whose owner changes, about 1/N of them. Their
+records are streamed from the old owner to the new one as NDJSON. Writes for
+those users wait until the handoff is done, then the ring is switched and
+the old owner drops its copy. Membership is kept in ``--state`` so a
+restarted router routes the same way.
+
+To try it with local processes, give each node a copy of the catalog first::
+
+    mkdir -p /tmp/node1 /tmp/node2 && cp data/problems.json /tmp/node1 && cp data/problems.json /tmp/node2
+    export CLUSTER_SECRET=$(python -c 'import secrets; print(secrets.token_hex())')
+    DATA_DIR=/tmp/node1 PORT=5002 python app.py
+    DATA_DIR=/tmp/node2 PORT=5003 python app.py
+    python router.py --nodes http://127.0.0.1:5002,http://127.0.0.1:5003
+"""
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlencode, urlsplit
+import argparse
+import http.client
+import io
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+import numpy as np
+from werkzeug.serving import run_simple
+from werkzeug.wrappers import Request, Response
+
+from config import CLUSTER_SECRET, CLUSTER_SECRET_HEADER, DATA_DIR, INTERNAL_PATHS, cluster_headers
+from logger import get_logger
+from services import fanout
+from services.hash_ring import HashRing
+from services.sketches import merge_saved
+
+logger = get_logger(__name__)
+
+USER_PATHS = [re.compile(p) for p in (
+    # Reviews are kept per problem on the home node, so /users/<id>/submit_review/ is not a user path
+    r'^/users/(?P<user>[^/]+)(?:/(?!submit_review/)|$)',
+    r'^/user_answer/(?P<user>[^/]+)/',
+    r'^/api/users/(?P<user>[^/]+)/',
+    r'^/api/unified-stats/(?P<user>[^/]+)',
+    r'^/api/stream/users/(?P<user>[^/]+)'
+)]
+CATALOG_PATH = re.compile(r'^/problems(/\d+)?/?$')
+PROBLEM_STATS_PATH = re.compile(r'^/problem_stats/\d+$')
+SOLVE_TIMES_PATH = re.compile(r'^/(?:problems/\d+|api/topics/[^/]+)/solve_times$')
+SUBMISSIONS_PATH = re.compile(r'^/problems/\d+/submissions$')
+PROBLEM_STREAM_PATH = re.compile(r'^/api/stream/problems/\d+$')
+HANDOFF_BATCH = 500
+# Not forwarded in either direction; they describe one hop, not the request. Clients never
+# pass on the cluster secret either
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+               'proxy-authorization', 'proxy-authenticate', 'host', 'content-length', CLUSTER_SECRET_HEADER.lower()}
+TIMEOUT = 60
+
+
+def user_for_path(path: str) -> Optional[str]:
+    for pattern in USER_PATHS:
+        match = pattern.match(path)
+        if match:
+            return match.group('user')
+    return None
+
+
+def _connection(node: str) -> http.client.HTTPConnection:
+    url = urlsplit(node)
+    return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=TIMEOUT)
+
+
+def call(node: str, method: str, path: str, payload=None):
+    """JSON request to a node's admin API."""
+    conn = _connection(node)
+    try:
+        body = json.dumps(payload) if payload is not None else None
+        conn.request(method, path, body=body, headers={'Content-Type': 'application/json', **cluster_headers()})
+        response = conn.getresponse()
+        data = response.read()
+        if response.status >= 400:
+            raise RuntimeError(f'{method} {node}{path} failed with {response.status}: {data[:200]!r}')
+        return json.loads(data) if data else None
+    finally:
+        conn.close()
+
+
+class Router:
+    def __init__(self, nodes: List[str], state_file: Optional[str] = None):
+        self.state_file = state_file
+        if state_file and os.path.exists(state_file):
+            with open(state_file, 'r') as f:
+                nodes = json.load(f)['nodes']
+        if not nodes:
+            raise ValueError('At least one node is required')
+        self.ring = HashRing(nodes)
+        self._cond = threading.Condition()
+        self._rebalance_lock = threading.Lock()
+        # Users being handed off, and writes currently in flight per user
+        self._moving: Set[str] = set()
+        self._writes: Dict[str, int] = {}
+        self._round_robin = count()
+        self._pool = ThreadPoolExecutor(max_workers=32)
+        self.moved_total = 0
+
+    @property
+    def home(self) -> str:
+        return self.ring.nodes[0]
+
+    def _save(self) -> None:
+        if not self.state_file:
+            return
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'nodes': self.ring.nodes}, f)
+        os.replace(tmp_file, self.state_file)
+
+    # Request routing
+    def _begin(self, user_id: Optional[str], method: str, path: str) -> str:
+        if user_id is None:
+            if method == 'GET' and CATALOG_PATH.match(path):
+                nodes = self.ring.nodes
+                return nodes[next(self._round_robin) % len(nodes)]
+            return self.home
+        with self._cond:
+            if method != 'GET':
+                # Writes for a user in handoff wait for the new owner
+                while user_id in self._moving:
+                    self._cond.wait()
+                self._writes[user_id] = self._writes.get(user_id, 0) + 1
+            return self.ring.node_for(user_id)
+
+    def _end(self, user_id: Optional[str], method: str) -> None:
+        if user_id is None or method == 'GET':
+            return
+        with self._cond:
+            self._writes[user_id] -= 1
+            if not self._writes[user_id]:
+                del self._writes[user_id]
+            self._cond.notify_all()
+
+    def forward(self, request: Request) -> Response:
+        path = request.path
+        user_id = user_for_path(path)
+        node = self._begin(user_id, request.method, path)
+        try:
+            conn = _connection(node)
+            headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+            target = path + ('?' + request.query_string.decode('latin-1') if request.query_string else '')
+            conn.request(request.method, target, body=request.get_data(), headers=headers)
+            upstream = conn.getresponse()
+        except Exception:
+            self._end(user_id, request.method)
+            raise
+        if request.method != 'GET':
+            body = upstream.read()
+            conn.close()
+            self._end(user_id, request.method)
+            stream = [body]
+        else:
+            stream = self._relay(upstream, conn)
+        headers = [(k, v) for k, v in upstream.getheaders() if k.lower() not in HOP_HEADERS]
+        response = Response(stream, status=upstream.status, headers=headers)
+        response.headers['X-Routed-To'] = node
+        return response
+
+    # Platform-wide reads
+    @staticmethod
+    def _fetch(node: str, method: str, target: str, body: bytes, headers: Dict[str, str]) -> Tuple[int, bytes]:
+        conn = _connection(node)
+        try:
+            conn.request(method, target, body=body or None, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def _gather(self, nodes: List[str], method: str, target: str, body: bytes,
+                headers: Dict[str, str]) -> List[Tuple[int, bytes]]:
+        return list(self._pool.map(lambda node: self._fetch(node, method, target, body, headers), nodes))
+
+    @staticmethod
+    def _target(request: Request, **params: str) -> str:
+        args = request.args.copy()
+        for key, value in params.items():
+            args[key] = value
+        query = urlencode(list(args.items(multi=True)))
+        return request.path + ('?' + query if query else '')
+
+    @staticmethod
+    def _json(payload, status: int = 200, nodes: Optional[List[str]] = None) -> Response:
+        response = Response(payload if isinstance(payload, bytes) else json.dumps(payload), status=status,
+                            mimetype='application/json')
+        if nodes:
+            response.headers['X-Routed-To'] = ','.join(nodes)
+        return response
+
+    def _merged(self, request: Request, headers: Dict[str, str], merge: Callable[[List], object],
+                **params: str) -> Response:
+        """Ask every node and merge their JSON answers; the first error is passed on as is."""
+        nodes = self.ring.nodes
+        responses = self._gather(nodes, request.method, self._target(request, **params), request.get_data(), headers)
+        for status, body in responses:
+            if status != 200:
+                return self._json(body, status, nodes)
+        return self._json(merge([json.loads(body) for _, body in responses]), nodes=nodes)
+
+    def _timeseries(self, request: Request, headers: Dict[str, str]) -> Response:
+        nodes = self.ring.nodes
+        status, body = self._fetch(nodes[0], 'GET', self._target(request), b'', headers)
+        if status != 200 or len(nodes) == 1:
+            return self._json(body, status, nodes[:1])
+        first = json.loads(body)
+        # The home node settles the range and resolution; the others answer for the same buckets
+        pinned = self._target(request, resolution=first['resolution'], **{'from': first['from'], 'to': first['to']})
+        results = [first]
+        for status, body in self._gather(nodes[1:], 'GET', pinned, b'', headers):
+            if status != 200:
+                return self._json(body, status, nodes)
+            results.append(json.loads(body))
+        return self._json(fanout.merge_timeseries(results), nodes=nodes)
+
+    def _query(self, request: Request, headers: Dict[str, str]) -> Response:
+        query = request.get_json(force=True, silent=True)
+        users = ((query or {}).get('filter') or {}).get('user_id') if isinstance(query, dict) else None
+        users = [users] if isinstance(users, str) else users
+        if isinstance(users, list) and len(set(users)) == 1:
+            # One user's submissions all live on the node that owns them
+            node = self.ring.node_for(str(users[0]))
+            status, body = self._fetch(node, 'POST', '/api/query', request.get_data(), headers)
+            return self._json(body, status, [node])
+        try:
+            node_query, metrics = fanout.prepare_query(query)
+        except ValueError as e:
+            return self._json({'error': str(e)}, 400)
+        nodes = self.ring.nodes
+        responses = self._gather(nodes, 'POST', '/api/query', json.dumps(node_query).encode('utf-8'), headers)
+        for status, body in responses:
+            if status != 200:
+                return self._json(body, status, nodes)
+        return self._json(fanout.merge_query([json.loads(body) for _, body in responses], metrics), nodes=nodes)
+
+    def _sketches(self, request: Request, headers: Dict[str, str]) -> Response:
+        nodes = self.ring.nodes
+        responses = self._gather(nodes, 'GET', self._target(request), b'', headers)
+        for status, body in responses:
+            if status != 200:
+                return self._json(body, status, nodes)
+        saved = [np.load(io.BytesIO(body)) for _, body in responses]
+        try:
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, **merge_saved(saved))
+        finally:
+            for npz in saved:
+                npz.close()
+        response = Response(buffer.getvalue(), mimetype='application/octet-stream',
+                            headers={'Content-Disposition': 'attachment; filename=sketches.npz'})
+        response.headers['X-Routed-To'] = ','.join(nodes)
+        return response
+
+    def _multiplex(self, request: Request, headers: Dict[str, str]) -> Response:
+        """One event stream carrying every node's events, which are deltas and add up."""
+        nodes = self.ring.nodes
+        events: 'queue.Queue[Optional[bytes]]' = queue.Queue()
+        conns = [_connection(node) for node in nodes]
+
+        def pump(conn: http.client.HTTPConnection) -> None:
+            try:
+                conn.request('GET', self._target(request), headers=headers)
+                upstream = conn.getresponse()
+                if upstream.status != 200:
+                    return
+                buffer = b''
+                while True:
+                    data = upstream.read1(65536)
+                    if not data:
+                        break
+                    *blocks, buffer = (buffer + data).split(b'\n\n')
+                    for block in blocks:
+                        # Each node sends its own retry interval; the router sends one
+                        if not block.startswith(b'retry:'):
+                            events.put(block + b'\n\n')
+            except (OSError, http.client.HTTPException):
+                pass
+            finally:
+                events.put(None)
+
+        for conn in conns:
+            threading.Thread(target=pump, args=(conn,), daemon=True).start()
+
+        def stream() -> Iterator[bytes]:
+            try:
+                yield b'retry: 3000\n\n'
+                while True:
+                    block = events.get()
+                    # A node that ends or drops the stream leaves gaps; the client reconnects
+                    if block is None:
+                        break
+                    yield block
+                    if block.startswith(b'event: dropped'):
+                        break
+            finally:
+                for conn in conns:
+                    conn.close()
+
+        response = Response(stream(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.headers['X-Routed-To'] = ','.join(nodes)
+        return response
+
+    def _create_problem(self, request: Request, headers: Dict[str, str]) -> Response:
+        """Create a problem on the home node, then copy it into every other node's catalog."""
+        home = self.home
+        status, body = self._fetch(home, 'POST', self._target(request), request.get_data(), headers)
+        if status != 201:
+            return self._json(body, status, [home])
+        # The response leaves out the correct answer; the stored record is the request plus its new id
+        problem = dict(json.loads(request.get_data()), id=json.loads(body)['id'])
+        others = [node for node in self.ring.nodes if node != home]
+
+        def copy(node: str) -> Optional[str]:
+            try:
+                call(node, 'PUT', '/api/admin/partition/catalog', [problem])
+                return None
+            except (OSError, http.client.HTTPException, RuntimeError):
+                logger.exception(f"Error copying problem {problem.get('id')} to {node}")
+                return node
+
+        failed = [node for node in self._pool.map(copy, others) if node is not None]
+        response = self._json(body, status, [home] + others)
+        if failed:
+            response.headers['X-Catalog-Unreplicated'] = ','.join(failed)
+        return response
+
+    def fan_out(self, request: Request) -> Optional[Response]:
+        """The merged answer of every node for platform-wide requests, or None for other requests."""
+        path = request.path
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+        if request.method == 'POST' and path == '/problems':
+            return self._create_problem(request, headers)
+        if request.method == 'POST' and path == '/api/query':
+            return self._query(request, headers)
+        if request.method != 'GET':
+            return None
+        if PROBLEM_STATS_PATH.match(path):
+            return self._merged(request, headers, fanout.merge_problem_stats, digest='true')
+        if SOLVE_TIMES_PATH.match(path):
+            time_taken = request.args.get('time_taken', type=float)
+            return self._merged(request, headers, lambda results: fanout.merge_solve_times(results, time_taken),
+                                digest='true')
+        if path == '/api/topics':
+            return self._merged(request, headers, fanout.merge_topics)
+        if SUBMISSIONS_PATH.match(path):
+            return self._merged(request, headers, fanout.merge_submissions)
+        if path == '/api/admin/timeseries':
+            return self._timeseries(request, headers)
+        if path == '/api/admin/sketches':
+            return self._sketches(request, headers)
+        if PROBLEM_STREAM_PATH.match(path):
+            return self._multiplex(request, headers)
+        return None
+
+    @staticmethod
+    def _relay(upstream: http.client.HTTPResponse, conn: http.client.HTTPConnection) -> Iterator[bytes]:
+        # read1 returns whatever has arrived, so event streams are passed on as they come
+        try:
+            while True:
+                data = upstream.read1(65536)
+                if not data:
+                    break
+                yield data
+        finally:
+            conn.close()
+
+    # Membership changes
+    def _handoff(self, moves: Dict[str, Dict[str, List[str]]], new_ring: HashRing) -> int:
+        """Copy ``moves[source][target]`` users, switch to ``new_ring``, then drop them at the source."""
+        moving = {user for targets in moves.values() for users in targets.values() for user in users}
+        with self._cond:
+            self._moving |= moving
+            while any(user in self._writes for user in moving):
+                self._cond.wait()
+        try:
+            for source, targets in moves.items():
+                for target, users in targets.items():
+                    for i in range(0, len(users), HANDOFF_BATCH):
+                        self._stream(source, target, users[i:i + HANDOFF_BATCH])
+            with self._cond:
+                self.ring = new_ring
+                self._save()
+        finally:
+            with self._cond:
+                self._moving -= moving
+                self._cond.notify_all()
+        for source, targets in moves.items():
+            if source in new_ring.nodes:
+                for users in targets.values():
+                    call(source, 'POST', '/api/admin/partition/drop', {'users': users})
+        self.moved_total += len(moving)
+        return len(moving)
+
+    @staticmethod
+    def _stream(source: str, target: str, users: List[str]) -> None:
+        """Pipe one batch of exported users from ``source`` into ``target`` without buffering it."""
+        export_conn, import_conn = _connection(source), _connection(target)
+        try:
+            export_conn.request('POST', '/api/admin/partition/export', body=json.dumps({'users': users}),
+                                headers={'Content-Type': 'application/json', **cluster_headers()})
+            exported = export_conn.getresponse()
+            if exported.status != 200:
+                raise RuntimeError(f'Export from {source} failed with {exported.status}')
+            import_conn.request('POST', '/api/admin/partition/import', body=iter(lambda: exported.read1(65536), b''),
+                                headers={'Content-Type': 'application/x-ndjson', **cluster_headers()},
+                                encode_chunked=True)
+            imported = import_conn.getresponse()
+            result = imported.read()
+            if imported.status != 200:
+                raise RuntimeError(f'Import into {target} failed with {imported.status}: {result[:200]!r}')
+        finally:
+            export_conn.close()
+            import_conn.close()
+
+    def add_node(self, node: str) -> Dict:
+        with self._rebalance_lock:
+            if node in self.ring.nodes:
+                raise ValueError(f'{node} is already a member')
+            started = time.perf_counter()
+            call(node, 'PUT', '/api/admin/partition/catalog', call(self.home, 'GET', '/api/admin/partition/catalog'))
+            new_ring = self.ring.copy()
+            new_ring.add(node)
+            moves = {}
+            for source in self.ring.nodes:
+                users = [u for u in call(source, 'GET', '/api/admin/partition/users') if new_ring.node_for(u) == node]
+                if users:
+                    moves[source] = {node: users}
+            moved = self._handoff(moves, new_ring)
+            return {'nodes': self.ring.nodes, 'moved': moved, 'seconds': round(time.perf_counter() - started, 3)}
+
+    def remove_node(self, node: str) -> Dict:
+        with self._rebalance_lock:
+            if node not in self.ring.nodes:
+                raise ValueError(f'{node} is not a member')
+            if node == self.home:
+                raise ValueError('The home node holds contests, reviews and other shared data and cannot be removed')
+            started = time.perf_counter()
+            new_ring = self.ring.copy()
+            new_ring.remove(node)
+            targets: Dict[str, List[str]] = {}
+            for user in call(node, 'GET', '/api/admin/partition/users'):
+                targets.setdefault(new_ring.node_for(user), []).append(user)
+            moved = self._handoff({node: targets}, new_ring)
+            return {'nodes': self.ring.nodes, 'moved': moved, 'seconds': round(time.perf_counter() - started, 3)}
+
+    # WSGI
+    def admin(self, request: Request) -> Response:
+        try:
+            if request.path == '/_router/nodes':
+                if request.method == 'GET':
+                    return Response(json.dumps({'nodes': self.ring.nodes, 'home': self.home,
+                                                'moved_total': self.moved_total}), mimetype='application/json')
+                node = (request.get_json(force=True, silent=True) or {}).get('url', '').rstrip('/')
+                if not node:
+                    return Response(json.dumps({'error': 'url is required'}), status=400, mimetype='application/json')
+                result = self.add_node(node) if request.method == 'POST' else self.remove_node(node)
+                return Response(json.dumps(result), mimetype='application/json')
+            if request.path.startswith('/_router/owner/'):
+                user_id = request.path[len('/_router/owner/'):]
+                return Response(json.dumps({'user_id': user_id, 'node': self.ring.node_for(user_id)}),
+                                mimetype='application/json')
+            return Response(json.dumps({'error': 'Not found'}), status=404, mimetype='application/json')
+        except ValueError as e:
+            return Response(json.dumps({'error': str(e)}), status=400, mimetype='application/json')
+        except Exception as e:
+            logger.exception("Error changing membership")
+            return Response(json.dumps({'error': str(e)}), status=502, mimetype='application/json')
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        if request.path.startswith('/_router/'):
+            response = self.admin(request)
+        elif request.path.startswith(INTERNAL_PATHS):
+            response = Response(json.dumps({'error': 'Not found'}), status=404, mimetype='application/json')
+        else:
+            try:
+                response = self.fan_out(request) or self.forward(request)
+            except (OSError, http.client.HTTPException) as e:
+                response = Response(json.dumps({'error': f'Upstream unavailable: {e}'}), status=502,
+                                    mimetype='application/json')
+        return response(environ, start_response)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Route requests to user-partitioned backend nodes.')
+    parser.add_argument('--nodes', default='', help='comma-separated node base URLs; the first is the home node')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--state', default=os.path.join(DATA_DIR, 'router.json'),
+                        help='membership file, which overrides --nodes once it exists')
+    args = parser.parse_args()
+    if not CLUSTER_SECRET:
+        logger.warning("CLUSTER_SECRET is not set; nodes will refuse handoffs until it is")
+    router = Router([n.rstrip('/') for n in args.nodes.split(',') if n], args.state)
+    print(f"Routing to {', '.join(router.ring.nodes)} (home {router.home})")
+    run_simple('0.0.0.0', args.port, router, threaded=True)
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+import os
+import threading
+
+import numpy as np
+
+from database.answer_store import shard_for
+from database.submission_store import EPOCH, MISSING, submission_store, to_micros
+from logger import get_logger
+from config import DATA_DIR
+
+logger = get_logger(__name__)
+
+FIELDS = ('attempts', 'correct', 'time_taken')
+SHARDS = 64
+CACHE_SIZE = 4096
+MAX_RANGE_DAYS = 3 * 366
+MICROS_PER_DAY = 86400 * 1000000
+
+
+class ActivityService:
+    """Per-user daily activity counters.
+
+    Each user-year is one ``366 x 3`` int32 array (attempts, correct, seconds
+    taken), indexed by day of the year and stored as
+    ``data/activity/<shard>/<user>-<year>.npy``. A submission increments one
+    row, and a range query reads at most one array per year it covers, so
+    cost follows the number of days asked for, not the user's history.
+    """
+
+    def __init__(self):
+        self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.root = os.path.join(DATA_DIR, 'activity')
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[Tuple[str, int], np.ndarray]' = OrderedDict()
+        self._loaded = False
+
+    def _path(self, user_id: str, year: int) -> str:
+        return os.path.join(self.root, f'{shard_for(user_id, SHARDS):02d}', f"{quote(user_id, safe='')}-{year}.npy")
+
+    def _get_year(self, user_id: str, year: int) -> Optional[np.ndarray]:
+        key = (user_id, year)
+        buckets = self._cache.get(key)
+        if buckets is None:
+            try:
+                buckets = np.load(self._path(user_id, year))
+            except FileNotFoundError:
+                return None
+            self._cache[key] = buckets
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return buckets
+
+    def _save_year(self, user_id: str, year: int, buckets: np.ndarray) -> None:
+        path = self._path(user_id, year)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, buckets)
+        os.replace(path + '.tmp', path)
+
+    # Building and updating
+    def load(self) -> None:
+        """Backfill from the submission store on first use; call before new submissions land."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if not os.path.isdir(self.root):
+                try:
+                    self._backfill()
+                except Exception:
+                    logger.exception("Error backfilling activity")
+            self._loaded = True
+
+    def _backfill(self) -> None:
+        users, days, correct, time_taken = [], [], [], []
+        for chunk in submission_store.chunks():
+            users.append(chunk['user'])
+            days.append((chunk['timestamp'] // MICROS_PER_DAY).astype('datetime64[D]'))
+            correct.append(chunk['correct'])
+            time_taken.append(chunk['time_taken'])
+        os.makedirs(self.root, exist_ok=True)
+        if not users:
+            return
+        users, days = np.concatenate(users), np.concatenate(days)
+        correct, time_taken = np.concatenate(correct), np.concatenate(time_taken)
+        years = days.astype('datetime64[Y]')
+        day_of_year = (days - years).astype(np.int64)
+        years = years.astype(np.int64) + 1970
+
+        order = np.lexsort((years, users))
+        users, years = users[order], years[order]
+        day_of_year, correct, time_taken = day_of_year[order], correct[order], time_taken[order]
+        boundaries = np.flatnonzero((np.diff(users) != 0) | (np.diff(years) != 0)) + 1
+        for start, stop in zip(np.r_[0, boundaries], np.r_[boundaries, len(users)]):
+            buckets = np.zeros((366, len(FIELDS)), dtype=np.int32)
+            rows = day_of_year[start:stop]
+            buckets[:, 0] = np.bincount(rows, minlength=366)
+            buckets[:, 1] = np.bincount(rows, weights=correct[start:stop], minlength=366)
+            timed = time_taken[start:stop]
+            buckets[:, 2] = np.bincount(rows, weights=np.where(timed == MISSING, 0, timed), minlength=366)
+            self._save_year(submission_store.user_name(int(users[start])), int(years[start]), buckets)
+
+    def record(self, user_id: str, timestamp: str, is_correct: bool, time_taken: Optional[int] = None) -> None:
+        """Count one submission in the user's bucket for its day."""
+        self.load()
+        user_id = str(user_id)
+        # Same day boundaries as the backfill: UTC for aware timestamps, as-is for naive ones
+        day = (EPOCH + timedelta(days=to_micros(timestamp) // MICROS_PER_DAY)).date()
+        with self._lock:
+            buckets = self._get_year(user_id, day.year)
+            if buckets is None:
+                buckets = np.zeros((366, len(FIELDS)), dtype=np.int32)
+                self._cache[(user_id, day.year)] = buckets
+            row = buckets[day.timetuple().tm_yday - 1]
+            row[0] += 1
+            row[1] += 1 if is_correct else 0
+            row[2] += int(time_taken or 0)
+            self._save_year(user_id, day.year, buckets)
+
+    def delete_user(self, user_id: str) -> None:
+        """Drop every year of a user's counters, e.g. once the user lives on another node."""
+        self.load()
+        user_id = str(user_id)
+        directory = os.path.dirname(self._path(user_id, 0))
+        prefix = quote(user_id, safe='') + '-'
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == user_id]:
+                del self._cache[key]
+            try:
+                names = os.listdir(directory)
+            except FileNotFoundError:
+                return
+            for name in names:
+                if name.startswith(prefix) and name.endswith('.npy') and name[len(prefix):-4].isdigit():
+                    os.remove(os.path.join(directory, name))
+
+    # Queries
+    def get_activity(self, user_id: str, start: date, end: date) -> Dict:
+        """Daily counters for ``start``..``end`` inclusive, plus range totals."""
+        if end < start:
+            raise ValueError("'from' must not be after 'to'")
+        if (end - start).days >= MAX_RANGE_DAYS:
+            raise ValueError(f'Range is limited to {MAX_RANGE_DAYS} days')
+        self.load()
+        user_id = str(user_id)
+        days = []
+        totals = np.zeros(len(FIELDS), dtype=np.int64)
+        with self._lock:
+            for year in range(start.year, end.year + 1):
+                buckets = self._get_year(user_id, year)
+                first = max(start, date(year, 1, 1))
+                last = min(end, date(year, 12, 31))
+                first_index = first.timetuple().tm_yday - 1
+                count = (last - first).days + 1
+                if buckets is None:
+                    values = np.zeros((count, len(FIELDS)), dtype=np.int32)
+                else:
+                    values = buckets[first_index:first_index + count]
+                totals += values.sum(axis=0)
+                for offset, (attempts, correct, time_taken) in enumerate(values.tolist()):
+                    days.append({
+                        'date': (first + timedelta(days=offset)).isoformat(),
+                        'attempts': attempts,
+                        'correct': correct,
+                        'time_taken': time_taken
+                    })
+        return {
+            'user_id': user_id,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'days': days,
+            'totals': dict(zip(FIELDS, (int(v) for v in totals))),
+            'active_days': sum(1 for d in days if d['attempts'])
+        }
+
+
+activity_tracker = ActivityService()
@@ -0,0 +1,449 @@
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from database.db_handler import db
+from logger import get_logger
+from config import DATA_DIR
+
+logger = get_logger(__name__)
+
+PENALTY_MINUTES = 20
+FLUSH_INTERVAL = 1.0
+SNAPSHOT_INTERVAL = 30.0
+
+
+class RankIndex:
+    """Indexable skip list of ranking keys.
+
+    Insert and remove are O(log n); fetching ``k`` entries starting at a given
+    rank costs O(log n + k). Keys must be unique and totally ordered.
+    """
+
+    MAX_LEVEL = 32
+
+    class _Node:
+        __slots__ = ('key', 'next', 'width')
+
+        def __init__(self, key, level: int):
+            self.key = key
+            self.next = [None] * level
+            self.width = [1] * level
+
+    def __init__(self):
+        self._head = self._Node(None, self.MAX_LEVEL)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key) -> None:
+        chain = [None] * self.MAX_LEVEL
+        steps_at_level = [0] * self.MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        new_level = self._random_level()
+        new_node = self._Node(key, new_level)
+        steps = 0
+        for level in range(new_level):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(new_level, self.MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key) -> None:
+        chain = [None] * self.MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key) -> int:
+        """Zero-based position of ``key``."""
+        position = 0
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start: int, count: int) -> List:
+        """Return up to ``count`` keys starting at zero-based rank ``start``."""
+        if start >= self._size or count <= 0:
+            return []
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Scoreboard:
+    """ICPC-style standings: more solved first, then less penalty, then earlier last solve."""
+
+    def __init__(self):
+        self.participants: Dict[str, Dict] = {}
+        self.index = RankIndex()
+
+    @staticmethod
+    def _key(user_id: str, row: Dict) -> Tuple:
+        return (-row['solved'], row['penalty'], row['last_solve'], user_id)
+
+    def _row(self, user_id: str) -> Dict:
+        row = self.participants.get(user_id)
+        if row is None:
+            row = {'solved': 0, 'penalty': 0, 'last_solve': 0, 'problems': {}}
+            self.participants[user_id] = row
+            self.index.insert(self._key(user_id, row))
+        return row
+
+    def apply(self, user_id: str, problem_id: str, is_correct: bool, minute: int) -> None:
+        row = self._row(user_id)
+        result = row['problems'].setdefault(problem_id, {'attempts': 0, 'solved_at': None, 'pending': 0})
+        if result['solved_at'] is not None:
+            return
+        old_key = self._key(user_id, row)
+        result['attempts'] += 1
+        if not is_correct:
+            return
+        result['solved_at'] = minute
+        row['solved'] += 1
+        row['penalty'] += minute + PENALTY_MINUTES * (result['attempts'] - 1)
+        row['last_solve'] = minute
+        self.index.remove(old_key)
+        self.index.insert(self._key(user_id, row))
+
+    def mark_pending(self, user_id: str, problem_id: str) -> None:
+        row = self._row(user_id)
+        result = row['problems'].setdefault(problem_id, {'attempts': 0, 'solved_at': None, 'pending': 0})
+        if result['solved_at'] is None:
+            result['pending'] += 1
+
+    def page(self, page: int, page_size: int) -> List[Dict]:
+        start = (page - 1) * page_size
+        rows = []
+        for offset, key in enumerate(self.index.slice(start, page_size)):
+            rows.append(self.format_row(key[3], start + offset + 1))
+        return rows
+
+    def rank_of(self, user_id: str) -> Optional[Dict]:
+        row = self.participants.get(user_id)
+        if row is None:
+            return None
+        return self.format_row(user_id, self.index.rank(self._key(user_id, row)) + 1)
+
+    def format_row(self, user_id: str, rank: int) -> Dict:
+        row = self.participants[user_id]
+        return {
+            'rank': rank,
+            'user_id': user_id,
+            'solved': row['solved'],
+            'penalty': row['penalty'],
+            # Copies, so callers cannot change the scoreboard through the row
+            'problems': {problem_id: dict(result) for problem_id, result in row['problems'].items()}
+        }
+
+    def to_dict(self) -> Dict:
+        return self.participants
+
+    @classmethod
+    def from_dict(cls, participants: Dict) -> 'Scoreboard':
+        board = cls()
+        for user_id, row in participants.items():
+            board.participants[user_id] = row
+            board.index.insert(cls._key(user_id, row))
+        return board
+
+
+class Contest:
+    def __init__(self, definition: Dict, answers: Dict[str, str]):
+        self.definition = definition
+        self.answers = answers
+        self.start = datetime.fromisoformat(definition['start_time']).timestamp()
+        self.end = self.start + definition['duration_minutes'] * 60
+        self.freeze_at = self.end - definition.get('freeze_minutes', 0) * 60
+        self.unfrozen = definition.get('unfrozen', False)
+        self.lock = threading.Lock()
+        self.live = Scoreboard()
+        self.public = Scoreboard()
+        self.submission_count = 0
+        self.pending_log: List[str] = []
+
+    def status(self, now: float) -> str:
+        if now < self.start:
+            return 'upcoming'
+        if now >= self.end:
+            return 'ended'
+        return 'running'
+
+    def apply(self, user_id: str, problem_id: str, is_correct: bool, submitted_at: float) -> None:
+        minute = int((submitted_at - self.start) // 60)
+        self.live.apply(user_id, problem_id, is_correct, minute)
+        if submitted_at < self.freeze_at:
+            self.public.apply(user_id, problem_id, is_correct, minute)
+        else:
+            self.public.mark_pending(user_id, problem_id)
+        self.submission_count += 1
+
+
+class ContestService:
+    """Timed contests with in-memory ICPC scoreboards.
+
+    Submissions are graded against answers cached when the contest is loaded and
+    applied to the scoreboards under a per-contest lock; the request thread only
+    buffers a log line. A background thread flushes the buffered log every second
+    and writes a full snapshot periodically, so recovery is snapshot plus the
+    short log written since.
+    """
+
+    def __init__(self):
+        self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.contests_file = os.path.join(DATA_DIR, 'contests.json')
+        self.state_dir = os.path.join(DATA_DIR, 'contests')
+        self._lock = threading.Lock()
+        self._contests: Dict[str, Contest] = {}
+        self._loaded = False
+        self._writer = None
+
+    # Loading and persistence
+    def _read_definitions(self) -> List[Dict]:
+        try:
+            with open(self.contests_file, 'r') as f:
+                return json.load(f).get('contests', [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def _write_definitions(self) -> None:
+        definitions = [c.definition for c in self._contests.values()]
+        with open(self.contests_file, 'w') as f:
+            json.dump({'contests': definitions}, f, indent=2)
+
+    def _load_answers(self, problem_ids: List[int]) -> Dict[str, str]:
+        wanted = {int(pid) for pid in problem_ids}
+        problems = db.get_all_problems()
+        return {str(p['id']): str(p.get('correct_answer', '')).strip().lower()
+                for p in problems if int(p['id']) in wanted}
+
+    def _snapshot_path(self, contest_id: str) -> str:
+        return os.path.join(self.state_dir, f'{contest_id}.snapshot.json')
+
+    def _log_path(self, contest_id: str) -> str:
+        return os.path.join(self.state_dir, f'{contest_id}.log')
+
+    def _recover(self, contest: Contest) -> None:
+        contest_id = contest.definition['id']
+        snapshot_path = self._snapshot_path(contest_id)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            contest.live = Scoreboard.from_dict(snapshot['live'])
+            contest.public = Scoreboard.from_dict(snapshot['public'])
+            contest.submission_count = snapshot.get('submission_count', 0)
+        log_path = self._log_path(contest_id)
+        if os.path.exists(log_path):
+            with open(log_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        user_id, problem_id, is_correct, submitted_at = json.loads(line)
+                        contest.apply(user_id, problem_id, is_correct, submitted_at)
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            os.makedirs(self.state_dir, exist_ok=True)
+            for definition in self._read_definitions():
+                try:
+                    contest = Contest(definition, self._load_answers(definition['problem_ids']))
+                    self._recover(contest)
+                    self._contests[definition['id']] = contest
+                except Exception:
+                    logger.exception(f"Error loading contest {definition.get('id')}")
+            self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+            self._writer.start()
+            self._loaded = True
+
+    def _writer_loop(self) -> None:
+        last_snapshot = time.time()
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            take_snapshot = time.time() - last_snapshot >= SNAPSHOT_INTERVAL
+            for contest in list(self._contests.values()):
+                try:
+                    if take_snapshot:
+                        self.snapshot(contest)
+                    else:
+                        self._flush(contest)
+                except Exception:
+                    logger.exception(f"Error persisting contest {contest.definition['id']}")
+            if take_snapshot:
+                last_snapshot = time.time()
+
+    def _flush(self, contest: Contest) -> None:
+        with contest.lock:
+            lines, contest.pending_log = contest.pending_log, []
+        if lines:
+            with open(self._log_path(contest.definition['id']), 'a') as f:
+                f.write(''.join(lines))
+
+    def snapshot(self, contest: Contest) -> None:
+        """Write the full scoreboard state and truncate the submission log."""
+        with contest.lock:
+            data = json.dumps({
+                'live': contest.live.to_dict(),
+                'public': contest.public.to_dict(),
+                'submission_count': contest.submission_count
+            }, separators=(',', ':'))
+            contest.pending_log = []
+        snapshot_path = self._snapshot_path(contest.definition['id'])
+        with open(snapshot_path + '.tmp', 'w') as f:
+            f.write(data)
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+        open(self._log_path(contest.definition['id']), 'w').close()
+
+    # Contest operations
+    def _summary(self, contest: Contest, now: float) -> Dict:
+        summary = dict(contest.definition)
+        summary['status'] = contest.status(now)
+        summary['frozen'] = now >= contest.freeze_at and not contest.unfrozen
+        summary['participants'] = len(contest.live.participants)
+        summary['submissions'] = contest.submission_count
+        return summary
+
+    def list_contests(self) -> List[Dict]:
+        self._ensure_loaded()
+        now = time.time()
+        return [self._summary(c, now) for c in self._contests.values()]
+
+    def get_contest(self, contest_id: str) -> Optional[Dict]:
+        self._ensure_loaded()
+        contest = self._contests.get(contest_id)
+        return self._summary(contest, time.time()) if contest else None
+
+    def create_contest(self, data: Dict) -> Dict:
+        required_fields = ['title', 'problem_ids', 'start_time', 'duration_minutes']
+        if not all(field in data for field in required_fields):
+            raise ValueError("Missing required fields")
+        self._ensure_loaded()
+        definition = {
+            'id': data.get('id') or str(uuid.uuid4()),
+            'title': data['title'],
+            'problem_ids': [int(pid) for pid in data['problem_ids']],
+            'start_time': datetime.fromisoformat(data['start_time']).isoformat(),
+            'duration_minutes': int(data['duration_minutes']),
+            'freeze_minutes': int(data.get('freeze_minutes', 0)),
+            'unfrozen': False
+        }
+        answers = self._load_answers(definition['problem_ids'])
+        if len(answers) != len(set(definition['problem_ids'])):
+            raise ValueError("Unknown problem in contest problem set")
+        with self._lock:
+            if definition['id'] in self._contests:
+                raise ValueError("Contest already exists")
+            self._contests[definition['id']] = Contest(definition, answers)
+            self._write_definitions()
+        return self.get_contest(definition['id'])
+
+    def submit(self, contest_id: str, user_id: str, problem_id: int, answer: str,
+               submitted_at: Optional[float] = None) -> Dict:
+        self._ensure_loaded()
+        contest = self._contests.get(contest_id)
+        if contest is None:
+            raise ValueError("Contest not found")
+        submitted_at = time.time() if submitted_at is None else submitted_at
+        if contest.status(submitted_at) != 'running':
+            raise ValueError("Contest is not running")
+        problem_key = str(problem_id)
+        if problem_key not in contest.answers:
+            raise ValueError("Problem is not part of this contest")
+        is_correct = str(answer).strip().lower() == contest.answers[problem_key]
+        with contest.lock:
+            contest.apply(str(user_id), problem_key, is_correct, submitted_at)
+            contest.pending_log.append(json.dumps([str(user_id), problem_key, is_correct, submitted_at]) + '\n')
+        return {'is_correct': is_correct, 'problem_id': problem_id, 'timestamp': datetime.fromtimestamp(submitted_at).isoformat()}
+
+    def _board(self, contest: Contest, live: bool) -> Scoreboard:
+        if live or contest.unfrozen:
+            return contest.live
+        return contest.public
+
+    def get_scoreboard(self, contest_id: str, page: int = 1, page_size: int = 50, live: bool = False) -> Optional[Dict]:
+        self._ensure_loaded()
+        contest = self._contests.get(contest_id)
+        if contest is None:
+            return None
+        with contest.lock:
+            board = self._board(contest, live)
+            return {
+                'contest_id': contest_id,
+                'page': page,
+                'page_size': page_size,
+                'total': len(board.index),
+                'frozen': board is contest.public and time.time() >= contest.freeze_at,
+                'rows': board.page(page, page_size)
+            }
+
+    def get_standing(self, contest_id: str, user_id: str, live: bool = False) -> Optional[Dict]:
+        self._ensure_loaded()
+        contest = self._contests.get(contest_id)
+        if contest is None:
+            return None
+        with contest.lock:
+            return self._board(contest, live).rank_of(str(user_id))
+
+    def unfreeze(self, contest_id: str) -> Optional[Dict]:
+        self._ensure_loaded()
+        contest = self._contests.get(contest_id)
+        if contest is None:
+            return None
+        with self._lock:
+            contest.unfrozen = True
+            contest.definition['unfrozen'] = True
+            self._write_definitions()
+        return self.get_contest(contest_id)
+
+
+contest_service = ContestService()
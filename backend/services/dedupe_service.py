@@ -0,0 +1,211 @@
+"""Near-duplicate problem detection with MinHash and locality-sensitive hashing.
+
+Each problem's title, description and option texts are normalized into word
+3-gram shingles. A signature of ``NUM_HASHES`` minimum hash values then stands
+in for that shingle set: the fraction of positions where two signatures agree
+estimates the Jaccard similarity of the two sets.
+
+Signatures are cut into ``BANDS`` bands of ``ROWS`` values. Each band is
+hashed into its own bucket table, and problems sharing any bucket become
+candidates. A pair with similarity s is a candidate with probability
+1 - (1 - s^ROWS)^BANDS: about 99.8% at s = 0.8 and under 2% at s = 0.4. A
+lookup therefore touches only a few buckets, not the whole catalog. Only the
+candidates get their similarity estimated, and those at or above the
+threshold are reported.
+"""
+from typing import Dict, Iterable, List
+import threading
+import zlib
+
+import numpy as np
+
+from database.db_handler import db
+from logger import get_logger
+from services.problem_text import problem_tokens
+
+logger = get_logger(__name__)
+
+BANDS = 20
+ROWS = 6
+NUM_HASHES = BANDS * ROWS
+SHINGLE_SIZE = 3
+DUPLICATE_THRESHOLD = 0.8
+# Shingle hashes expanded per numpy step when signing a batch; bounds memory to ~this * NUM_HASHES * 8 bytes
+SIGN_BLOCK = 65536
+
+_rng = np.random.default_rng(0x5EED)
+# Multiply-shift hashing: the high 32 bits of a * x + b (mod 2^64), with odd a
+_MULTIPLIERS = _rng.integers(1, 2 ** 63, NUM_HASHES, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_OFFSETS = _rng.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64)
+
+
+def shingles(problem: Dict) -> List[str]:
+    """Normalized word 3-grams of a problem's title, description and options."""
+    tokens = problem_tokens(problem)
+    if len(tokens) < SHINGLE_SIZE:
+        return [' '.join(tokens)] if tokens else []
+    return [' '.join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)]
+
+
+def _hash_shingles(values: Iterable[str]) -> np.ndarray:
+    return np.unique(np.fromiter((zlib.crc32(v.encode('utf-8')) for v in values), dtype=np.uint64))
+
+
+def signatures(problems: List[Dict]) -> np.ndarray:
+    """MinHash signatures, one uint32 row per problem, computed in vectorized blocks."""
+    hashed = [_hash_shingles(shingles(p)) for p in problems]
+    sizes = np.array([len(h) for h in hashed], dtype=np.int64)
+    result = np.full((len(problems), NUM_HASHES), np.iinfo(np.uint32).max, dtype=np.uint32)
+    if not sizes.sum():
+        return result
+    values = np.concatenate(hashed)
+    owners = np.repeat(np.arange(len(problems)), sizes)
+    for start in range(0, len(values), SIGN_BLOCK):
+        block = values[start:start + SIGN_BLOCK]
+        block_owners = owners[start:start + SIGN_BLOCK]
+        with np.errstate(over='ignore'):
+            permuted = ((block[:, None] * _MULTIPLIERS + _OFFSETS) >> np.uint64(32)).astype(np.uint32)
+        # Rows of one problem are contiguous, so reduce each run and fold it into the running minimum
+        starts = np.flatnonzero(np.r_[True, block_owners[1:] != block_owners[:-1]])
+        mins = np.minimum.reduceat(permuted, starts, axis=0)
+        rows = block_owners[starts]
+        result[rows] = np.minimum(result[rows], mins)
+    return result
+
+
+class ProblemDedupeIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._signatures = np.empty((0, NUM_HASHES), dtype=np.uint32)
+        self._ids: List[int] = []
+        self._rows: Dict[int, int] = {}
+        # One table per band: band bytes -> rows whose signature has that band
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(BANDS)]
+
+    def load(self) -> None:
+        """Sign the whole catalog; later problems are added incrementally."""
+        self._ensure_loaded()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                problems = db.get_all_problems()
+                self._add_locked([int(p['id']) for p in problems], signatures(problems))
+            except Exception:
+                logger.exception("Error building duplicate index")
+            self._loaded = True
+
+    def _add_locked(self, problem_ids: List[int], sigs: np.ndarray) -> None:
+        fresh = [i for i, problem_id in enumerate(problem_ids) if problem_id not in self._rows]
+        if not fresh:
+            return
+        base = len(self._ids)
+        if base + len(fresh) > len(self._signatures):
+            # Grow geometrically so inserting one problem at a time stays amortized O(1)
+            grown = np.empty((max(2 * len(self._signatures), base + len(fresh), 1024), NUM_HASHES), dtype=np.uint32)
+            grown[:base] = self._signatures[:base]
+            self._signatures = grown
+        self._signatures[base:base + len(fresh)] = sigs[fresh]
+        for offset, i in enumerate(fresh):
+            row = base + offset
+            self._ids.append(problem_ids[i])
+            self._rows[problem_ids[i]] = row
+            for band, table in enumerate(self._buckets):
+                table.setdefault(sigs[i, band * ROWS:(band + 1) * ROWS].tobytes(), []).append(row)
+
+    def add_problem(self, problem: Dict) -> None:
+        """Index a newly created problem."""
+        self._ensure_loaded()
+        sig = signatures([problem])
+        with self._lock:
+            self._add_locked([int(problem['id'])], sig)
+
+    def _candidates_locked(self, sig: np.ndarray) -> np.ndarray:
+        rows = set()
+        for band, table in enumerate(self._buckets):
+            rows.update(table.get(sig[band * ROWS:(band + 1) * ROWS].tobytes(), ()))
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+    def find_duplicates(self, problem: Dict, threshold: float = DUPLICATE_THRESHOLD,
+                        limit: int = 10) -> List[Dict]:
+        """Indexed problems whose estimated similarity to ``problem`` is at least ``threshold``."""
+        return self.find_duplicates_batch([problem], threshold, limit)[0]
+
+    def find_duplicates_batch(self, problems: List[Dict], threshold: float = DUPLICATE_THRESHOLD,
+                              limit: int = 10) -> List[List[Dict]]:
+        """``find_duplicates`` for many problems at once, e.g. to validate an import."""
+        self._ensure_loaded()
+        sigs = signatures(problems)
+        results = []
+        with self._lock:
+            for problem, sig in zip(problems, sigs):
+                rows = self._candidates_locked(sig)
+                if problem.get('id') is not None and int(problem['id']) in self._rows:
+                    rows = rows[rows != self._rows[int(problem['id'])]]
+                similarity = (self._signatures[rows] == sig).mean(axis=1) if len(rows) else np.empty(0)
+                keep = np.flatnonzero(similarity >= threshold)
+                keep = keep[np.argsort(-similarity[keep], kind='stable')][:limit]
+                results.append([{'id': self._ids[rows[i]], 'similarity': round(float(similarity[i]), 3)}
+                                for i in keep])
+        return results
+
+    def report(self, threshold: float = DUPLICATE_THRESHOLD) -> Dict:
+        """Groups of near-duplicate problems across the whole catalog.
+
+        For every band, each problem is compared with the first problem that
+        shares its bucket and linked to it when estimated at or above
+        ``threshold``. Connected components of those links are the groups.
+        Everything runs as whole-catalog numpy operations, so a bucket of k
+        copies of one template costs O(k) rather than O(k^2).
+        """
+        self._ensure_loaded()
+        with self._lock:
+            ids = np.array(self._ids)
+            sigs = self._signatures[:len(ids)]
+        sources, targets = [], []
+        for band in range(BANDS):
+            keys = sigs[:, band * ROWS:(band + 1) * ROWS].astype(np.uint64)
+            with np.errstate(over='ignore'):
+                keys = (keys * _MULTIPLIERS[:ROWS]).sum(axis=1)
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            leaders = first[inverse.ravel()]
+            linked = np.flatnonzero((leaders != np.arange(len(ids)))
+                                    & ((sigs == sigs[leaders]).mean(axis=1) >= threshold))
+            sources.append(linked)
+            targets.append(leaders[linked])
+        sources, targets = np.concatenate(sources), np.concatenate(targets)
+
+        # Connected components by min-label propagation with pointer jumping
+        labels = np.arange(len(ids))
+        while True:
+            low = np.minimum(labels[sources], labels[targets])
+            updated = labels.copy()
+            np.minimum.at(updated, sources, low)
+            np.minimum.at(updated, targets, low)
+            updated = updated[updated]
+            if np.array_equal(updated, labels):
+                break
+            labels = updated
+
+        order = np.argsort(labels, kind='stable')
+        groups = [ids[g].tolist() for g in np.split(order, np.flatnonzero(np.diff(labels[order])) + 1) if len(g) > 1]
+        groups.sort(key=lambda g: (-len(g), g[0]))
+        return {
+            'threshold': threshold,
+            'problems': len(ids),
+            'duplicate_problems': sum(len(g) - 1 for g in groups),
+            'groups': [{'size': len(g), 'problem_ids': sorted(g)} for g in groups]
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'problems': len(self._ids), 'bands': BANDS, 'rows_per_band': ROWS,
+                    'buckets': sum(len(table) for table in self._buckets)}
+
+
+problem_dedupe = ProblemDedupeIndex()
@@ -0,0 +1,100 @@
+from typing import Dict, Iterator, Set
+import json
+import queue
+import threading
+
+DEFAULT_QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+
+
+class Subscription:
+    """One connected client: a bounded queue of pending events."""
+
+    def __init__(self, channel: str, maxsize: int):
+        self.channel = channel
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.dropped = False
+
+
+class EventBroadcaster:
+    """In-process fan-out of events to Server-Sent Events subscribers.
+
+    Publishing never blocks: each subscriber has a bounded queue and a client
+    whose queue is full is dropped and told to reconnect, so one slow consumer
+    cannot hold up the submission path or the other clients.
+    """
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._channels: Dict[str, Set[Subscription]] = {}
+        self.dropped_total = 0
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel, self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel: str, event: str, data: Dict) -> int:
+        """Queue an event for every subscriber of ``channel``; returns how many received it."""
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        if not subscribers:
+            return 0
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        delivered = 0
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                subscription.dropped = True
+                self.dropped_total += 1
+                self.unsubscribe(subscription)
+        return delivered
+
+    def stream(self, subscription: Subscription) -> Iterator[str]:
+        """Yield SSE frames for ``subscription`` until the client goes away or is dropped."""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield subscription.queue.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    if subscription.dropped:
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if subscription.dropped and subscription.queue.empty():
+                    break
+            yield "event: dropped\ndata: {}\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'subscribers': sum(len(s) for s in self._channels.values()),
+                'dropped_total': self.dropped_total
+            }
+
+
+def problem_channel(problem_id: int) -> str:
+    return f"problem:{problem_id}"
+
+
+def user_channel(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+broadcaster = EventBroadcaster()
@@ -0,0 +1,150 @@
+"""Merging the answers of every node into the answer one node would give for all users.
+
+Nodes partition users, and a user's submissions live only on the node that
+owns them, so platform-wide numbers are sums over nodes: counts add, and so
+do distinct users, who are never counted on two nodes. Percentiles do not
+add; nodes return their t-digest centroids (``?digest=true``) and the
+merged digest is summarized here. The router in ``router.py`` calls these
+with the parsed JSON of each node's response, home node first.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from services.sketches import TDigest, faster_than, solve_time_summary
+
+COUNT_METRICS = ('count', 'correct', 'accuracy')
+
+
+def _accuracy(correct: int, attempts: int) -> float:
+    return round(correct / attempts * 100, 2) if attempts else 0
+
+
+def _merged_digest(digests: List[Optional[Dict]]) -> Optional[TDigest]:
+    merged = None
+    for data in digests:
+        if data is None:
+            continue
+        digest = TDigest.from_dict(data)
+        if merged is None:
+            merged = digest
+        else:
+            merged.merge(digest)
+    return merged
+
+
+def merge_solve_times(results: List[Dict], time_taken: Optional[float] = None) -> Dict:
+    """One solve-time summary from each node's summary with its ``digest``."""
+    digest = _merged_digest([result.get('digest') for result in results])
+    merged = {key: value for key, value in results[0].items() if key not in ('digest', 'faster_than')}
+    merged.update(solve_time_summary(digest))
+    if time_taken is not None:
+        merged['faster_than'] = faster_than(digest, time_taken)
+    return merged
+
+
+def merge_problem_stats(results: List[Dict]) -> Dict:
+    merged = dict(results[0])
+    for key in ('total_attempts', 'correct_attempts', 'total_reviews', 'unique_users'):
+        if key in merged:
+            merged[key] = sum(result.get(key, 0) for result in results)
+    merged['correct_attempts'] = min(merged['correct_attempts'], merged['total_attempts'])
+    merged['accuracy'] = _accuracy(merged['correct_attempts'], merged['total_attempts'])
+    distribution: Dict[str, int] = {}
+    for result in results:
+        for answer, n in result.get('answer_distribution', {}).items():
+            distribution[answer] = distribution.get(answer, 0) + n
+    merged['answer_distribution'] = distribution
+    if 'first_submission' in merged:
+        firsts = [r['first_submission'] for r in results if r.get('first_submission')]
+        lasts = [r['last_submission'] for r in results if r.get('last_submission')]
+        merged['first_submission'] = min(firsts) if firsts else None
+        merged['last_submission'] = max(lasts) if lasts else None
+    if 'solve_time' in merged:
+        merged['solve_time'] = merge_solve_times([result['solve_time'] for result in results])
+        merged['average_time'] = merged['solve_time']['mean'] or 0
+    if 'approximation' in merged:
+        # Overcounts add up; each node's bound fails with its own small probability
+        counts = [result['approximation']['counts'] for result in results]
+        merged['approximation'] = dict(merged['approximation'], counts={
+            'max_overcount': sum(c['max_overcount'] for c in counts),
+            'confidence': round(max(1 - sum(1 - c['confidence'] for c in counts), 0), 3)
+        })
+    return merged
+
+
+def merge_topics(results: List[Dict]) -> Dict:
+    """The home node's topic tree, with attempts, solved counts and distinct users summed over nodes."""
+    merged = results[0]
+    summed = ('attempts', 'correct', 'solved', 'unique_users')
+    others = [{(s['name'], t['name']): t for s in result['subjects'] for t in s['topics']} for result in results[1:]]
+    for subject in merged['subjects']:
+        for key in summed:
+            if key in subject:
+                subject[key] = 0
+        for topic in subject['topics']:
+            for other in others:
+                match = other.get((subject['name'], topic['name']))
+                if match is not None:
+                    for key in summed:
+                        if key in topic:
+                            topic[key] += match.get(key, 0)
+            topic['accuracy'] = _accuracy(topic['correct'], topic['attempts'])
+            for key in summed:
+                if key in subject and key in topic:
+                    subject[key] += topic[key]
+        subject['accuracy'] = _accuracy(subject['correct'], subject['attempts'])
+    return merged
+
+
+def merge_timeseries(results: List[Dict]) -> Dict:
+    """Sum series that every node returned for the same range and resolution."""
+    merged = results[0]
+    for point, *others in zip(merged['points'], *(result['points'] for result in results[1:])):
+        for key in ('submissions', 'correct', 'active_users'):
+            if key in point:
+                point[key] += sum(other[key] for other in others)
+        if 'accuracy' in point:
+            point['accuracy'] = _accuracy(point['correct'], point['submissions']) if point['submissions'] else None
+    if 'range' in merged:
+        merged['range']['distinct_users'] = sum(result['range']['distinct_users'] for result in results)
+    return merged
+
+
+def prepare_query(query: Dict) -> Tuple[Dict, List[str]]:
+    """The query to send every node, and the metrics the caller asked for.
+
+    Counts and accuracy merge exactly, so every node is asked for count and
+    correct. Time statistics need every value and are refused; they are
+    answered when the query filters on one user, whose node has them all.
+    """
+    if not isinstance(query, dict):
+        raise ValueError('Query must be a JSON object')
+    metrics = list(dict.fromkeys(query.get('metrics') or ['count']))
+    timed = [m for m in metrics if str(m).endswith('_time_taken')]
+    if timed:
+        raise ValueError(f"'{timed[0]}' needs every submission in one place; "
+                         f"filter on a single user_id or use {', '.join(COUNT_METRICS)}")
+    return dict(query, metrics=list(dict.fromkeys(metrics + ['count', 'correct']))), metrics
+
+
+def merge_query(results: List[Dict], metrics: List[str]) -> Dict:
+    group_by = results[0]['query']['group_by']
+    groups: Dict[Tuple, List[int]] = {}
+    for result in results:
+        for row in result['rows']:
+            totals = groups.setdefault(tuple(row[key] for key in group_by), [0, 0])
+            totals[0] += row['count']
+            totals[1] += row['correct']
+    rows = []
+    for group, (count, correct) in sorted(groups.items()):
+        values = {'count': count, 'correct': correct, 'accuracy': _accuracy(correct, count)}
+        rows.append(dict(zip(group_by, group), **{metric: values[metric] for metric in metrics}))
+    return {
+        'query': dict(results[0]['query'], metrics=metrics),
+        'plan': results[0]['plan'],
+        'rows': rows,
+        'cached': all(result.get('cached') for result in results)
+    }
+
+
+def merge_submissions(results: List[List[Dict]]) -> List[Dict]:
+    return sorted((s for result in results for s in result), key=lambda s: s.get('timestamp') or '')
@@ -0,0 +1,40 @@
+from typing import Optional
+import mimetypes
+import os
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'public, no-cache'
+
+
+def serve_file(path: str, etag: Optional[str] = None, immutable: bool = False,
+               accel_prefix: Optional[str] = None, accel_path: Optional[str] = None) -> Response:
+    """Serve a file with range support, validators and zero-copy where the server allows it.
+
+    ``etag`` should be a content hash when one is known (content-addressed
+    uploads); otherwise a strong tag is derived from size and mtime. The body is
+    handed to ``wsgi.file_wrapper`` so servers that support it can ``sendfile``;
+    Range and conditional requests are resolved by ``make_conditional``. With
+    ``accel_prefix`` set, the body is left to a fronting nginx through
+    ``X-Accel-Redirect`` and only headers are produced here.
+    """
+    stat = os.stat(path)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if accel_prefix:
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + accel_path.lstrip('/')
+    else:
+        data = wrap_file(request.environ, open(path, 'rb'))
+        response = Response(data, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = stat.st_size
+
+    response.set_etag(etag or f'{stat.st_size:x}-{stat.st_mtime_ns:x}')
+    response.last_modified = int(stat.st_mtime)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE
+    response.headers['Accept-Ranges'] = 'bytes'
+
+    if accel_prefix:
+        return response.make_conditional(request.environ)
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=stat.st_size)
@@ -0,0 +1,62 @@
+from bisect import bisect
+from typing import Dict, Iterable, List, Optional
+import hashlib
+
+VIRTUAL_NODES = 160
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes.
+
+    Each node is placed on the ring at ``replicas`` pseudo-random points and a
+    key belongs to the first point clockwise from its hash. Adding or removing
+    one of N nodes therefore moves only about 1/N of the keys, all of them to
+    or from that node.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = VIRTUAL_NODES):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self._nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def add(self, node: str) -> None:
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        for i in range(self.replicas):
+            point = _hash(f'{node}#{i}')
+            # Collisions are astronomically unlikely; keep the first owner so placement is stable
+            if point not in self._owners:
+                self._owners[point] = node
+        self._points = sorted(self._owners)
+
+    def remove(self, node: str) -> None:
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != node}
+        self._points = sorted(self._owners)
+
+    def node_for(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[self._points[index]]
+
+    def copy(self) -> 'HashRing':
+        ring = HashRing(replicas=self.replicas)
+        ring._points = list(self._points)
+        ring._owners = dict(self._owners)
+        ring._nodes = list(self._nodes)
+        return ring
@@ -0,0 +1,331 @@
+from typing import BinaryIO, Dict, Optional
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from werkzeug.utils import secure_filename
+from config import DATA_DIR
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov', 'webm'}
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_SIZE = 512 * 1024 * 1024
+# Partial uploads untouched for this long are deleted, checked at most every CLEANUP_INTERVAL
+STALE_UPLOAD_SECONDS = 24 * 60 * 60
+CLEANUP_INTERVAL = 60 * 60
+# <digest>.<ext> for originals, <digest>.<kind>.jpg for derivatives stored beside them
+BLOB_NAME = re.compile(r'^([0-9a-f]{64})(?:\.(?:thumb|poster))?\.([a-z0-9]+)$')
+
+
+def file_extension(filename: str) -> Optional[str]:
+    if '.' not in filename:
+        return None
+    ext = filename.rsplit('.', 1)[1].lower()
+    return ext if ext in ALLOWED_EXTENSIONS else None
+
+
+class UploadError(ValueError):
+    pass
+
+
+class MediaStore:
+    """Content-addressed media storage with resumable, streaming uploads.
+
+    Blobs are stored once per sha256 digest under ``uploads/<aa>/<bb>/<digest>.<ext>``
+    and reference counted in ``data/media_refs.json``: every review showing a
+    blob holds one reference. An upload made ahead of its review holds one too,
+    counted as ``unattached``, and drops it once the first review that attaches
+    the blob by its URL holds its own. Uploads are copied to a
+    temp file in fixed-size chunks and hashed on the way through, so memory per
+    upload does not depend on the file size. Chunked sessions keep their partial
+    file and metadata under ``uploads/tmp`` so a client can resume from the last
+    acknowledged offset, even after a restart; sessions left untouched for
+    ``STALE_UPLOAD_SECONDS`` are deleted.
+    """
+
+    def __init__(self):
+        self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.upload_dir = os.path.join(self.current_dir, 'uploads')
+        self.tmp_dir = os.path.join(self.upload_dir, 'tmp')
+        self.refs_file = os.path.join(DATA_DIR, 'media_refs.json')
+        # Guards the reference counts; each upload session also has a lock of its own
+        self._lock = threading.Lock()
+        self._session_locks: Dict[str, threading.Lock] = {}
+        self._last_cleanup = 0.0
+        self._refs: Optional[Dict[str, Dict]] = None
+        # upload id -> running sha256 for sessions whose partial file we have hashed so far
+        self._hashers: Dict[str, 'hashlib._Hash'] = {}
+
+    # Blob layout and reference counts
+    def blob_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.upload_dir, digest[:2], digest[2:4], f'{digest}.{ext}')
+
+    def resolve(self, filename: str) -> Optional[str]:
+        """Map a public blob or derivative name to its path on disk, if it is one."""
+        match = BLOB_NAME.match(filename)
+        if not match:
+            return None
+        digest = match.group(1)
+        return os.path.join(self.upload_dir, digest[:2], digest[2:4], filename)
+
+    def _load_refs(self) -> Dict[str, Dict]:
+        if self._refs is None:
+            try:
+                with open(self.refs_file, 'r') as f:
+                    self._refs = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._refs = {}
+        return self._refs
+
+    def _save_refs(self) -> None:
+        tmp_file = self.refs_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self._refs, f, separators=(',', ':'))
+        os.replace(tmp_file, self.refs_file)
+
+    def _commit_blob(self, tmp_path: str, digest: str, ext: str, size: int, attached: bool) -> Dict:
+        name = f'{digest}.{ext}'
+        with self._lock:
+            refs = self._load_refs()
+            entry = refs.get(name)
+            path = self.blob_path(digest, ext)
+            if entry is not None and os.path.exists(path):
+                os.remove(tmp_path)
+                entry['refs'] += 1
+                deduplicated = True
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                entry = {'refs': 1, 'size': size, 'created': datetime.now().isoformat()}
+                refs[name] = entry
+                deduplicated = False
+            if not attached:
+                entry['unattached'] = entry.get('unattached', 0) + 1
+            self._save_refs()
+        return {
+            'digest': digest,
+            'filename': name,
+            'path': f'/uploads/{name}',
+            'size': size,
+            'refs': entry['refs'],
+            'deduplicated': deduplicated
+        }
+
+    def acquire(self, filename: str) -> bool:
+        """Add a reference to a stored blob; False if there is no such blob."""
+        with self._lock:
+            refs = self._load_refs()
+            entry = refs.get(filename)
+            path = self.resolve(filename)
+            if entry is None or path is None or not os.path.exists(path):
+                return False
+            entry['refs'] += 1
+            self._save_refs()
+            return True
+
+    def attach(self, filename: str) -> None:
+        """Drop an unattached upload's reference once a review holds one of its own."""
+        with self._lock:
+            refs = self._load_refs()
+            entry = refs.get(filename)
+            if entry is None or not entry.get('unattached'):
+                return
+            entry['unattached'] -= 1
+            entry['refs'] -= 1
+            self._save_refs()
+
+    def release(self, filename: str) -> None:
+        """Drop one reference to a blob, deleting it when nothing refers to it."""
+        with self._lock:
+            refs = self._load_refs()
+            entry = refs.get(filename)
+            if entry is None:
+                return
+            entry['refs'] -= 1
+            if entry['refs'] <= 0:
+                del refs[filename]
+                digest = filename.split('.', 1)[0]
+                for name in (filename, f'{digest}.thumb.jpg', f'{digest}.poster.jpg'):
+                    path = self.resolve(name)
+                    if path and os.path.exists(path):
+                        os.remove(path)
+            self._save_refs()
+
+    # Single-request uploads
+    def save_stream(self, stream: BinaryIO, filename: str, attached: bool = False) -> Dict:
+        """Store an uploaded file stream, hashing it chunk by chunk.
+
+        With ``attached`` the caller keeps the reference for the review it is
+        adding; otherwise it waits, unattached, for a review to ``attach`` it.
+        """
+        ext = file_extension(filename or '')
+        if ext is None:
+            raise UploadError('Invalid file type')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, f'{uuid.uuid4()}.part')
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_SIZE:
+                        raise UploadError('File too large')
+                    hasher.update(chunk)
+                    f.write(chunk)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self._commit_blob(tmp_path, hasher.hexdigest(), ext, size, attached)
+
+    # Resumable sessions
+    def _session_path(self, upload_id: str) -> str:
+        if not re.match(r'^[0-9a-f-]{36}$', upload_id):
+            raise UploadError('Invalid upload id')
+        return os.path.join(self.tmp_dir, f'{upload_id}.json')
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.tmp_dir, f'{upload_id}.part')
+
+    def _read_session(self, upload_id: str) -> Dict:
+        try:
+            with open(self._session_path(upload_id), 'r') as f:
+                session = json.load(f)
+        except FileNotFoundError:
+            raise UploadError('Upload session not found')
+        session['offset'] = os.path.getsize(self._part_path(upload_id))
+        return session
+
+    def _session_lock(self, upload_id: str) -> threading.Lock:
+        with self._lock:
+            lock = self._session_locks.get(upload_id)
+            if lock is None:
+                lock = self._session_locks[upload_id] = threading.Lock()
+            return lock
+
+    def cleanup_stale(self, max_age: float = STALE_UPLOAD_SECONDS) -> int:
+        """Delete partial uploads and their sessions not written to for ``max_age`` seconds."""
+        try:
+            names = os.listdir(self.tmp_dir)
+        except FileNotFoundError:
+            return 0
+        cutoff = time.time() - max_age
+        removed = 0
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext != '.part':
+                continue
+            with self._session_lock(stem):
+                try:
+                    if os.path.getmtime(os.path.join(self.tmp_dir, name)) >= cutoff:
+                        continue
+                    os.remove(os.path.join(self.tmp_dir, name))
+                except FileNotFoundError:
+                    continue
+                if os.path.exists(os.path.join(self.tmp_dir, stem + '.json')):
+                    os.remove(os.path.join(self.tmp_dir, stem + '.json'))
+                self._hashers.pop(stem, None)
+                removed += 1
+            with self._lock:
+                self._session_locks.pop(stem, None)
+        if removed:
+            logger.info(f"Removed {removed} stale uploads")
+        return removed
+
+    def _maybe_cleanup(self) -> None:
+        now = time.time()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        try:
+            self.cleanup_stale()
+        except OSError:
+            logger.exception("Error removing stale uploads")
+
+    def create_session(self, filename: str, size: Optional[int] = None) -> Dict:
+        self._maybe_cleanup()
+        ext = file_extension(filename or '')
+        if ext is None:
+            raise UploadError('Invalid file type')
+        if size is not None and int(size) > MAX_UPLOAD_SIZE:
+            raise UploadError('File too large')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        upload_id = str(uuid.uuid4())
+        session = {
+            'upload_id': upload_id,
+            'filename': secure_filename(filename),
+            'ext': ext,
+            'size': int(size) if size is not None else None,
+            'created': datetime.now().isoformat()
+        }
+        open(self._part_path(upload_id), 'wb').close()
+        with open(self._session_path(upload_id), 'w') as f:
+            json.dump(session, f)
+        self._hashers[upload_id] = hashlib.sha256()
+        session['offset'] = 0
+        return session
+
+    def get_session(self, upload_id: str) -> Dict:
+        return self._read_session(upload_id)
+
+    def _hasher_for(self, upload_id: str) -> 'hashlib._Hash':
+        hasher = self._hashers.get(upload_id)
+        if hasher is None:
+            # Resumed after a restart: rebuild the running hash from the partial file
+            hasher = hashlib.sha256()
+            with open(self._part_path(upload_id), 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            self._hashers[upload_id] = hasher
+        return hasher
+
+    def append_chunk(self, upload_id: str, offset: int, stream: BinaryIO) -> Dict:
+        """Append the request body at ``offset``; the offset must match what was received so far."""
+        with self._session_lock(upload_id):
+            session = self._read_session(upload_id)
+            if offset != session['offset']:
+                raise UploadError(f"Offset mismatch, expected {session['offset']}")
+            hasher = self._hasher_for(upload_id)
+            received = session['offset']
+            with open(self._part_path(upload_id), 'ab') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                    if received > MAX_UPLOAD_SIZE or (session['size'] is not None and received > session['size']):
+                        f.truncate(session['offset'])
+                        self._hashers.pop(upload_id, None)
+                        raise UploadError('Upload exceeds declared size')
+                    hasher.update(chunk)
+                    f.write(chunk)
+            session['offset'] = received
+            return session
+
+    def complete_session(self, upload_id: str) -> Dict:
+        with self._session_lock(upload_id):
+            session = self._read_session(upload_id)
+            if session['size'] is not None and session['offset'] != session['size']:
+                raise UploadError('Upload is incomplete')
+            digest = self._hasher_for(upload_id).hexdigest()
+            self._hashers.pop(upload_id, None)
+            result = self._commit_blob(self._part_path(upload_id), digest, session['ext'], session['offset'],
+                                       attached=False)
+            os.remove(self._session_path(upload_id))
+        with self._lock:
+            self._session_locks.pop(upload_id, None)
+        result['original_filename'] = session['filename']
+        return result
+
+
+media_store = MediaStore()
@@ -0,0 +1,170 @@
+"""Export, import and drop whole users, for moving them between nodes.
+
+When the router adds or removes a node, the users whose hash moves are
+streamed from their old node to their new one as newline-delimited JSON,
+one record per line::
+
+    {"type": "user", "user_id": "u1", "profile": {...}, "stats": {...}, "answers": {...}}
+    {"type": "submission", "user_id": "u1", "problem_id": 7, "answer": "...", ...}
+
+Importing replays submissions through the same stores the submit path feeds,
+so the new node's columnar store, activity buckets, time series and topic
+index include the moved history. Dropping removes that history from the old
+node again, so each submission is counted on exactly one node.
+"""
+from typing import Dict, Iterable, Iterator, List, Optional
+import json
+
+import numpy as np
+
+from database.answer_store import answer_store
+from database.db_handler import db, profile_cache, stats_cache
+from database.state_store import state_store
+from database.submission_store import submission_store, to_micros
+from services.activity_service import activity_tracker
+from services.dedupe_service import problem_dedupe
+from services.similarity_service import similar_problems
+from services.sketch_service import stat_sketches
+from services.suggest_service import problem_suggester
+from services.timeseries_service import timeseries
+from services.topic_service import topic_index
+
+# Catalogs up to this size are indexed problem by problem; larger ones rebuild the similarity index
+CATALOG_REBUILD_SIZE = 100
+
+
+class PartitionService:
+    def list_users(self) -> List[str]:
+        """Every user this node holds a profile, stats or answers for."""
+        users = set(state_store.keys('users')) | set(state_store.keys('stats'))
+        users.update(user_id for user_id, answers in answer_store.iter_users() if answers)
+        return sorted(users)
+
+    def catalog(self) -> List[Dict]:
+        """Full problem records, correct answers included, for seeding a new node."""
+        return db.get_all_problems()
+
+    def import_catalog(self, problems: List[Dict]) -> int:
+        """Store problems from the home node: a whole catalog for a new node, or one newly created problem."""
+        added = []
+        for problem in problems:
+            # Problems already here are only updated, so sending one again does not index it twice
+            is_new = db.get_problem_by_id(problem['id']) is None
+            state_store.put('problems', problem['id'], problem)
+            if is_new:
+                problem_dedupe.add_problem(problem)
+                problem_suggester.add_problem(problem)
+                added.append(problem)
+        if len(added) > CATALOG_REBUILD_SIZE:
+            # A catalog arrives in one piece, so one full build beats inserting problem by problem
+            similar_problems.rebuild()
+        else:
+            for problem in added:
+                similar_problems.add_problem(problem)
+        return len(problems)
+
+    def export(self, user_ids: Iterable[str]) -> Iterator[str]:
+        """NDJSON lines for ``user_ids``: one user record each, then their submissions."""
+        user_ids = [str(u) for u in user_ids]
+        for user_id in user_ids:
+            yield json.dumps({
+                'type': 'user',
+                'user_id': user_id,
+                'profile': state_store.get('users', user_id),
+                'stats': state_store.get('stats', user_id),
+                'answers': answer_store.get_user_answers(user_id)
+            }) + '\n'
+
+        codes = [c for c in (submission_store.user_code(u) for u in user_ids) if c is not None]
+        if not codes:
+            return
+        codes = np.array(codes, dtype=np.int32)
+        for chunk in submission_store.chunks():
+            for row in np.flatnonzero(np.isin(chunk['user'], codes)):
+                yield json.dumps(dict(submission_store.submission_at(chunk, int(row)), type='submission')) + '\n'
+
+    def import_records(self, lines: Iterable[bytes]) -> Dict[str, int]:
+        """Apply exported records; users are written first, submissions in one append.
+
+        Importing the same records twice is harmless: submissions already
+        stored for the same user, problem and timestamp are skipped.
+        """
+        counts = {'users': 0, 'submissions': 0, 'duplicates': 0}
+        submissions = []
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record['type'] == 'user':
+                user_id = record['user_id']
+                if record.get('profile') is not None:
+                    state_store.put('users', user_id, record['profile'])
+                    profile_cache.invalidate(user_id)
+                if record.get('stats') is not None:
+                    state_store.put('stats', user_id, record['stats'])
+                    stats_cache.invalidate(user_id)
+                answers = record.get('answers') or {}
+                if answers:
+                    answer_store.update_user_answers(user_id, lambda current: current.update(answers))
+                counts['users'] += 1
+            elif record['type'] == 'submission':
+                record.pop('type')
+                submissions.append(record)
+
+        if submissions:
+            with submission_store.source_lock:
+                # A handoff retried after a partial import sends the same rows again; keep the first copy
+                users = {str(s['user_id']) for s in submissions}
+                seen = submission_store.submission_keys(users)
+                previous = submission_store.latest_answers(users)
+                fresh = []
+                for submission in submissions:
+                    key = (str(submission['user_id']), int(submission['problem_id']), to_micros(submission['timestamp']))
+                    if key not in seen:
+                        seen.add(key)
+                        fresh.append(submission)
+                submission_store.write(fresh)
+            for submission in fresh:
+                key = (str(submission['user_id']), int(submission['problem_id']))
+                activity_tracker.record(submission['user_id'], submission['timestamp'],
+                                        submission['is_correct'], submission.get('time_taken'))
+                timeseries.record(submission['user_id'], submission['timestamp'], submission['is_correct'])
+                stat_sketches.record(submission['user_id'], submission['problem_id'], submission['timestamp'],
+                                     submission['answer'], submission['is_correct'], submission.get('time_taken'),
+                                     previous.get(key))
+                previous[key] = {'answer': submission['answer'], 'is_correct': submission['is_correct']}
+                topic_index.record_submission(submission['user_id'], submission['problem_id'], submission['is_correct'])
+                problem_suggester.record_attempt(submission['problem_id'])
+            counts['submissions'] = len(fresh)
+            counts['duplicates'] = len(submissions) - len(fresh)
+        return counts
+
+    def drop(self, user_ids: Iterable[str]) -> int:
+        """Forget users that now live on another node.
+
+        Profiles, stats, answers and submission history are all removed, so
+        when the router adds up platform-wide stats across nodes every
+        submission is counted once, on the node that owns its user.
+        """
+        user_ids = [str(u) for u in user_ids]
+        for user_id in user_ids:
+            db.delete_user(user_id)
+            answer_store.delete_user(user_id)
+        self.forget_submissions(user_ids)
+        return len(user_ids)
+
+    @staticmethod
+    def forget_submissions(user_ids: List[str], generation: Optional[int] = None) -> int:
+        """Remove the users' submissions and rebuild the aggregates counted from them."""
+        removed = submission_store.remove_users(user_ids, generation)
+        for user_id in user_ids:
+            activity_tracker.delete_user(user_id)
+        if removed:
+            topic_index.rebuild()
+            timeseries.rebuild()
+            stat_sketches.rebuild()
+            problem_suggester.recount_attempts()
+        return removed
+
+
+partition_service = PartitionService()
@@ -1,51 +1,177 @@
 from database.db_handler import db
-from typing import Dict, List, Optional
+from database.answer_store import answer_store
+from database.cache import TTLCache
+from database.state_store import state_store
+from database.submission_store import submission_store
+from services.dedupe_service import problem_dedupe
+from services.similarity_service import similar_problems, TOP_K
+from services.suggest_service import problem_suggester
+from services.review_service import review_store
+from services.sketch_service import stat_sketches
+from typing import Dict, FrozenSet, List, Optional, Tuple
 import json
 import os
+import threading
 import uuid
 from datetime import datetime
+from logger import get_logger
+from config import DATA_DIR
+
+logger = get_logger(__name__)
+
+# What a problem list entry carries unless the client asks for other fields
+LIST_FIELDS = ('id', 'title', 'difficulty', 'topic', 'acceptance_rate')
+# Only shown once asked for, through /problems/<id>/hints
+LAZY_FIELDS = frozenset({'hints'})
+# Read server-side to score submissions and never served
+HIDDEN_FIELDS = frozenset({'correct_answer'})
+
+# Held from the duplicate check until the problem is indexed, so two near-identical
+# problems created at once cannot both pass the check
+_create_lock = threading.Lock()
+
+# Serialized problem lists, one per field set; every problem write clears them
+projection_cache = TTLCache('problem_projections', max_entries=32, ttl=None, negative_ttl=None,
+                            copier=lambda body: body)
+state_store.add_listener(lambda record: record['c'] == 'problems' and projection_cache.clear())
+
+# (fields to keep or None for all visible ones, fields to drop)
+Projection = Tuple[Optional[Tuple[str, ...]], FrozenSet[str]]
+
+
+def parse_projection(fields: Optional[str], exclude: Optional[str],
+                     default: Optional[Tuple[str, ...]] = None) -> Projection:
+    """Turn ``fields=`` and ``exclude=`` query values into a projection.
+
+    Without ``fields`` the ``default`` fields are kept; ``fields=*`` keeps
+    every visible field. Asking for a hidden field is a ValueError.
+    """
+    def split(value: Optional[str]) -> List[str]:
+        return [f.strip() for f in (value or '').split(',') if f.strip()]
+
+    requested = split(fields)
+    hidden = HIDDEN_FIELDS.intersection(requested)
+    if hidden:
+        raise ValueError(f"Field not available: {', '.join(sorted(hidden))}")
+    if requested == ['*']:
+        keep = None
+    elif requested:
+        keep = tuple(sorted(set(requested)))
+    else:
+        keep = default
+    # Lazy fields come along only when named in fields=
+    dropped = HIDDEN_FIELDS | frozenset(split(exclude))
+    if keep is None:
+        dropped |= LAZY_FIELDS
+    return keep, dropped
+
+
+def option_ids(problem: Dict) -> List[str]:
+    return [str(o.get('id', '')) if isinstance(o, dict) else str(o) for o in problem.get('options') or []]
+
+
+def project(problem: Dict, projection: Projection) -> Dict:
+    keep, dropped = projection
+    if keep is None:
+        return {k: v for k, v in problem.items() if k not in dropped}
+    return {k: problem[k] for k in keep if k in problem and k not in dropped}
+
+
+class DuplicateProblemError(ValueError):
+    """Raised when a new problem is a near-duplicate of existing ones."""
+
+    def __init__(self, matches: List[Dict]):
+        super().__init__(f"Problem is a near-duplicate of problem {matches[0]['id']}")
+        self.matches = matches
+
 
 class ProblemService:
     def __init__(self):
         self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.problems_file = os.path.join(self.current_dir, 'data', 'problems.json')
-        self.answers_file = os.path.join(self.current_dir, 'data', 'user_answers.json')
-        self.submissions_file = os.path.join(self.current_dir, 'data', 'submissions.json')
+        self.submissions_file = os.path.join(DATA_DIR, 'submissions.json')
 
     def get_all_problems(self) -> List[Dict]:
         try:
-            with open(self.problems_file, 'r') as f:
-                data = json.load(f)
-                # Sort problems by ID to ensure consistent order
-                problems = sorted(data['problems'], key=lambda x: x['id'])
-                return problems
-        except Exception as e:
-            print(f"Error reading problems: {e}")
+            # Sorted by ID for a consistent order
+            return db.get_all_problems()
+        except Exception:
+            logger.exception("Error reading problems")
             return []
 
     def get_problem_by_id(self, problem_id: int) -> Optional[Dict]:
         try:
-            with open(self.problems_file, 'r') as f:
-                data = json.load(f)
-                for problem in data['problems']:
-                    if problem['id'] == problem_id:
-                        return problem
-                return None
-        except Exception as e:
-            print(f"Error reading problem {problem_id}: {e}")
+            return db.get_problem_by_id(problem_id)
+        except Exception:
+            logger.exception(f"Error reading problem {problem_id}")
+            return None
+
+    def get_problems_json(self, projection: Projection) -> str:
+        """The problem list projected to ``projection``, serialized once per field set."""
+        return projection_cache.get_or_load(projection, lambda: json.dumps(
+            [project(p, projection) for p in self.get_all_problems()], separators=(',', ':')))
+
+    def get_problem_hints(self, problem_id: int) -> Optional[List[str]]:
+        problem = self.get_problem_by_id(problem_id)
+        if problem is None:
             return None
+        return problem.get('hints') or []
 
-    def create_problem(self, problem_data: Dict) -> Dict:
+    def create_problem(self, problem_data: Dict, allow_duplicates: bool = False) -> Dict:
         required_fields = ['title', 'description', 'options', 'correct_answer']
         if not all(field in problem_data for field in required_fields):
             raise ValueError("Missing required fields")
-        
-        return db.add_problem(problem_data)
+        options = problem_data['options']
+        if not isinstance(options, list) or not options or not all(
+                isinstance(o, dict) and isinstance(o.get('id'), str) and o['id'] and isinstance(o.get('text'), str)
+                for o in options):
+            raise ValueError("options must be a non-empty list of {id, text} objects")
+        option_ids = [o['id'] for o in options]
+        if len(set(option_ids)) != len(option_ids):
+            raise ValueError("Option ids must be unique")
+        if problem_data['correct_answer'] not in option_ids:
+            raise ValueError("correct_answer must be the id of one of the options")
+        with _create_lock:
+            if not allow_duplicates:
+                matches = problem_dedupe.find_duplicates(problem_data)
+                if matches:
+                    raise DuplicateProblemError(matches)
+
+            problem = db.add_problem(problem_data)
+            problem_dedupe.add_problem(problem)
+            similar_problems.add_problem(problem)
+            problem_suggester.add_problem(problem)
+        return problem
+
+    def get_similar_problems(self, problem_id: int, limit: int = 5) -> Optional[List[Dict]]:
+        """Summaries of the nearest problems by TF-IDF cosine, or None if the problem is unknown."""
+        neighbours = similar_problems.similar(problem_id, min(max(limit, 1), TOP_K))
+        if neighbours is None:
+            return None
+        similar = []
+        for neighbour_id, similarity in neighbours:
+            problem = db.get_problem_by_id(neighbour_id)
+            if problem:
+                similar.append({
+                    'id': problem['id'],
+                    'title': problem.get('title'),
+                    'difficulty': problem.get('difficulty'),
+                    'subject': problem.get('subject') or problem.get('category'),
+                    'topic': problem.get('topic'),
+                    'similarity': similarity
+                })
+        return similar
 
-    def get_problem_stats(self, problem_id: int) -> Dict:
+    def get_problem_stats(self, problem_id: int, approx: bool = False) -> Dict:
+        """Stats from every recorded answer, or with ``approx`` from the stats sketches in O(1)."""
         try:
             # Check if problem exists first
             problem = self.get_problem_by_id(problem_id)
+            if problem and approx:
+                stats = stat_sketches.problem_stats(problem_id, option_ids(problem))
+                stats['solve_time'] = stat_sketches.problem_solve_times(problem_id)
+                stats['average_time'] = stats['solve_time']['mean'] or 0
+                stats['total_reviews'] = review_store.count(problem_id)
+                return stats
             if not problem:
                 return {
                     'total_attempts': 0,
@@ -58,70 +184,51 @@ class ProblemService:
                     'last_submission': None
                 }
 
-            # Load answers data
-            with open(self.answers_file, 'r') as f:
-                answers_data = json.load(f)
-
             total_attempts = 0
             correct_attempts = 0
             answer_distribution = {}
-            total_time = 0
-            reviews_count = 0
             last_submission = None
             first_submission = None
 
-            # Convert problem_id to string since it's stored as string in JSON
-            problem_id_str = str(problem_id)
-
-            # Analyze all submissions
-            for user_id, user_answers in answers_data.get('answers', {}).items():
-                if problem_id_str in user_answers:
-                    answer_data = user_answers[problem_id_str]
-                    total_attempts += 1
-                    
-                    # Track correct attempts
-                    if answer_data.get('is_correct', False):
-                        correct_attempts += 1
-                    
-                    # Track answer distribution
-                    user_answer = answer_data.get('answer', '')
-                    answer_distribution[user_answer] = answer_distribution.get(user_answer, 0) + 1
-                    
-                    # Track reviews
-                    if answer_data.get('review'):
-                        reviews_count += 1
-                    
-                    # Track submission time
-                    timestamp = answer_data.get('timestamp')
-                    if timestamp:
-                        if not first_submission or timestamp < first_submission:
-                            first_submission = timestamp
-                        if not last_submission or timestamp > last_submission:
-                            last_submission = timestamp
+            # Analyze all submissions, gathered across answer shards
+            for user_id, answer_data in answer_store.get_problem_answers(problem_id):
+                total_attempts += 1
+                
+                # Track correct attempts
+                if answer_data.get('is_correct', False):
+                    correct_attempts += 1
+                
+                # Track answer distribution
+                user_answer = answer_data.get('answer', '')
+                answer_distribution[user_answer] = answer_distribution.get(user_answer, 0) + 1
+                
+                # Track submission time
+                timestamp = answer_data.get('timestamp')
+                if timestamp:
+                    if not first_submission or timestamp < first_submission:
+                        first_submission = timestamp
+                    if not last_submission or timestamp > last_submission:
+                        last_submission = timestamp
 
             # Calculate accuracy
             accuracy = (correct_attempts / total_attempts * 100) if total_attempts > 0 else 0
             
-            # Calculate average time (if we have both first and last submission)
-            average_time = 0
-            if first_submission and last_submission:
-                from datetime import datetime
-                time_diff = datetime.fromisoformat(last_submission) - datetime.fromisoformat(first_submission)
-                if total_attempts > 1:  # Only calculate average if we have more than one attempt
-                    average_time = time_diff.total_seconds() / total_attempts
+            # Solve times come from the time_taken of correct submissions, summarized per problem
+            solve_time = stat_sketches.problem_solve_times(problem_id)
 
             return {
                 'total_attempts': total_attempts,
                 'correct_attempts': correct_attempts,
                 'accuracy': round(accuracy, 2),
                 'answer_distribution': answer_distribution,
-                'average_time': round(average_time, 2),
-                'total_reviews': reviews_count,
+                'average_time': solve_time['mean'] or 0,
+                'solve_time': solve_time,
+                'total_reviews': review_store.count(problem_id),
                 'first_submission': first_submission,
                 'last_submission': last_submission
             }
-        except Exception as e:
-            print(f"Error getting problem stats: {e}")
+        except Exception:
+            logger.exception("Error getting problem stats")
             return {
                 'total_attempts': 0,
                 'correct_attempts': 0,
@@ -142,8 +249,8 @@ class ProblemService:
                     submissions = json.load(f)
                 return [s for s in submissions if s['problem_id'] == problem_id]
             return []
-        except Exception as e:
-            print(f"Error reading submissions for problem {problem_id}: {e}")
+        except Exception:
+            logger.exception(f"Error reading submissions for problem {problem_id}")
             return []
 
     def add_submission(self, problem_id: int, user_id: str, submission_data: Dict) -> Dict:
@@ -158,20 +265,9 @@ class ProblemService:
                 'timestamp': submission_data.get('timestamp', datetime.now().isoformat())
             }
 
-            # Load existing submissions
-            submissions = []
-            if os.path.exists(self.submissions_file):
-                with open(self.submissions_file, 'r') as f:
-                    submissions = json.load(f)
-
-            # Add new submission
-            submissions.append(submission)
-
-            # Save updated submissions
-            with open(self.submissions_file, 'w') as f:
-                json.dump(submissions, f, indent=2)
-
+            # Through the store, so the columnar copy's source_offset keeps matching the file
+            submission_store.write([submission])
             return submission
-        except Exception as e:
-            print(f"Error adding submission: {e}")
+        except Exception:
+            logger.exception("Error adding submission")
             raise
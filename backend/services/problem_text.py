@@ -0,0 +1,18 @@
+"""The searchable text of a problem, shared by the similarity and duplicate indexes."""
+from typing import Dict, List
+import re
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def problem_text(problem: Dict) -> str:
+    """Lowercased title, description and option texts."""
+    parts = [problem.get('title') or '', problem.get('description') or '']
+    for option in problem.get('options') or []:
+        parts.append(option.get('text', '') if isinstance(option, dict) else str(option))
+    return ' '.join(parts).lower()
+
+
+def problem_tokens(problem: Dict) -> List[str]:
+    """Alphanumeric words of ``problem_text``, in order."""
+    return _TOKEN.findall(problem_text(problem))
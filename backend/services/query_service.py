@@ -0,0 +1,371 @@
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List, Tuple
+import json
+import re
+import threading
+
+import numpy as np
+
+from database.db_handler import db
+from database.state_store import state_store
+from database.submission_store import EPOCH, MISSING, submission_store, to_micros
+from services.topic_service import topic_index
+
+GROUP_KEYS = ('user', 'problem', 'topic', 'subject', 'difficulty', 'day')
+FILTER_KEYS = ('user_id', 'problem_id', 'topic', 'subject', 'difficulty', 'is_correct', 'from', 'to')
+COUNT_METRICS = ('count', 'correct', 'accuracy')
+TIME_METRIC = re.compile(r'^(?:mean|p(\d{1,2}))_time_taken$')
+# Dimensions that come from the problem record; submissions to unknown problems have none
+PROBLEM_ATTRIBUTES = ('topic', 'subject', 'difficulty')
+MICROS_PER_DAY = 86400 * 1000000
+CACHE_SIZE = 256
+# Above this many possible key combinations, groups are found by sorting instead of a dense bincount
+DENSE_GROUP_LIMIT = 1 << 24
+
+
+def problem_attributes(problem: Dict) -> Dict[str, str]:
+    """Subject, topic and difficulty as the topic index derives them."""
+    subject = problem.get('subject') or problem.get('category') or 'General'
+    return {
+        'subject': subject,
+        'topic': problem.get('topic') or subject,
+        'difficulty': str(problem.get('difficulty', 'medium')).lower()
+    }
+
+
+def _as_list(value) -> List:
+    return sorted(set(value)) if isinstance(value, (list, tuple)) else [value]
+
+
+def _as_bool(value) -> bool:
+    """A JSON boolean, or "true"/"false" as a query string would send it."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    raise ValueError(f"'is_correct' must be true or false, not {value!r}")
+
+
+class QueryService:
+    """Group-by aggregations over submissions.
+
+    A query has a filter, a list of group-by keys and a list of metrics. The
+    planner answers it from the cheapest source that can:
+
+    topic_index
+        Running per-topic counters. Used for count/correct/accuracy by subject
+        or topic.
+    problem_rollup
+        Per-problem tallies. Sealed segments are counted once. Used for
+        count/correct/accuracy by problem attributes.
+    scan
+        A vectorized scan of the columnar submission store. Used for
+        everything else, such as users, days and time_taken statistics.
+
+    Results are cached by the normalized query together with the versions of
+    the submission and problem data.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[Tuple, Dict]' = OrderedDict()
+        self._attributes = None
+        self._attributes_version = None
+        self.hits = 0
+        self.misses = 0
+
+    # Query normalization and planning
+    def normalize(self, query: Dict) -> Dict:
+        if not isinstance(query, dict):
+            raise ValueError('Query must be a JSON object')
+        raw_filter = query.get('filter') or {}
+        unknown = set(raw_filter) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown filter keys: {', '.join(sorted(unknown))}")
+        filters = {}
+        for key, value in raw_filter.items():
+            if key in ('from', 'to'):
+                to_micros(str(value))
+                filters[key] = str(value)
+            elif key == 'is_correct':
+                filters[key] = _as_bool(value)
+            elif key == 'problem_id':
+                filters[key] = sorted({int(v) for v in _as_list(value)})
+            else:
+                filters[key] = sorted({str(v) for v in _as_list(value)})
+
+        group_by = []
+        for key in query.get('group_by') or []:
+            if key not in GROUP_KEYS:
+                raise ValueError(f"Cannot group by '{key}'; use one of {', '.join(GROUP_KEYS)}")
+            if key not in group_by:
+                group_by.append(key)
+
+        metrics = []
+        for metric in query.get('metrics') or ['count']:
+            if metric not in COUNT_METRICS and not TIME_METRIC.match(str(metric)):
+                raise ValueError(f"Unknown metric '{metric}'")
+            if metric not in metrics:
+                metrics.append(metric)
+        return {'filter': filters, 'group_by': group_by, 'metrics': metrics}
+
+    def plan(self, query: Dict) -> str:
+        dimensions = set(query['group_by']) | {'problem' if k == 'problem_id' else k for k in query['filter']}
+        if any(m not in COUNT_METRICS for m in query['metrics']):
+            return 'scan'
+        if dimensions and dimensions <= {'subject', 'topic'}:
+            return 'topic_index'
+        if dimensions <= {'problem', 'topic', 'subject', 'difficulty'}:
+            return 'problem_rollup'
+        return 'scan'
+
+    def execute(self, query: Dict) -> Dict:
+        normalized = self.normalize(query)
+        key = (json.dumps(normalized, sort_keys=True), submission_store.version, state_store.version)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return dict(cached, cached=True)
+            self.misses += 1
+
+        plan = self.plan(normalized)
+        result = {
+            'query': normalized,
+            'plan': plan,
+            'rows': self.run(normalized, plan),
+            'cached': False
+        }
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+    def run(self, query: Dict, plan: str) -> List[Dict]:
+        if plan == 'topic_index':
+            return self._from_topic_index(query)
+        if plan == 'problem_rollup':
+            return self._from_problem_rollup(query)
+        return self._scan(query)
+
+    # Problem attributes
+    def _problem_attributes(self) -> Dict:
+        """Problem id -> attribute code arrays, rebuilt when the problem set changes."""
+        version = state_store.version
+        if self._attributes is not None and self._attributes_version == version:
+            return self._attributes
+        problems = db.get_all_problems()
+        size = max([int(p['id']) for p in problems] + [0]) + 2
+        attributes = {'size': size, 'by_id': {}}
+        for name in PROBLEM_ATTRIBUTES:
+            values = sorted({problem_attributes(p)[name] for p in problems})
+            attributes[name + '_names'] = values
+            attributes[name] = np.full(size, -1, dtype=np.int32)
+        for problem in problems:
+            attrs = problem_attributes(problem)
+            attributes['by_id'][int(problem['id'])] = attrs
+            for name in PROBLEM_ATTRIBUTES:
+                attributes[name][int(problem['id'])] = attributes[name + '_names'].index(attrs[name])
+        self._attributes, self._attributes_version = attributes, version
+        return attributes
+
+    # Pre-aggregated sources
+    def _aggregate(self, entries, query: Dict) -> List[Dict]:
+        """Roll ``(dimensions, count, correct)`` entries up to the query's groups."""
+        filters = query['filter']
+        groups: Dict[Tuple, List[int]] = {}
+        for dims, count, correct in entries:
+            # Like a scan, only groups with submissions appear
+            if not count:
+                continue
+            if any(dims[key] not in filters[key] for key in ('subject', 'topic', 'difficulty') if key in filters):
+                continue
+            if 'problem_id' in filters and dims.get('problem') not in filters['problem_id']:
+                continue
+            group = tuple(dims[key] for key in query['group_by'])
+            totals = groups.setdefault(group, [0, 0])
+            totals[0] += count
+            totals[1] += correct
+        rows = []
+        for group, (count, correct) in sorted(groups.items()):
+            row = dict(zip(query['group_by'], group))
+            row.update(self._count_metrics(query['metrics'], count, correct))
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _count_metrics(metrics: List[str], count: int, correct: int) -> Dict:
+        values = {
+            'count': count,
+            'correct': correct,
+            'accuracy': round(correct / count * 100, 2) if count else 0
+        }
+        return {metric: values[metric] for metric in metrics}
+
+    def _from_topic_index(self, query: Dict) -> List[Dict]:
+        entries = []
+        for subject in topic_index.get_topics():
+            for topic in subject['topics']:
+                entries.append(({'subject': subject['name'], 'topic': topic['name']},
+                                topic['attempts'], topic['correct']))
+        return self._aggregate(entries, query)
+
+    def _from_problem_rollup(self, query: Dict) -> List[Dict]:
+        by_id = self._problem_attributes()['by_id']
+        needs_attributes = any(k in PROBLEM_ATTRIBUTES for k in list(query['filter']) + query['group_by'])
+        entries = []
+        for problem_id, tally in submission_store.problem_accuracy().items():
+            attrs = by_id.get(problem_id)
+            if attrs is None:
+                if needs_attributes:
+                    continue
+                attrs = {}
+            entries.append((dict(attrs, problem=problem_id), tally['attempts'], tally['correct']))
+        return self._aggregate(entries, query)
+
+    # Vectorized scan
+    def _scan(self, query: Dict) -> List[Dict]:
+        filters, group_by = query['filter'], query['group_by']
+        attributes = self._problem_attributes()
+        needs_attributes = any(k in PROBLEM_ATTRIBUTES for k in list(filters) + group_by)
+        wanted = {}
+        for name in PROBLEM_ATTRIBUTES:
+            if name in filters:
+                names = attributes[name + '_names']
+                wanted[name] = [names.index(v) for v in filters[name] if v in names]
+        user_codes = None
+        if 'user_id' in filters:
+            user_codes = [c for c in (submission_store.user_code(u) for u in filters['user_id']) if c is not None]
+
+        keys: List[List[np.ndarray]] = [[] for _ in group_by]
+        correct_parts, time_parts = [], []
+        for chunk in submission_store.chunks():
+            problem = chunk['problem']
+            # Ids past the attribute table land on its last slot, which is always -1
+            slot = np.minimum(problem, attributes['size'] - 1)
+            mask = np.ones(len(problem), dtype=bool)
+            if needs_attributes:
+                mask &= attributes['topic'][slot] >= 0
+            if user_codes is not None:
+                mask &= np.isin(chunk['user'], user_codes)
+            if 'problem_id' in filters:
+                mask &= np.isin(problem, filters['problem_id'])
+            for name, codes in wanted.items():
+                mask &= np.isin(attributes[name][slot], codes)
+            if 'is_correct' in filters:
+                mask &= chunk['correct'] == filters['is_correct']
+            if 'from' in filters:
+                mask &= chunk['timestamp'] >= to_micros(filters['from'])
+            if 'to' in filters:
+                mask &= chunk['timestamp'] < to_micros(filters['to'])
+            if not mask.any():
+                continue
+            for i, key in enumerate(group_by):
+                if key == 'user':
+                    column = chunk['user'][mask]
+                elif key == 'problem':
+                    column = problem[mask]
+                elif key == 'day':
+                    column = (chunk['timestamp'][mask] // MICROS_PER_DAY).astype(np.int64)
+                else:
+                    column = attributes[key][slot[mask]]
+                keys[i].append(column.astype(np.int64))
+            correct_parts.append(chunk['correct'][mask])
+            time_parts.append(chunk['time_taken'][mask])
+
+        if not correct_parts:
+            return []
+        correct = np.concatenate(correct_parts)
+        time_taken = np.concatenate(time_parts)
+        key_columns = [np.concatenate(parts) for parts in keys]
+        inverse, group_values = self._group(key_columns, len(correct))
+        groups = len(group_values[0]) if group_by else 1
+
+        counts = np.bincount(inverse, minlength=groups)
+        corrects = np.bincount(inverse, weights=correct, minlength=groups)
+        timed = time_taken != MISSING
+        timed_groups = inverse[timed]
+        time_values = time_taken[timed]
+        time_counts = np.bincount(timed_groups, minlength=groups)
+        time_metrics = {}
+        for metric in query['metrics']:
+            match = TIME_METRIC.match(metric)
+            if not match:
+                continue
+            if match.group(1) is None:
+                sums = np.bincount(timed_groups, weights=time_values, minlength=groups)
+                time_metrics[metric] = np.divide(sums, time_counts, out=np.zeros(groups), where=time_counts > 0)
+            else:
+                time_metrics[metric] = self._percentile(timed_groups, time_values, time_counts, int(match.group(1)))
+
+        rows = []
+        for g in range(groups):
+            row = {key: self._decode(key, values[g], attributes) for key, values in zip(group_by, group_values)}
+            row.update(self._count_metrics([m for m in query['metrics'] if m in COUNT_METRICS],
+                                           int(counts[g]), int(corrects[g])))
+            for metric, values in time_metrics.items():
+                row[metric] = round(float(values[g]), 2) if time_counts[g] else None
+            rows.append(row)
+        rows.sort(key=lambda r: tuple(r[k] for k in group_by))
+        # Keep the requested metric order
+        return [dict({k: r[k] for k in group_by}, **{m: r[m] for m in query['metrics']}) for r in rows]
+
+    @staticmethod
+    def _group(key_columns: List[np.ndarray], rows: int) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """Dense group index per row, and each key's value per group."""
+        if not key_columns:
+            return np.zeros(rows, dtype=np.int64), []
+        lows = [int(column.min()) for column in key_columns]
+        dims = [int(column.max()) - low + 1 for column, low in zip(key_columns, lows)]
+        if np.prod(dims, dtype=np.float64) <= DENSE_GROUP_LIMIT:
+            composite = np.ravel_multi_index([c - low for c, low in zip(key_columns, lows)], dims)
+            present = np.nonzero(np.bincount(composite))[0]
+            remap = np.full(int(np.prod(dims)), -1, dtype=np.int64)
+            remap[present] = np.arange(len(present))
+            inverse = remap[composite]
+            values = [v + low for v, low in zip(np.unravel_index(present, dims), lows)]
+            return inverse, values
+        unique, inverse = np.unique(np.stack(key_columns, axis=1), axis=0, return_inverse=True)
+        return inverse.reshape(-1), [unique[:, i] for i in range(len(key_columns))]
+
+    @staticmethod
+    def _percentile(groups: np.ndarray, values: np.ndarray, counts: np.ndarray, p: int) -> np.ndarray:
+        """Per-group percentile with linear interpolation, like ``np.percentile``."""
+        if not len(values):
+            return np.zeros(len(counts))
+        low_value = int(values.min())
+        span = int(values.max()) - low_value + 1
+        if span * len(counts) < 2 ** 62:
+            # One sort of (group, value) packed into an int64 is much cheaper than a lexsort
+            packed = np.sort(groups.astype(np.int64) * span + (values - low_value))
+            ordered = (packed % span + low_value).astype(np.float64)
+        else:
+            ordered = values[np.lexsort((values, groups))].astype(np.float64)
+        starts = np.cumsum(counts) - counts
+        position = starts + (np.maximum(counts, 1) - 1) * (p / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        result = np.zeros(len(counts))
+        has = counts > 0
+        result[has] = ordered[low[has]] + (ordered[high[has]] - ordered[low[has]]) * (position[has] - low[has])
+        return result
+
+    @staticmethod
+    def _decode(key: str, value, attributes: Dict):
+        if key == 'user':
+            return submission_store.user_name(int(value))
+        if key == 'day':
+            return (EPOCH + timedelta(days=int(value))).date().isoformat()
+        if key == 'problem':
+            return int(value)
+        return attributes[key + '_names'][int(value)]
+
+    def cache_stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._cache), 'hits': self.hits, 'misses': self.misses}
+
+
+query_engine = QueryService()
@@ -0,0 +1,330 @@
+"""Log-shipping replication from a primary to read-only replicas.
+
+The primary ships two ordered logs:
+
+- submissions: rows of the columnar submission store; a position is a row
+  count. Replicas append each row to their own submissions.json, columnar
+  store and answer shards, which is everything the stats and history
+  endpoints read. When the primary hands users off to another node it
+  removes their rows; the stream then sends a ``forget`` record, the replica
+  removes the same rows and resumes from its new row count.
+- state: records of the state store's write-ahead log (problems, users and
+  stats); a position is the primary's WAL sequence number.
+
+A replica is an ordinary ``app.py`` started with ``REPLICA_OF=<primary url>``,
+its own ``DATA_DIR`` and the primary's ``CLUSTER_SECRET``. It loads a snapshot of the state store, then
+follows ``GET /api/replication/stream`` on the primary. That stream sends
+NDJSON records as they happen plus a heartbeat every second carrying the
+primary's positions, from which the replica reports its lag.
+
+Read-your-writes: the primary returns the positions after a submit as an
+``X-Replication-Token`` of the form ``"<submissions>.<state>"``. A client
+sending that token back to a replica as ``X-Min-Replication-Token`` is only
+answered once the replica has applied at least that much. If it falls short
+within ``READ_YOUR_WRITES_WAIT`` seconds, the replica returns 503 so the
+client can go to the primary instead.
+"""
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+import http.client
+import json
+import os
+import threading
+import time
+
+from config import cluster_headers
+from database.answer_store import answer_store
+from database.db_handler import profile_cache, stats_cache
+from database.state_store import state_store
+from database.submission_store import submission_store
+from logger import get_logger
+from services.activity_service import activity_tracker
+from services.partition_service import partition_service
+from services.sketch_service import stat_sketches
+from services.suggest_service import problem_suggester
+from services.timeseries_service import timeseries
+from services.topic_service import topic_index
+
+logger = get_logger(__name__)
+
+HEARTBEAT_INTERVAL = 1.0
+# State records kept for replicas catching up; a replica further behind reloads the snapshot
+STATE_LOG_SIZE = 100000
+STREAM_BATCH = 1000
+APPLY_BATCH = 5000
+READ_YOUR_WRITES_WAIT = 2.0
+RECONNECT_DELAY = 1.0
+
+
+def parse_token(token: str) -> Tuple[int, int]:
+    submissions, _, state = token.partition('.')
+    return int(submissions), int(state or 0)
+
+
+class ReplicationPrimary:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._state_log: Deque[Dict] = deque(maxlen=STATE_LOG_SIZE)
+        self._started = False
+
+    def start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        state_store.add_listener(self._on_state_record)
+        submission_store.add_listener(self._on_submission)
+
+    def _on_state_record(self, record: Dict) -> None:
+        with self._cond:
+            self._state_log.append(record)
+            self._cond.notify_all()
+
+    def _on_submission(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def position(self) -> Dict[str, int]:
+        return {'submissions': submission_store.row_count(), 'state': state_store.version}
+
+    def token(self) -> str:
+        position = self.position()
+        return f"{position['submissions']}.{position['state']}"
+
+    def snapshot(self) -> Dict:
+        return state_store.export()
+
+    def _state_after(self, seq: int) -> Optional[List[Dict]]:
+        """State records after ``seq``, or None if they are no longer kept."""
+        with self._cond:
+            if seq >= state_store.version:
+                return []
+            if not self._state_log or self._state_log[0]['seq'] > seq + 1:
+                return None
+            return [r for r in self._state_log if r['seq'] > seq]
+
+    def stream(self, submissions: int, state: int, generation: int = 0) -> Iterator[str]:
+        """NDJSON replication records from the given positions on, followed live.
+
+        ``generation`` is the submission store generation the replica's row
+        position belongs to. If rows have been removed since, the stream sends
+        the removals and ends; the replica applies them and reconnects.
+        """
+        last_heartbeat = 0.0
+        while True:
+            removals = submission_store.removals_since(generation)
+            if removals:
+                for removal in removals:
+                    yield json.dumps(dict(removal, type='forget')) + '\n'
+                return
+            sent = False
+            batch = list(submission_store.iter_submissions(submissions, STREAM_BATCH))
+            if submission_store.generation != generation:
+                # Rows were removed while the batch was read, so its positions are off
+                continue
+            for submission in batch:
+                submissions += 1
+                sent = True
+                yield json.dumps({'type': 'submission', 'seq': submissions, 'submission': submission}) + '\n'
+
+            records = self._state_after(state)
+            if records is None:
+                yield json.dumps({'type': 'resnapshot'}) + '\n'
+                return
+            for record in records:
+                state = record['seq']
+                sent = True
+                yield json.dumps({'type': 'state', 'record': record}) + '\n'
+
+            now = time.time()
+            if sent or now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                last_heartbeat = now
+                yield json.dumps({'type': 'heartbeat', 'ts': now, 'position': self.position()}) + '\n'
+            if not sent:
+                with self._cond:
+                    self._cond.wait(HEARTBEAT_INTERVAL)
+
+
+class ReplicaFollower:
+    def __init__(self, primary: str):
+        self.primary = primary.rstrip('/')
+        self._cond = threading.Condition()
+        self.applied = {'submissions': 0, 'state': 0}
+        self.primary_position = {'submissions': 0, 'state': 0}
+        self.connected = False
+        # When the replica last had everything the primary had announced
+        self._caught_up_at = time.time()
+        self._pending: List[Dict] = []
+
+    def _connection(self) -> http.client.HTTPConnection:
+        url = urlsplit(self.primary)
+        return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+
+    def start(self) -> None:
+        self.applied['submissions'] = submission_store.row_count()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # Applying
+    def _load_snapshot(self) -> None:
+        conn = self._connection()
+        try:
+            conn.request('GET', '/api/replication/snapshot', headers=cluster_headers())
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f'Snapshot request failed with {response.status}')
+            snapshot = json.loads(response.read())
+        finally:
+            conn.close()
+        with state_store.lock:
+            for collection, records in snapshot['collections'].items():
+                for key in set(state_store.keys(collection)) - set(records):
+                    state_store.delete(collection, key)
+                for key, value in records.items():
+                    state_store.put(collection, key, value)
+        profile_cache.clear()
+        stats_cache.clear()
+        with self._cond:
+            self.applied['state'] = snapshot['seq']
+            self._cond.notify_all()
+        logger.info(f"Loaded state snapshot at {snapshot['seq']} from {self.primary}")
+
+    def _apply_state(self, record: Dict) -> None:
+        collection, key = record['c'], record['k']
+        if record['op'] == 'put':
+            state_store.put(collection, key, record['v'])
+        elif record['op'] == 'merge':
+            state_store.merge(collection, key, record['v'])
+        elif record['op'] == 'delete':
+            state_store.delete(collection, key)
+        if collection == 'users':
+            profile_cache.invalidate(key)
+        elif collection == 'stats':
+            stats_cache.invalidate(key)
+        with self._cond:
+            self.applied['state'] = record['seq']
+            self._cond.notify_all()
+
+    def _flush_submissions(self) -> None:
+        """Write buffered submissions with one append to submissions.json."""
+        if not self._pending:
+            return
+        submission_store.write(self._pending)
+        for submission in self._pending:
+            previous = answer_store.replace_answer(submission['user_id'], submission['problem_id'], {
+                'answer': submission['answer'],
+                'is_correct': submission['is_correct'],
+                'timestamp': submission['timestamp']
+            })
+            activity_tracker.record(submission['user_id'], submission['timestamp'],
+                                    submission['is_correct'], submission.get('time_taken'))
+            timeseries.record(submission['user_id'], submission['timestamp'], submission['is_correct'])
+            stat_sketches.record(submission['user_id'], submission['problem_id'], submission['timestamp'],
+                                 submission['answer'], submission['is_correct'], submission.get('time_taken'),
+                                 previous)
+            topic_index.record_submission(submission['user_id'], submission['problem_id'], submission['is_correct'])
+            problem_suggester.record_attempt(submission['problem_id'])
+        with self._cond:
+            self.applied['submissions'] += len(self._pending)
+            self._cond.notify_all()
+        self._pending = []
+
+    def _forget(self, user_ids: List[str], generation: int) -> None:
+        """Apply a removal of handed-off users made on the primary; row positions restart from ours."""
+        for user_id in user_ids:
+            answer_store.delete_user(user_id)
+        partition_service.forget_submissions(user_ids, generation)
+        with self._cond:
+            self.applied['submissions'] = submission_store.row_count()
+            self._cond.notify_all()
+
+    def _note_heartbeat(self, position: Dict[str, int]) -> None:
+        with self._cond:
+            self.primary_position = position
+            if all(self.applied[log] >= position[log] for log in position):
+                self._caught_up_at = time.time()
+
+    # Following
+    def _follow(self) -> None:
+        conn = self._connection()
+        try:
+            conn.request('GET', f"/api/replication/stream?submissions={self.applied['submissions']}"
+                                f"&state={self.applied['state']}&generation={submission_store.generation}",
+                         headers=cluster_headers())
+            response = conn.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f'Stream request failed with {response.status}')
+            self.connected = True
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                record = json.loads(line)
+                kind = record['type']
+                if kind == 'submission':
+                    self._pending.append(record['submission'])
+                    if len(self._pending) >= APPLY_BATCH:
+                        self._flush_submissions()
+                    continue
+                # Anything else is a batch boundary; apply buffered rows before moving on
+                self._flush_submissions()
+                if kind == 'state':
+                    self._apply_state(record['record'])
+                elif kind == 'heartbeat':
+                    self._note_heartbeat(record['position'])
+                elif kind == 'forget':
+                    self._forget(record['users'], record['generation'])
+                elif kind == 'resnapshot':
+                    self._load_snapshot()
+                    break
+        finally:
+            self._flush_submissions()
+            self.connected = False
+            conn.close()
+
+    def _run(self) -> None:
+        snapshot_loaded = False
+        while True:
+            try:
+                if not snapshot_loaded:
+                    self._load_snapshot()
+                    snapshot_loaded = True
+                self._follow()
+            except Exception as e:
+                logger.warning(f"Replication from {self.primary} interrupted: {e}")
+            time.sleep(RECONNECT_DELAY)
+
+    # Reads
+    def wait_for(self, token: str, timeout: float = READ_YOUR_WRITES_WAIT) -> bool:
+        """Block until the replica has applied ``token``'s positions; False on timeout."""
+        submissions, state = parse_token(token)
+        deadline = time.time() + timeout
+        with self._cond:
+            while self.applied['submissions'] < submissions or self.applied['state'] < state:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def lag_seconds(self) -> float:
+        with self._cond:
+            if all(self.applied[log] >= self.primary_position[log] for log in self.applied):
+                return 0.0
+            return round(time.time() - self._caught_up_at, 3)
+
+    def status(self) -> Dict:
+        with self._cond:
+            applied, primary = dict(self.applied), dict(self.primary_position)
+        return {
+            'role': 'replica',
+            'primary': self.primary,
+            'connected': self.connected,
+            'applied': applied,
+            'primary_position': primary,
+            'lag_records': {log: max(primary[log] - applied[log], 0) for log in applied},
+            'lag_seconds': self.lag_seconds()
+        }
+
+
+replication_primary = ReplicationPrimary()
+replica: Optional[ReplicaFollower] = ReplicaFollower(os.environ['REPLICA_OF']) if os.environ.get('REPLICA_OF') else None
@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional, Tuple
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from services.thumbnail_service import thumbnailer
+from config import DATA_DIR
+
+
+class ReviewStore:
+    """Per-problem, append-only review storage.
+
+    Each problem's reviews live in ``data/reviews/<problem_id>.jsonl``, one JSON
+    review per line with an ID assigned once at write time. The byte offset of
+    every line is kept in memory (built on first access to a problem), so adding
+    a review is a single append and a page of reviews is a single seek and read
+    regardless of how many reviews the problem has.
+    """
+
+    def __init__(self):
+        self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.reviews_dir = os.path.join(DATA_DIR, 'reviews')
+        self.legacy_file = os.path.join(DATA_DIR, 'reviews.json')
+        self._lock = threading.Lock()
+        self._offsets: Dict[str, List[int]] = {}
+        self._migrated = False
+
+    def _shard_path(self, problem_id: str) -> str:
+        return os.path.join(self.reviews_dir, f'{problem_id}.jsonl')
+
+    def _migrate_legacy(self) -> None:
+        """Move reviews out of the single reviews.json file the first time the store is used."""
+        if self._migrated:
+            return
+        if not os.path.isdir(self.reviews_dir):
+            os.makedirs(self.reviews_dir + '.tmp', exist_ok=True)
+            try:
+                with open(self.legacy_file, 'r') as f:
+                    legacy = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                legacy = {}
+            if not isinstance(legacy, dict):
+                legacy = {}
+            grouped: Dict[str, List[Dict]] = {}
+            # Older writers nested reviews under a "reviews" key, newer ones used the top level
+            for source in (legacy.get('reviews', {}), legacy):
+                for problem_id, reviews in source.items():
+                    if isinstance(reviews, list):
+                        grouped.setdefault(str(problem_id), []).extend(reviews)
+            for problem_id, reviews in grouped.items():
+                reviews.sort(key=lambda r: r.get('timestamp') or '')
+                with open(os.path.join(self.reviews_dir + '.tmp', f'{problem_id}.jsonl'), 'w') as f:
+                    for r in reviews:
+                        f.write(json.dumps(self._normalize(problem_id, r)) + '\n')
+            os.replace(self.reviews_dir + '.tmp', self.reviews_dir)
+        self._migrated = True
+
+    def _normalize(self, problem_id: str, review: Dict) -> Dict:
+        return {
+            'id': review.get('id') or str(uuid.uuid4()),
+            'problem_id': int(problem_id),
+            'user_id': review.get('user_id') or review.get('username') or 'Anonymous',
+            'review': review.get('review', ''),
+            'media': review.get('media'),
+            'rating': review.get('rating'),
+            'timestamp': review.get('timestamp')
+        }
+
+    def _load_offsets(self, problem_id: str) -> List[int]:
+        offsets = self._offsets.get(problem_id)
+        if offsets is not None:
+            return offsets
+        self._migrate_legacy()
+        offsets = []
+        path = self._shard_path(problem_id)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                position = 0
+                for line in f:
+                    offsets.append(position)
+                    position += len(line)
+        self._offsets[problem_id] = offsets
+        return offsets
+
+    def add_review(self, problem_id: int, user_id: str, review: str,
+                   media: Optional[str] = None, rating: Optional[int] = None) -> Dict:
+        """Append a review and return it with its permanent ID."""
+        problem_key = str(problem_id)
+        record = self._normalize(problem_key, {
+            'user_id': user_id,
+            'review': review,
+            'media': media,
+            'rating': rating,
+            'timestamp': datetime.now().isoformat()
+        })
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self._lock:
+            offsets = self._load_offsets(problem_key)
+            with open(self._shard_path(problem_key), 'ab') as f:
+                f.seek(0, os.SEEK_END)
+                offsets.append(f.tell())
+                f.write(line)
+        return record
+
+    def get_reviews(self, problem_id: int, limit: int = 20,
+                    cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Return a newest-first page of reviews and the cursor for the next page."""
+        problem_key = str(problem_id)
+        with self._lock:
+            offsets = self._load_offsets(problem_key)
+            total = len(offsets)
+            end = total if cursor is None else max(0, min(int(cursor), total))
+            start = max(0, end - limit)
+            if start >= end:
+                return [], None
+            start_offset = offsets[start]
+            end_offset = offsets[end] if end < total else None
+        with open(self._shard_path(problem_key), 'rb') as f:
+            f.seek(start_offset)
+            chunk = f.read() if end_offset is None else f.read(end_offset - start_offset)
+        reviews = [json.loads(line) for line in chunk.splitlines()[:end - start]]
+        reviews.reverse()
+        return reviews, (str(start) if start > 0 else None)
+
+    def count(self, problem_id: int) -> int:
+        with self._lock:
+            return len(self._load_offsets(str(problem_id)))
+
+
+def format_review(review: Dict) -> Dict:
+    """Shape a stored review the way the review endpoints return it."""
+    return {
+        'id': review['id'],
+        'content': review.get('review', ''),
+        'media': review.get('media'),
+        'thumbnail': thumbnailer.derivative_url(review.get('media')),
+        'author': review.get('user_id', 'Anonymous'),
+        'timestamp': review.get('timestamp')
+    }
+
+
+review_store = ReviewStore()
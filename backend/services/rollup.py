@@ -0,0 +1,120 @@
+"""Base for in-memory aggregates of the columnar submission store.
+
+An aggregate counts each submission as it arrives and is flushed to one
+``.npz`` file every ``FLUSH_INTERVAL`` seconds in an atomic write, together
+with a watermark: the number of submission-store rows it includes. On boot,
+the rows past the watermark are replayed, so a crash loses nothing and the
+first boot builds the aggregate from the whole history.
+
+Subclasses hold ``_lock`` while they change the aggregate, bump ``_rows``
+and set ``_dirty`` for every submission they count, and implement:
+
+    _reset()                empty the aggregate
+    _restore(saved)         read it back from the loaded file; raise
+                            ValueError or KeyError if it cannot be used
+    _arrays()               the arrays to save, without the watermark
+    _replay(chunks, start)  count every row from ``start`` on
+"""
+from typing import Dict, List
+import os
+import threading
+import time
+
+import numpy as np
+
+from database.submission_store import submission_store
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+FLUSH_INTERVAL = 30.0
+
+
+class SubmissionRollup:
+    # Named in log messages
+    label = 'rollup'
+    compress = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._rows = 0
+        self._dirty = False
+
+    def _reset(self) -> None:
+        raise NotImplementedError
+
+    def _restore(self, saved) -> None:
+        raise NotImplementedError
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        raise NotImplementedError
+
+    def _replay(self, chunks: List[Dict[str, np.ndarray]], start: int) -> None:
+        raise NotImplementedError
+
+    # Loading and persistence
+    def load(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._read_saved()
+            try:
+                self._catch_up()
+            except Exception:
+                logger.exception(f"Error replaying submissions into {self.label}")
+            self._flush_locked()
+            self._loaded = True
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _read_saved(self) -> None:
+        try:
+            with np.load(self.path) as saved:
+                self._reset()
+                self._restore(saved)
+                self._rows = int(saved['rows'])
+        except (FileNotFoundError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Error reading {self.label}, rebuilding: {e}")
+            self._reset()
+            self._rows = 0
+
+    def _catch_up(self) -> None:
+        chunks = submission_store.chunks()
+        total = sum(len(chunk['timestamp']) for chunk in chunks)
+        if total < self._rows:
+            # The submission store was rebuilt; start over from its rows
+            self._reset()
+            self._rows = 0
+        self._replay(chunks, self._rows)
+        self._rows = total
+
+    def _flush_locked(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            (np.savez_compressed if self.compress else np.savez)(f, rows=np.int64(self._rows), **self._arrays())
+        os.replace(tmp_file, self.path)
+        self._dirty = False
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                with self._lock:
+                    if self._dirty:
+                        self._flush_locked()
+            except Exception:
+                logger.exception(f"Error flushing {self.label}")
+
+    def rebuild(self) -> None:
+        """Recount everything from the submission store, after rows have been removed from it."""
+        self.load()
+        with self._lock:
+            self._reset()
+            self._rows = 0
+            self._catch_up()
+            self._flush_locked()
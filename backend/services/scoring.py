@@ -1,40 +1,24 @@
 from datetime import datetime, timedelta
-import json
 import os
 import statistics
+from database.answer_store import answer_store
+from database.db_handler import db
+from logger import get_logger
+
+logger = get_logger(__name__)
 
 class ScoringService:
     def __init__(self):
         self.base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.users_file = os.path.join(self.base_dir, 'data', 'users.json')
-        self.answers_file = os.path.join(self.base_dir, 'data', 'user_answers.json')
-        self.problems_file = os.path.join(self.base_dir, 'data', 'problems.json')
 
     def load_data(self):
-        try:
-            with open(self.users_file, 'r') as f:
-                users_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            users_data = {"users": {}}
-            
-        try:
-            with open(self.answers_file, 'r') as f:
-                answers_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            answers_data = {"answers": {}}
-            
-        try:
-            with open(self.problems_file, 'r') as f:
-                problems_data = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            problems_data = {"problems": []}
-            
+        users_data = {"users": db.get_all_users()}
+        answers_data = {"answers": dict(answer_store.iter_users())}
+        problems_data = {"problems": db.get_all_problems()}
         return users_data, answers_data, problems_data
 
-    def save_users_data(self, users_data):
-        os.makedirs(os.path.dirname(self.users_file), exist_ok=True)
-        with open(self.users_file, 'w') as f:
-            json.dump(users_data, f, indent=2)
+    def save_user(self, users_data, user_id):
+        db.update_user(user_id, users_data['users'][user_id])
 
     def get_global_stats(self, users_data):
         """Calculate global statistics across all users"""
@@ -87,7 +71,7 @@ class ScoringService:
                         'lastUpdated': datetime.now().isoformat()
                     }
                 }
-                self.save_users_data(users_data)
+                self.save_user(users_data, user_id)
             
             user_answers = answers_data.get('answers', {}).get(user_id, {})
 
@@ -200,11 +184,11 @@ class ScoringService:
 
             # Update users data
             users_data['users'][user_id]['stats'] = updated_stats
-            self.save_users_data(users_data)
+            self.save_user(users_data, user_id)
 
             return updated_stats
-        except Exception as e:
-            print(f"Error in calculate_score: {str(e)}")
+        except Exception:
+            logger.exception("Error in calculate_score")
             return {
                 'problemsSolved': 0,
                 'accuracyRate': 0,
@@ -257,9 +241,9 @@ class ScoringService:
 
             # Update user achievements
             users_data['users'][user_id]['achievements'] = achievements
-            self.save_users_data(users_data)
+            self.save_user(users_data, user_id)
 
             return achievements
-        except Exception as e:
-            print(f"Error in update_achievements: {str(e)}")
+        except Exception:
+            logger.exception("Error in update_achievements")
             return []
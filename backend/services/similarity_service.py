@@ -0,0 +1,363 @@
+"""Precomputed "similar problems" from TF-IDF vectors.
+
+Every problem becomes a sparse TF-IDF vector over the words of its title,
+description and option texts. It also gets one ``topic:`` and one
+``subject:`` feature, weighted ``TOPIC_WEIGHT`` and ``SUBJECT_WEIGHT``
+times a word. Words found in more than ``MAX_DF_RATIO`` of the catalog carry
+almost no signal and are dropped, like stop words.
+
+Vectors are kept as CSR arrays, with an inverted index (CSC) alongside. The
+catalog is scored in blocks: each block's word postings are gathered,
+(problem, candidate) products are summed with one sort, and the topic and
+subject terms are added for the candidates found. Only the top
+``TOP_K`` cosine neighbours of each problem are kept. A problem that shares
+no word with another is never its candidate, even when both share a topic.
+
+New problems are vectorized with the current document frequencies and
+scored against the catalog. They are then inserted into the neighbour
+lists of any problem they now beat. Existing vectors keep the IDF weights
+of the last full build.
+
+The first build runs in a background thread at startup; lookups answer
+``IndexNotReady`` (503 over HTTP) until it finishes.
+"""
+from typing import Dict, List, Optional, Tuple
+import threading
+
+import numpy as np
+
+from database.db_handler import db
+from logger import get_logger
+from services.problem_text import problem_tokens
+
+logger = get_logger(__name__)
+
+TOP_K = 20
+MAX_DF_RATIO = 0.01
+# Below this catalog size every word is kept; a ratio of a handful of problems means nothing
+MIN_STOP_DF = 50
+TOPIC_WEIGHT = 3.0
+SUBJECT_WEIGHT = 1.0
+# (problem, candidate) products materialized per scoring block
+BLOCK_PAIRS = 4_000_000
+# Problems added since the last build are searched from a small side index, merged back past this size
+DELTA_LIMIT = 2048
+
+
+class IndexNotReady(RuntimeError):
+    """The index is still being built at startup."""
+
+
+class SimilarProblemIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Held only to start the background build, never during it
+        self._start_lock = threading.Lock()
+        self._building = False
+        self._vocab: Dict[str, int] = {}
+        self._labels: Dict[str, int] = {}
+        self._reset()
+
+    def _reset(self) -> None:
+        self._ids = np.empty(0, dtype=np.int64)
+        self._rows: Dict[int, int] = {}
+        self._df = np.zeros(0, dtype=np.int64)
+        # CSR of word weights, rows in insertion order
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._terms = np.empty(0, dtype=np.int32)
+        self._weights = np.empty(0, dtype=np.float32)
+        # Topic and subject codes with their normalized weights, one entry per row
+        self._topic = np.empty(0, dtype=np.int32)
+        self._subject = np.empty(0, dtype=np.int32)
+        self._topic_w = np.empty(0, dtype=np.float32)
+        self._subject_w = np.empty(0, dtype=np.float32)
+        # Inverted index over rows [0, _indexed_rows); later rows are scanned directly
+        self._indexed_rows = 0
+        self._post_ptr = np.zeros(1, dtype=np.int64)
+        self._post_rows = np.empty(0, dtype=np.int32)
+        self._post_weights = np.empty(0, dtype=np.float32)
+        self._neighbours = np.empty((0, TOP_K), dtype=np.int32)
+        self._scores = np.empty((0, TOP_K), dtype=np.float32)
+        self._stop_df = MIN_STOP_DF
+
+    # Vectorizing
+    def _term_ids(self, tokens: List[str]) -> List[int]:
+        vocab = self._vocab
+        ids = []
+        for token in tokens:
+            term = vocab.get(token)
+            if term is None:
+                term = vocab[token] = len(vocab)
+            ids.append(term)
+        return ids
+
+    def _label(self, value: str) -> int:
+        return self._labels.setdefault(value, len(self._labels))
+
+    def _tokenize(self, problems: List[Dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Distinct (row, term, count) triples for ``problems``, sorted by row."""
+        owners, terms = [], []
+        for row, problem in enumerate(problems):
+            ids = self._term_ids(problem_tokens(problem))
+            terms.extend(ids)
+            owners.extend([row] * len(ids))
+        if len(self._df) < len(self._vocab):
+            self._df = np.concatenate([self._df, np.zeros(len(self._vocab) - len(self._df), dtype=np.int64)])
+        width = max(len(self._vocab), 1)
+        keys = np.array(owners, dtype=np.int64) * width + np.array(terms, dtype=np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        return keys // width, (keys % width).astype(np.int32), counts
+
+    def _vectorize(self, problems: List[Dict], rows: np.ndarray, terms: np.ndarray,
+                   counts: np.ndarray, total: int):
+        """Normalized CSR weights plus topic/subject codes and weights for ``problems``."""
+        idf = np.log((1 + total) / (1 + self._df[terms])) + 1
+        keep = self._df[terms] <= self._stop_df
+        rows, terms = rows[keep], terms[keep]
+        weights = ((1 + np.log(counts[keep])) * idf[keep]).astype(np.float32)
+
+        n = len(problems)
+        subjects = [p.get('subject') or p.get('category') or 'General' for p in problems]
+        topic = np.array([self._label('topic:' + (p.get('topic') or s)) for p, s in zip(problems, subjects)], dtype=np.int32)
+        subject = np.array([self._label('subject:' + s) for s in subjects], dtype=np.int32)
+        topic_counts = np.bincount(self._topic, minlength=len(self._labels))
+        subject_counts = np.bincount(self._subject, minlength=len(self._labels))
+        np.add.at(topic_counts, topic, 1)
+        np.add.at(subject_counts, subject, 1)
+        topic_w = TOPIC_WEIGHT * (np.log((1 + total) / (1 + topic_counts[topic])) + 1)
+        subject_w = SUBJECT_WEIGHT * (np.log((1 + total) / (1 + subject_counts[subject])) + 1)
+
+        norms = np.bincount(rows, weights=weights.astype(np.float64) ** 2, minlength=n)
+        norms = np.sqrt(norms + topic_w ** 2 + subject_w ** 2)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+        return (indptr, terms, weights / norms[rows].astype(np.float32), topic, subject,
+                (topic_w / norms).astype(np.float32), (subject_w / norms).astype(np.float32))
+
+    # Building
+    def load(self) -> None:
+        """Vectorize the catalog and precompute every problem's neighbours in a background thread.
+
+        A large catalog takes a while, so the server starts serving first and
+        ``similar`` raises ``IndexNotReady`` until the build is done.
+        """
+        with self._start_lock:
+            if self._loaded or self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._ensure_loaded, daemon=True).start()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                self._build_locked(db.get_all_problems())
+            except Exception:
+                logger.exception("Error building similar problems index")
+            self._loaded = True
+
+    def rebuild(self, problems: Optional[List[Dict]] = None) -> None:
+        """Recompute vectors, IDF weights and neighbours from scratch."""
+        with self._lock:
+            self._build_locked(db.get_all_problems() if problems is None else problems)
+            self._loaded = True
+
+    def _build_locked(self, problems: List[Dict]) -> None:
+        self._reset()
+        self._vocab, self._labels = {}, {}
+        n = len(problems)
+        rows, terms, counts = self._tokenize(problems)
+        self._df = np.bincount(terms, minlength=len(self._vocab)).astype(np.int64)
+        self._stop_df = max(MIN_STOP_DF, int(MAX_DF_RATIO * n))
+        (self._indptr, self._terms, self._weights, self._topic, self._subject,
+         self._topic_w, self._subject_w) = self._vectorize(problems, rows, terms, counts, n)
+        self._ids = np.array([int(p['id']) for p in problems], dtype=np.int64)
+        self._rows = {int(problem_id): row for row, problem_id in enumerate(self._ids)}
+        self._index_locked()
+        self._neighbours = np.full((n, TOP_K), -1, dtype=np.int32)
+        self._scores = np.zeros((n, TOP_K), dtype=np.float32)
+        for start, end in self._blocks(0, n):
+            self._top_block(start, end)
+
+    def _index_locked(self) -> None:
+        """Rebuild the inverted index over every row."""
+        n = len(self._ids)
+        rows = np.repeat(np.arange(n, dtype=np.int32), np.diff(self._indptr))
+        order = np.argsort(self._terms, kind='stable')
+        self._post_rows = rows[order]
+        self._post_weights = self._weights[order]
+        self._post_ptr = np.zeros(len(self._vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self._terms, minlength=len(self._vocab)), out=self._post_ptr[1:])
+        self._indexed_rows = n
+
+    def _blocks(self, start: int, end: int):
+        """Split rows [start, end) so each block gathers about BLOCK_PAIRS postings."""
+        terms = self._terms[self._indptr[start]:self._indptr[end]]
+        entry_rows = np.repeat(np.arange(end - start), np.diff(self._indptr[start:end + 1]))
+        per_row = np.bincount(entry_rows, weights=np.diff(self._post_ptr)[terms], minlength=end - start)
+        block_of = (np.cumsum(per_row) // BLOCK_PAIRS).astype(np.int64)
+        bounds = np.flatnonzero(np.diff(block_of)) + 1 + start
+        edges = [start, *bounds.tolist(), end]
+        return [(a, b) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+    # Scoring
+    def _gather(self, start: int, end: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Per-word products of rows [start, end) with every row sharing that word, self included."""
+        lo, hi = self._indptr[start], self._indptr[end]
+        entry_rows = np.repeat(np.arange(start, end, dtype=np.int64), np.diff(self._indptr[start:end + 1]))
+        entry_terms, entry_weights = self._terms[lo:hi], self._weights[lo:hi]
+
+        # Indexed rows, through the postings of each query word
+        post_start = self._post_ptr[entry_terms]
+        lengths = self._post_ptr[entry_terms + 1] - post_start
+        offsets = np.repeat(post_start - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        queries = np.repeat(entry_rows, lengths)
+        candidates = self._post_rows[offsets].astype(np.int64)
+        products = np.repeat(entry_weights, lengths) * self._post_weights[offsets]
+
+        # Rows added since the last index rebuild, matched on shared words
+        n = len(self._ids)
+        if n > self._indexed_rows:
+            d_lo = self._indptr[self._indexed_rows]
+            d_terms, d_weights = self._terms[d_lo:], self._weights[d_lo:]
+            d_rows = np.repeat(np.arange(self._indexed_rows, n), np.diff(self._indptr[self._indexed_rows:]))
+            q_order = np.argsort(entry_terms, kind='stable')
+            left = np.searchsorted(entry_terms[q_order], d_terms, 'left')
+            right = np.searchsorted(entry_terms[q_order], d_terms, 'right')
+            hits = right - left
+            match = q_order[np.repeat(left - np.cumsum(hits) + hits, hits) + np.arange(hits.sum())]
+            queries = np.concatenate([queries, entry_rows[match]])
+            candidates = np.concatenate([candidates, np.repeat(d_rows, hits)])
+            products = np.concatenate([products, entry_weights[match] * np.repeat(d_weights, hits)])
+        return queries, candidates, products
+
+    def _metadata_scores(self, queries: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        """Topic and subject terms of the cosine for (query, candidate) pairs."""
+        return (np.where(self._topic[queries] == self._topic[candidates],
+                         self._topic_w[queries] * self._topic_w[candidates], 0)
+                + np.where(self._subject[queries] == self._subject[candidates],
+                           self._subject_w[queries] * self._subject_w[candidates], 0))
+
+    def _top_block(self, start: int, end: int) -> None:
+        """Fill the (empty) neighbour lists of rows [start, end)."""
+        queries, candidates, scores = self._score_rows(start, end)
+        if not len(queries):
+            return
+        # Order by query, then best score first, with a single float sort key; cosines lie in [0, 1]
+        order = np.argsort((queries - start) * 4.0 + (2.0 - scores), kind='stable')
+        queries, candidates, scores = queries[order], candidates[order], scores[order]
+        starts = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]])
+        rank = np.arange(len(queries)) - np.repeat(starts, np.diff(np.r_[starts, len(queries)]))
+        top = rank < TOP_K
+        self._neighbours[queries[top], rank[top]] = candidates[top]
+        self._scores[queries[top], rank[top]] = scores[top]
+
+    def _score_rows(self, start: int, end: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Cosine scores of rows [start, end) against every row sharing a word with them."""
+        n = len(self._ids)
+        queries, candidates, products = self._gather(start, end)
+        keep = queries != candidates
+        keys = queries[keep] * n + candidates[keep]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse.ravel(), weights=products[keep], minlength=len(keys)).astype(np.float64)
+        queries, candidates = keys // n, keys % n
+        scores += self._metadata_scores(queries, candidates)
+        return queries, candidates, scores.astype(np.float32)
+
+    def _keep_top(self, queries: np.ndarray, candidates: np.ndarray, scores: np.ndarray) -> None:
+        """Merge scored (query, candidate) pairs into each query's top-k list."""
+        if not len(queries):
+            return
+        rows = np.unique(queries)
+        current = self._neighbours[rows]
+        valid = current >= 0
+        queries = np.concatenate([queries, np.repeat(rows, TOP_K)[valid.ravel()]])
+        candidates = np.concatenate([candidates, current[valid]])
+        scores = np.concatenate([scores, self._scores[rows][valid]])
+        order = np.lexsort((candidates, -scores, queries))
+        queries, candidates, scores = queries[order], candidates[order], scores[order]
+        # A candidate already listed can be scored again; the first, best-scored copy wins
+        _, first = np.unique(queries * len(self._ids) + candidates, return_index=True)
+        unique = np.zeros(len(queries), dtype=bool)
+        unique[first] = True
+        queries, candidates, scores = queries[unique], candidates[unique], scores[unique]
+        starts = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]])
+        rank = np.arange(len(queries)) - np.repeat(starts, np.diff(np.r_[starts, len(queries)]))
+        top = rank < TOP_K
+        self._neighbours[rows] = -1
+        self._scores[rows] = 0
+        self._neighbours[queries[top], rank[top]] = candidates[top]
+        self._scores[queries[top], rank[top]] = scores[top]
+
+    # Incremental updates
+    def add_problem(self, problem: Dict) -> None:
+        """Vectorize a new problem and merge it into every affected neighbour list."""
+        self._ensure_loaded()
+        with self._lock:
+            problem_id = int(problem['id'])
+            if problem_id in self._rows:
+                return
+            n = len(self._ids)
+            rows, terms, counts = self._tokenize([problem])
+            self._df[terms] += 1
+            # Words new to the vocabulary have empty postings until the next index rebuild
+            missing = len(self._vocab) + 1 - len(self._post_ptr)
+            if missing > 0:
+                self._post_ptr = np.concatenate([self._post_ptr, np.full(missing, self._post_ptr[-1])])
+            (indptr, terms, weights, topic, subject, topic_w, subject_w) = self._vectorize(
+                [problem], rows, terms, counts, n + 1)
+            self._indptr = np.concatenate([self._indptr, indptr[1:] + self._indptr[-1]])
+            self._terms = np.concatenate([self._terms, terms])
+            self._weights = np.concatenate([self._weights, weights])
+            self._topic = np.concatenate([self._topic, topic])
+            self._subject = np.concatenate([self._subject, subject])
+            self._topic_w = np.concatenate([self._topic_w, topic_w])
+            self._subject_w = np.concatenate([self._subject_w, subject_w])
+            self._ids = np.append(self._ids, problem_id)
+            self._rows[problem_id] = n
+            self._neighbours = np.vstack([self._neighbours, np.full((1, TOP_K), -1, dtype=np.int32)])
+            self._scores = np.vstack([self._scores, np.zeros((1, TOP_K), dtype=np.float32)])
+            if n + 1 - self._indexed_rows > DELTA_LIMIT:
+                self._index_locked()
+
+            queries, candidates, scores = self._score_rows(n, n + 1)
+            # Similarity is symmetric: the new row's scores are also its candidates' scores for it
+            self._keep_top(np.concatenate([queries, candidates]), np.concatenate([candidates, queries]),
+                           np.concatenate([scores, scores]))
+
+    # Reads
+    def similar(self, problem_id: int, limit: int = 5) -> Optional[List[Tuple[int, float]]]:
+        """``(problem id, cosine similarity)`` of up to ``limit`` nearest problems, or None if unknown."""
+        if not self._loaded:
+            self.load()
+            raise IndexNotReady('Similar problems are still being computed; try again shortly')
+        with self._lock:
+            row = self._rows.get(int(problem_id))
+            if row is None:
+                return None
+            neighbours, scores = self._neighbours[row], self._scores[row]
+            return [(int(self._ids[n]), round(float(s), 4))
+                    for n, s in zip(neighbours[:limit], scores[:limit]) if n >= 0]
+
+    def stats(self) -> Dict:
+        if not self._loaded:
+            return {'ready': False}
+        with self._lock:
+            arrays = [self._indptr, self._terms, self._weights, self._topic, self._subject, self._topic_w,
+                      self._subject_w, self._post_ptr, self._post_rows, self._post_weights,
+                      self._neighbours, self._scores, self._df, self._ids]
+            return {
+                'ready': True,
+                'problems': len(self._ids),
+                'vocabulary': len(self._vocab),
+                'stop_df': self._stop_df,
+                'nonzeros': len(self._terms),
+                'array_bytes': int(sum(a.nbytes for a in arrays))
+            }
+
+
+similar_problems = SimilarProblemIndex()
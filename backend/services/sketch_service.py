@@ -0,0 +1,372 @@
+"""Approximate per-problem, per-topic and per-day stats from sketches.
+
+Exact distinct-user counts need every user id kept per problem, topic and
+day, and exact answer distributions need a scan of every answer. These
+sketches answer the same questions in O(1) from a fixed amount of memory:
+
+- distinct users per problem: HyperLogLog, precision 10 (1 KiB each, ±3.3%)
+- distinct users per topic and per day: HyperLogLog, precision 12 (4 KiB
+  each, ±1.6%); ranges of days are merged, so "distinct users this week"
+  comes from seven day sketches
+- attempts, correct attempts and answer counts per problem: one Count-Min
+  sketch, 4 x 16384 counters (512 KiB), overcounting by at most
+  e / 16384 * N with 98% probability, N being about three times the number
+  of (user, problem) pairs answered
+- solve times (``time_taken`` of correct submissions) per problem and per
+  topic: t-digests of compression 100 and 200, which keep p50/p90/p99 within
+  about 1% of the exact percentiles in under 2 KiB each
+
+The ± figures are one standard error. They are also returned with every
+approximate answer. Problem sketches cost about 100 MiB at 100k problems
+that all have submissions.
+
+Attempts, correct attempts and answer counts follow each user's latest
+answer to a problem, which is what the exact problem stats count: a
+resubmission takes the answer it replaces out of the Count-Min sketch
+before adding its own. Distinct users, solve times and the topic and day
+sketches cover every submission.
+
+Sketches are saved to ``data/sketches/sketches.npz`` with a watermark and
+caught up from the submission store on boot, as described in
+``services.rollup``.
+
+Sketches exported by other shards are kept apart, one file per shard under
+``data/sketches/shards/``, and unioned with this node's at query time.
+Loading a shard's export again replaces it instead of counting it twice, and
+rebuilding this node's sketches leaves them alone.
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+import io
+import os
+import urllib.parse
+
+import numpy as np
+
+from config import DATA_DIR
+from database.db_handler import db
+from database.submission_store import EPOCH, submission_store, to_micros
+from logger import get_logger
+from database.submission_store import MISSING
+from services.rollup import SubmissionRollup
+from services.sketches import (CountMinSketch, HyperLogLogTable, TDigestTable, faster_than, hash64, solve_time_summary,
+                               union_count, union_digest, union_estimate)
+
+logger = get_logger(__name__)
+
+PROBLEM_PRECISION = 10
+GROUP_PRECISION = 12
+PROBLEM_COMPRESSION = 100
+TOPIC_COMPRESSION = 200
+MICROS_PER_DAY = 24 * 60 * 60 * 1000000
+
+
+def _day_key(micros: int) -> str:
+    return (EPOCH + timedelta(microseconds=micros)).date().isoformat()
+
+
+class StatsSketches(SubmissionRollup):
+    label = 'sketches'
+    compress = True
+
+    def __init__(self):
+        super().__init__(os.path.join(DATA_DIR, 'sketches', 'sketches.npz'))
+        self.shard_dir = os.path.join(DATA_DIR, 'sketches', 'shards')
+        # Shard name -> sketches exported by that shard
+        self.shards: Dict[str, StatsSketches] = {}
+        self._reset()
+
+    # Loading and persistence
+    def _reset(self) -> None:
+        self.problem_users = HyperLogLogTable(PROBLEM_PRECISION)
+        self.topic_users = HyperLogLogTable(GROUP_PRECISION)
+        self.day_users = HyperLogLogTable(GROUP_PRECISION)
+        self.counts = CountMinSketch()
+        self.problem_times = TDigestTable(PROBLEM_COMPRESSION)
+        self.topic_times = TDigestTable(TOPIC_COMPRESSION)
+
+    def _read_saved(self) -> None:
+        super()._read_saved()
+        self._load_shards()
+
+    def _load_shards(self) -> None:
+        if not os.path.isdir(self.shard_dir):
+            return
+        for filename in sorted(os.listdir(self.shard_dir)):
+            if not filename.endswith('.npz'):
+                continue
+            try:
+                with open(os.path.join(self.shard_dir, filename), 'rb') as f:
+                    self.shards[urllib.parse.unquote(filename[:-4])] = self._read(f.read())
+            except (ValueError, KeyError, OSError) as e:
+                logger.warning(f"Error reading shard sketches {filename}, skipping: {e}")
+
+    def _read(self, data: bytes) -> 'StatsSketches':
+        """Sketches exported by another shard, checked to be the same shape as this node's."""
+        with np.load(io.BytesIO(data)) as saved:
+            other = StatsSketches.__new__(StatsSketches)
+            other._restore(saved)
+        for name in ('problem_users', 'topic_users', 'day_users'):
+            if getattr(other, name).precision != getattr(self, name).precision:
+                raise ValueError(f'{name} has precision {getattr(other, name).precision}, '
+                                 f'expected {getattr(self, name).precision}')
+        if (other.counts.width, other.counts.depth) != (self.counts.width, self.counts.depth):
+            raise ValueError('Count-Min sketch has a different shape')
+        return other
+
+    def _restore(self, saved) -> None:
+        self.problem_users = HyperLogLogTable.from_arrays(saved, 'problem')
+        self.topic_users = HyperLogLogTable.from_arrays(saved, 'topic')
+        self.day_users = HyperLogLogTable.from_arrays(saved, 'day')
+        self.counts = CountMinSketch.from_arrays(saved, 'counts')
+        self.problem_times = TDigestTable.from_arrays(saved, 'problem_times')
+        self.topic_times = TDigestTable.from_arrays(saved, 'topic_times')
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return dict(**self.problem_users.to_arrays('problem'),
+                    **self.topic_users.to_arrays('topic'), **self.day_users.to_arrays('day'),
+                    **self.counts.to_arrays('counts'), **self.problem_times.to_arrays('problem_times'),
+                    **self.topic_times.to_arrays('topic_times'))
+
+    def _replay(self, chunks: List[Dict[str, np.ndarray]], start: int) -> None:
+        topics = {int(p['id']): p.get('topic') for p in db.get_all_problems()}
+        user_hashes: Dict[int, int] = {}
+        offset = 0
+        for chunk in chunks:
+            size = len(chunk['timestamp'])
+            if offset + size > start:
+                self._add_chunk(chunk, max(start - offset, 0), topics, user_hashes)
+            offset += size
+        self._count_latest_answers(chunks, start)
+
+    def _count_latest_answers(self, chunks: List[Dict[str, np.ndarray]], start: int) -> None:
+        """Move the counts of every (user, problem) answered from row ``start`` on to its latest answer."""
+        pairs = [(chunk['user'].astype(np.int64) << 32) | chunk['problem'] for chunk in chunks]
+        offsets = np.cumsum([0] + [len(p) for p in pairs])
+        tails = [p[max(start - offset, 0):] for p, offset in zip(pairs, offsets) if offset + len(p) > start]
+        if not tails:
+            return
+        touched = np.unique(np.concatenate(tails))
+        parts = []
+        for chunk, pair, offset in zip(chunks, pairs, offsets):
+            rows = np.flatnonzero(np.isin(pair, touched))
+            parts.append((rows + offset, pair[rows], chunk['answer'][rows], chunk['correct'][rows]))
+        rows, keys, answers, correct = (np.concatenate(column) for column in zip(*parts))
+        # Stable, so each pair's rows stay in submission order
+        order = np.argsort(keys, kind='stable')
+        rows, keys, answers, correct = rows[order], keys[order], answers[order], correct[order]
+        pair_ends = np.r_[keys[1:] != keys[:-1], True]
+        before = rows < start
+        # The answer each pair had at the watermark comes out, its latest answer goes in
+        latest_before = before & (pair_ends | ~np.r_[before[1:], False])
+        names: List[str] = []
+        signs: List[int] = []
+        for selected, sign in ((pair_ends, 1), (latest_before, -1)):
+            for problem, answer, ok in zip((keys[selected] & 0xFFFFFFFF).tolist(), answers[selected].tolist(),
+                                           correct[selected].tolist()):
+                names += [f'attempts|{problem}', f'answer|{problem}|{submission_store.answer_text(answer)}']
+                names += [f'correct|{problem}'] if ok else []
+                signs += [sign] * (3 if ok else 2)
+        unique, inverse = np.unique(np.array(names, dtype=str), return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=signs, minlength=len(unique)).astype(np.int64)
+        changed = totals != 0
+        self.counts.add(hash64(unique[changed].tolist()), totals[changed])
+
+    def _add_chunk(self, chunk: Dict[str, np.ndarray], start: int, topics: Dict[int, Optional[str]],
+                   user_hashes: Dict[int, int]) -> None:
+        users = chunk['user'][start:]
+        problems = chunk['problem'][start:].tolist()
+        # Hash each user once per replay rather than once per submission
+        codes, inverse = np.unique(users, return_inverse=True)
+        missing = [code for code in codes.tolist() if code not in user_hashes]
+        user_hashes.update(zip(missing, hash64(submission_store.user_name(code) for code in missing).tolist()))
+        hashes = np.array([user_hashes[code] for code in codes.tolist()], dtype=np.uint64)[inverse.ravel()]
+
+        self.problem_users.add([str(p) for p in problems], hashes)
+        topic_keys = [topics.get(p) for p in problems]
+        has_topic = np.array([t is not None for t in topic_keys], dtype=bool)
+        self.topic_users.add([t for t in topic_keys if t is not None], hashes[has_topic])
+        days, day_index = np.unique(chunk['timestamp'][start:] // MICROS_PER_DAY, return_inverse=True)
+        day_keys = [_day_key(day * MICROS_PER_DAY) for day in days.tolist()]
+        self.day_users.add([day_keys[i] for i in day_index.ravel().tolist()], hashes)
+
+        time_taken = chunk['time_taken'][start:]
+        solved = np.flatnonzero(chunk['correct'][start:] & (time_taken != MISSING))
+        if len(solved):
+            solved_problems = np.array(problems)[solved]
+            order = np.argsort(solved_problems, kind='stable')
+            solved, solved_problems = solved[order], solved_problems[order]
+            bounds = np.flatnonzero(np.diff(solved_problems)) + 1
+            for rows in np.split(solved, bounds):
+                problem_id = problems[rows[0]]
+                self.problem_times.digest(str(problem_id)).add_many(time_taken[rows])
+                if topics.get(problem_id):
+                    self.topic_times.digest(topics[problem_id]).add_many(time_taken[rows])
+        self._dirty = True
+
+    # Updating
+    def record(self, user_id: str, problem_id: int, timestamp: str, answer: str, is_correct: bool,
+               time_taken: Optional[int] = None, previous: Optional[Dict] = None) -> None:
+        """Add one submission; call after it has been appended to the submission store.
+
+        ``previous`` is the user's earlier answer to the problem that this one
+        replaces, as the answer store held it; its counts are taken out.
+        """
+        self.load()
+        problem = db.get_problem_by_id(problem_id) or {}
+        user_hash = hash64([user_id])
+        keys = [f'attempts|{problem_id}', f'answer|{problem_id}|{answer}']
+        if is_correct:
+            keys.append(f'correct|{problem_id}')
+        signs = [1] * len(keys)
+        if previous is not None:
+            keys += [f'attempts|{problem_id}', f"answer|{problem_id}|{previous.get('answer', '')}"]
+            if previous.get('is_correct'):
+                keys.append(f'correct|{problem_id}')
+            signs += [-1] * (len(keys) - len(signs))
+        with self._lock:
+            self._rows += 1
+            self.problem_users.add([str(problem_id)], user_hash)
+            if problem.get('topic'):
+                self.topic_users.add([problem['topic']], user_hash)
+            self.day_users.add([_day_key(to_micros(timestamp))], user_hash)
+            self.counts.add(hash64(keys), signs)
+            if is_correct and time_taken is not None:
+                self.problem_times.digest(str(problem_id)).add(time_taken)
+                if problem.get('topic'):
+                    self.topic_times.digest(problem['topic']).add(time_taken)
+            self._dirty = True
+
+    def put_shard(self, name: str, data: bytes) -> None:
+        """Keep sketches exported by shard ``name``, replacing any it sent before."""
+        self.load()
+        if not name:
+            raise ValueError('Shard name is required')
+        other = self._read(data)
+        os.makedirs(self.shard_dir, exist_ok=True)
+        path = os.path.join(self.shard_dir, urllib.parse.quote(name, safe='') + '.npz')
+        with self._lock:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            self.shards[name] = other
+
+    def remove_shard(self, name: str) -> bool:
+        self.load()
+        with self._lock:
+            if self.shards.pop(name, None) is None:
+                return False
+            os.remove(os.path.join(self.shard_dir, urllib.parse.quote(name, safe='') + '.npz'))
+            return True
+
+    def export_bytes(self) -> bytes:
+        """This node's own sketches, without the shards loaded into it."""
+        self.load()
+        buffer = io.BytesIO()
+        with self._lock:
+            np.savez_compressed(buffer, **self._arrays())
+        return buffer.getvalue()
+
+    # Queries, over this node's sketches and every shard's
+    def _views(self) -> List['StatsSketches']:
+        return [self, *self.shards.values()]
+
+    def _error(self) -> Dict:
+        # Overcounts add up across the sketches, as they would in the merged sketch
+        total = sum(view.counts.total for view in self._views())
+        return {'max_overcount': int(np.ceil(np.e / self.counts.width * total)),
+                'confidence': round(self.counts.confidence, 3)}
+
+    def problem_stats(self, problem_id: int, answers: Iterable[str]) -> Dict:
+        """Approximate attempts, accuracy, distinct users and counts of the given answers."""
+        self.load()
+        answers = list(answers)
+        keys = [f'attempts|{problem_id}', f'correct|{problem_id}'] + [f'answer|{problem_id}|{a}' for a in answers]
+        with self._lock:
+            views = self._views()
+            estimates = union_estimate([view.counts for view in views], hash64(keys)).tolist()
+            unique_users = union_count([view.problem_users for view in views], [str(problem_id)])
+            error = self._error()
+        # Answers kept from before submissions were recorded can take a counter below zero
+        estimates = [max(n, 0) for n in estimates]
+        total_attempts, correct_attempts = estimates[0], min(estimates[1], estimates[0])
+        return {
+            'total_attempts': total_attempts,
+            'correct_attempts': correct_attempts,
+            'accuracy': round(correct_attempts / total_attempts * 100, 2) if total_attempts else 0,
+            'answer_distribution': {a: n for a, n in zip(answers, estimates[2:]) if n},
+            'unique_users': unique_users,
+            'approximation': {
+                'unique_users_relative_error': round(self.problem_users.relative_error, 4),
+                'counts': error
+            }
+        }
+
+    @staticmethod
+    def _solve_times(digest, time_taken: Optional[float], with_digest: bool) -> Dict:
+        result = solve_time_summary(digest)
+        if time_taken is not None:
+            result['faster_than'] = faster_than(digest, time_taken)
+        if with_digest:
+            # Centroids for a router to merge with other nodes'
+            result['digest'] = digest.to_dict() if digest is not None else None
+        return result
+
+    def problem_solve_times(self, problem_id: int, time_taken: Optional[float] = None,
+                            with_digest: bool = False) -> Dict:
+        """Solve-time percentiles in seconds, and how ``time_taken`` ranks against them."""
+        self.load()
+        with self._lock:
+            digest = union_digest([view.problem_times for view in self._views()], str(problem_id))
+            return self._solve_times(digest, time_taken, with_digest)
+
+    def topic_solve_times(self, topic: str, with_digest: bool = False) -> Dict:
+        self.load()
+        with self._lock:
+            return self._solve_times(union_digest([view.topic_times for view in self._views()], topic), None,
+                                     with_digest)
+
+    def faster_than(self, problem_id: int, time_taken: float) -> Optional[float]:
+        """Percent of recorded solves of the problem slower than ``time_taken``."""
+        self.load()
+        with self._lock:
+            digest = union_digest([view.problem_times for view in self._views()], str(problem_id))
+            return faster_than(digest, time_taken)
+
+    def topic_unique_users(self, topics: Iterable[str]) -> Dict[str, int]:
+        self.load()
+        with self._lock:
+            tables = [view.topic_users for view in self._views()]
+            return {topic: union_count(tables, [topic]) for topic in topics}
+
+    def distinct_users(self, start: date, end: date) -> Dict:
+        """Approximate distinct users who submitted on any day from ``start`` to ``end`` inclusive."""
+        self.load()
+        days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+        with self._lock:
+            return {
+                'from': start.isoformat(),
+                'to': end.isoformat(),
+                'distinct_users': union_count([view.day_users for view in self._views()], days),
+                'relative_error': round(self.day_users.relative_error, 4)
+            }
+
+    def stats(self) -> Dict:
+        self.load()
+        with self._lock:
+            return {
+                'rows': self._rows,
+                'shards': sorted(self.shards),
+                'problems': len(self.problem_users.keys),
+                'topics': len(self.topic_users.keys),
+                'days': len(self.day_users.keys),
+                'count_total': self.counts.total,
+                'solve_time_digests': len(self.problem_times.digests) + len(self.topic_times.digests),
+                'bytes': int(self.problem_users.registers[:len(self.problem_users.keys)].nbytes
+                             + self.topic_users.registers[:len(self.topic_users.keys)].nbytes
+                             + self.day_users.registers[:len(self.day_users.keys)].nbytes
+                             + self.counts.counts.nbytes)
+            }
+
+
+stat_sketches = StatsSketches()
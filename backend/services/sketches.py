@@ -0,0 +1,380 @@
+"""Mergeable probabilistic sketches for counting over large streams.
+
+HyperLogLog estimates how many distinct values were added. With 2^p one-byte
+registers its relative standard error is 1.04 / sqrt(2^p):
+
+    precision 10    1 KiB    3.3%
+    precision 12    4 KiB    1.6%
+    precision 14   16 KiB    0.8%
+
+Count-Min estimates how often each key was added. With ``width`` columns and
+``depth`` rows an estimate never undercounts, and it overcounts by at most
+e / width * N (N being the total added) with probability 1 - e^-depth.
+Keys can be removed again by adding negative counts, as long as no key's
+true count goes below zero; N is then the total still counted.
+
+Both merge without loss: the union of two HyperLogLogs is their register-wise
+maximum, and two Count-Min sketches of equal shape add up. So sketches built
+on different shards or over different days combine into exactly the sketch
+the combined stream would have produced. The ``union_*`` functions answer
+from several sketches as if they had been merged, without building the
+merged copy.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence
+import hashlib
+import math
+
+import numpy as np
+
+SOLVE_PERCENTILES = (50, 90, 99)
+
+
+def hash64(values: Iterable[str]) -> np.ndarray:
+    """Stable 64-bit hashes, the same on every node and across restarts."""
+    return np.fromiter((int.from_bytes(hashlib.blake2b(str(v).encode('utf-8'), digest_size=8).digest(), 'little')
+                        for v in values), dtype=np.uint64)
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    # Exact for 32-bit halves: frexp's exponent is the bit length of an integer-valued float
+    high, low = values >> np.uint64(32), values & np.uint64(0xFFFFFFFF)
+    high_bits = np.frexp(high.astype(np.float64))[1]
+    low_bits = np.frexp(low.astype(np.float64))[1]
+    return np.where(high > 0, high_bits + 32, low_bits)
+
+
+def hll_estimate(registers: np.ndarray) -> float:
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        # Linear counting is more accurate while many registers are still empty
+        estimate = m * math.log(m / zeros)
+    return estimate
+
+
+class HyperLogLogTable:
+    """Many HyperLogLogs of one precision, keyed by string, in one register matrix."""
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self.registers = np.zeros((0, 1 << precision), dtype=np.uint8)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(1 << self.precision)
+
+    def _row(self, key: str) -> int:
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = len(self.keys)
+            self.keys.append(key)
+            if row >= len(self.registers):
+                grown = np.zeros((max(2 * len(self.registers), 16), self.registers.shape[1]), dtype=np.uint8)
+                grown[:len(self.registers)] = self.registers
+                self.registers = grown
+        return row
+
+    def add(self, keys: List[str], hashes: np.ndarray) -> None:
+        """Add ``hashes[i]`` to the sketch of ``keys[i]``."""
+        if not len(hashes):
+            return
+        rows = np.array([self._row(key) for key in keys], dtype=np.int64)
+        width = 64 - self.precision
+        index = (hashes >> np.uint64(width)).astype(np.int64)
+        rest = hashes << np.uint64(self.precision)
+        rank = np.minimum(64 - _bit_length(rest), width) + 1
+        np.maximum.at(self.registers, (rows, index), rank.astype(np.uint8))
+
+    def merged(self, keys: Iterable[str]) -> Optional[np.ndarray]:
+        """Registers of the union of ``keys``' sketches, or None if none exist."""
+        rows = [self._rows[key] for key in keys if key in self._rows]
+        if not rows:
+            return None
+        return self.registers[rows].max(axis=0)
+
+    def count(self, keys: Iterable[str]) -> int:
+        registers = self.merged(keys)
+        return 0 if registers is None else int(round(hll_estimate(registers)))
+
+    def merge(self, other: 'HyperLogLogTable') -> None:
+        if other.precision != self.precision:
+            raise ValueError(f'Cannot merge precision {other.precision} into {self.precision}')
+        for key, registers in zip(other.keys, other.registers):
+            row = self._row(key)
+            np.maximum(self.registers[row], registers, out=self.registers[row])
+
+    # Persistence as plain arrays, so sketches save with np.savez without pickling
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {f'{prefix}_keys': np.array(self.keys, dtype=str),
+                f'{prefix}_registers': self.registers[:len(self.keys)]}
+
+    @classmethod
+    def from_arrays(cls, saved, prefix: str) -> 'HyperLogLogTable':
+        registers = saved[f'{prefix}_registers']
+        table = cls(int(math.log2(registers.shape[1])))
+        table.keys = saved[f'{prefix}_keys'].tolist()
+        table._rows = {key: row for row, key in enumerate(table.keys)}
+        table.registers = np.array(registers, dtype=np.uint8)
+        return table
+
+
+class CountMinSketch:
+    def __init__(self, width: int = 1 << 14, depth: int = 4):
+        if width & (width - 1):
+            raise ValueError('Count-Min width must be a power of two')
+        self.width = width
+        self.depth = depth
+        self.counts = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    @property
+    def error_bound(self) -> float:
+        """Largest overcount of any estimate, with probability ``confidence``."""
+        return math.e / self.width * self.total
+
+    @property
+    def confidence(self) -> float:
+        return 1 - math.exp(-self.depth)
+
+    def _columns(self, hashes: np.ndarray) -> np.ndarray:
+        # Kirsch-Mitzenmacher: row i hashes to h1 + i * h2, from the two halves of one 64-bit hash
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        with np.errstate(over='ignore'):
+            return ((h1 + rows * h2) & np.uint64(self.width - 1)).astype(np.int64)
+
+    def add(self, hashes: np.ndarray, counts=1) -> None:
+        """Add each hashed key ``counts`` times (a scalar, or one count per key; negative to remove)."""
+        if not len(hashes):
+            return
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.int64), hashes.shape)
+        columns = self._columns(hashes)
+        for row in range(self.depth):
+            np.add.at(self.counts[row], columns[row], counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, hashes: np.ndarray) -> np.ndarray:
+        columns = self._columns(hashes)
+        return self.counts[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Cannot merge Count-Min sketches of different shapes')
+        self.counts += other.counts
+        self.total += other.total
+
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {f'{prefix}_counts': self.counts, f'{prefix}_total': np.int64(self.total)}
+
+    @classmethod
+    def from_arrays(cls, saved, prefix: str) -> 'CountMinSketch':
+        counts = saved[f'{prefix}_counts']
+        sketch = cls(counts.shape[1], counts.shape[0])
+        sketch.counts = np.array(counts, dtype=np.int64)
+        sketch.total = int(saved[f'{prefix}_total'])
+        return sketch
+
+
+class TDigest:
+    """Streaming quantiles: a few dozen weighted centroids summarize any number of values.
+
+    Centroids are kept small near both tails (the arcsine scale function), so
+    p99 is as accurate as p50. Values are buffered and folded in
+    ``BUFFER_SIZE`` at a time, and two digests merge by folding one's centroids
+    into the other's.
+    """
+    BUFFER_SIZE = 256
+
+    def __init__(self, compression: int = 100):
+        self.compression = compression
+        self.means = np.empty(0, dtype=np.float64)
+        self.weights = np.empty(0, dtype=np.float64)
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer: List[float] = []
+
+    @property
+    def count(self) -> int:
+        return int(self.weights.sum()) + len(self._buffer)
+
+    def add(self, value: float) -> None:
+        self._buffer.append(float(value))
+        if len(self._buffer) >= self.BUFFER_SIZE:
+            self._flush()
+
+    def add_many(self, values: np.ndarray) -> None:
+        if len(values):
+            self._fold(np.asarray(values, dtype=np.float64), np.ones(len(values)))
+
+    def merge(self, other: 'TDigest') -> None:
+        other._flush()
+        if len(other.weights):
+            self._fold(other.means, other.weights, other.min, other.max)
+
+    def _flush(self) -> None:
+        if self._buffer:
+            values, self._buffer = np.array(self._buffer), []
+            self._fold(values, np.ones(len(values)))
+
+    def _fold(self, means: np.ndarray, weights: np.ndarray,
+              low: Optional[float] = None, high: Optional[float] = None) -> None:
+        self.min = min(self.min, means.min() if low is None else low)
+        self.max = max(self.max, means.max() if high is None else high)
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        # Cluster j takes the items whose left quantile q satisfies floor(k(q)) == j
+        q = (np.cumsum(weights) - weights) / weights.sum()
+        k = np.floor(self.compression / (2 * math.pi) * np.arcsin(2 * q - 1))
+        cluster = np.cumsum(np.r_[True, k[1:] != k[:-1]]) - 1
+        self.weights = np.bincount(cluster, weights)
+        self.means = np.bincount(cluster, weights * means) / self.weights
+
+    def _curve(self):
+        """Cumulative weight at each centroid's centre, bracketed by the exact min and max."""
+        self._flush()
+        centres = np.cumsum(self.weights) - self.weights / 2
+        total = self.weights.sum()
+        return np.r_[0, centres, total], np.r_[self.min, self.means, self.max], total
+
+    def quantile(self, q: float) -> Optional[float]:
+        positions, values, total = self._curve()
+        if not total:
+            return None
+        return float(np.interp(q * total, positions, values))
+
+    def cdf(self, value: float) -> Optional[float]:
+        """Estimated fraction of values at or below ``value``."""
+        positions, values, total = self._curve()
+        if not total:
+            return None
+        return float(np.interp(value, values, positions) / total)
+
+    def mean(self) -> Optional[float]:
+        self._flush()
+        total = self.weights.sum()
+        return float((self.means * self.weights).sum() / total) if total else None
+
+    # Centroids as JSON, so nodes can return digests that a router merges
+    def to_dict(self) -> Dict:
+        self._flush()
+        return {'compression': self.compression, 'means': self.means.tolist(), 'weights': self.weights.tolist(),
+                'min': self.min if len(self.weights) else None, 'max': self.max if len(self.weights) else None}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TDigest':
+        digest = cls(int(data['compression']))
+        digest.means = np.array(data['means'], dtype=np.float64)
+        digest.weights = np.array(data['weights'], dtype=np.float64)
+        if len(digest.weights):
+            digest.min, digest.max = float(data['min']), float(data['max'])
+        return digest
+
+
+class TDigestTable:
+    """TDigests keyed by string, persisted as one flat set of centroid arrays."""
+
+    def __init__(self, compression: int = 100):
+        self.compression = compression
+        self.digests: Dict[str, TDigest] = {}
+
+    def get(self, key: str) -> Optional[TDigest]:
+        return self.digests.get(key)
+
+    def digest(self, key: str) -> TDigest:
+        digest = self.digests.get(key)
+        if digest is None:
+            digest = self.digests[key] = TDigest(self.compression)
+        return digest
+
+    def merge(self, other: 'TDigestTable') -> None:
+        for key, digest in other.digests.items():
+            self.digest(key).merge(digest)
+
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        keys = list(self.digests)
+        for key in keys:
+            self.digests[key]._flush()
+        digests = [self.digests[key] for key in keys]
+        return {
+            f'{prefix}_keys': np.array(keys, dtype=str),
+            f'{prefix}_sizes': np.array([len(d.means) for d in digests], dtype=np.int64),
+            f'{prefix}_means': np.concatenate([d.means for d in digests]) if digests else np.empty(0),
+            f'{prefix}_weights': np.concatenate([d.weights for d in digests]) if digests else np.empty(0),
+            f'{prefix}_bounds': np.array([(d.min, d.max) for d in digests], dtype=np.float64).reshape(-1, 2),
+            f'{prefix}_compression': np.int64(self.compression)
+        }
+
+    @classmethod
+    def from_arrays(cls, saved, prefix: str) -> 'TDigestTable':
+        table = cls(int(saved[f'{prefix}_compression']))
+        offsets = np.r_[0, np.cumsum(saved[f'{prefix}_sizes'])]
+        means, weights, bounds = saved[f'{prefix}_means'], saved[f'{prefix}_weights'], saved[f'{prefix}_bounds']
+        for i, key in enumerate(saved[f'{prefix}_keys'].tolist()):
+            digest = table.digest(key)
+            digest.means = np.array(means[offsets[i]:offsets[i + 1]])
+            digest.weights = np.array(weights[offsets[i]:offsets[i + 1]])
+            digest.min, digest.max = float(bounds[i, 0]), float(bounds[i, 1])
+        return table
+
+
+# Queries over several sketches of the same shape, answered as their merge would answer them
+def union_count(tables: Sequence[HyperLogLogTable], keys: Iterable[str]) -> int:
+    keys = list(keys)
+    merged = [registers for registers in (table.merged(keys) for table in tables) if registers is not None]
+    return int(round(hll_estimate(np.max(merged, axis=0)))) if merged else 0
+
+
+def union_estimate(sketches: Sequence[CountMinSketch], hashes: np.ndarray) -> np.ndarray:
+    columns = sketches[0]._columns(hashes)
+    rows = np.arange(sketches[0].depth)[:, None]
+    return sum(sketch.counts[rows, columns] for sketch in sketches).min(axis=0)
+
+
+def union_digest(tables: Sequence[TDigestTable], key: str) -> Optional[TDigest]:
+    digests = [digest for digest in (table.get(key) for table in tables) if digest is not None]
+    if len(digests) <= 1:
+        return digests[0] if digests else None
+    union = TDigest(digests[0].compression)
+    for digest in digests:
+        union.merge(digest)
+    return union
+
+
+def solve_time_summary(digest: Optional[TDigest]) -> Dict:
+    """Count, mean and percentiles of a digest of solve times, in seconds."""
+    if digest is None or not digest.count:
+        return {'count': 0, 'mean': None, **{f'p{p}': None for p in SOLVE_PERCENTILES}}
+    return {'count': digest.count, 'mean': round(digest.mean(), 2),
+            **{f'p{p}': round(digest.quantile(p / 100), 1) for p in SOLVE_PERCENTILES}}
+
+
+def faster_than(digest: Optional[TDigest], time_taken: float) -> Optional[float]:
+    """Percent of the digest's solve times slower than ``time_taken``."""
+    if digest is None or not digest.count:
+        return None
+    return round((1 - digest.cdf(time_taken)) * 100, 1)
+
+
+def merge_saved(saved: Sequence) -> Dict[str, np.ndarray]:
+    """Merge sets of sketches saved with ``to_arrays`` under the same prefixes, such as several nodes' exports."""
+    # The array each sketch type saves under its prefix tells the types apart
+    kinds = {'registers': HyperLogLogTable, 'counts': CountMinSketch, 'compression': TDigestTable}
+    prefixes = {}
+    for name in saved[0].files:
+        prefix, _, suffix = name.rpartition('_')
+        if suffix in kinds:
+            prefixes[prefix] = kinds[suffix]
+    arrays = {}
+    for prefix, kind in prefixes.items():
+        merged = kind.from_arrays(saved[0], prefix)
+        for other in saved[1:]:
+            merged.merge(kind.from_arrays(other, prefix))
+        arrays.update(merged.to_arrays(prefix))
+    return arrays
@@ -0,0 +1,218 @@
+from typing import Dict, List, Optional, Tuple
+import heapq
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from logger import get_logger
+from config import DATA_DIR
+
+logger = get_logger(__name__)
+
+DAY_SECONDS = 24 * 60 * 60
+MIN_EASE = 1.3
+DEFAULT_EASE = 2.5
+
+
+class StudyPlanService:
+    """SM-2 spaced-repetition scheduler for missed problems.
+
+    A card is created the first time a user misses a problem and is
+    rescheduled on every later answer to it. Each user has a heap of
+    ``(due, problem_id)`` entries and a global heap of
+    ``(due, user_id, problem_id)`` backs the "today's reviews" view. Both heaps
+    use lazy deletion: a rescheduled card pushes a new entry and stale entries
+    are dropped when they surface, so a reschedule is O(log n). Stale entries
+    not yet due never surface, so a heap is rebuilt from the live cards once
+    they outnumber them; that costs O(n) after n reschedules.
+
+    Card state lives in ``study_cards.json`` (compact ``[ease, interval, reps,
+    lapses, due]`` rows) plus an append-only ``study_cards.log``. On startup the
+    snapshot and log are merged and the snapshot rewritten; submission history
+    is only replayed once, when no snapshot exists yet.
+    """
+
+    def __init__(self):
+        self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.cards_file = os.path.join(DATA_DIR, 'study_cards.json')
+        self.log_file = os.path.join(DATA_DIR, 'study_cards.log')
+        self.submissions_file = os.path.join(DATA_DIR, 'submissions.json')
+        self._lock = threading.Lock()
+        self._loaded = False
+        # user id -> problem id -> [ease, interval_days, reps, lapses, due]
+        self._cards: Dict[str, Dict[int, List]] = {}
+        self._user_heaps: Dict[str, List[Tuple[int, int]]] = {}
+        self._global_heap: List[Tuple[int, str, int]] = []
+        self._card_count = 0
+
+    # Persistence
+    def load(self) -> None:
+        """Load card state; call before new submissions are written to disk."""
+        self._ensure_loaded()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                if os.path.exists(self.cards_file):
+                    with open(self.cards_file, 'r') as f:
+                        for user_id, cards in json.load(f).items():
+                            for problem_id, card in cards.items():
+                                self._set_card(user_id, int(problem_id), card)
+                    if os.path.exists(self.log_file):
+                        with open(self.log_file, 'r') as f:
+                            for line in f:
+                                if line.strip():
+                                    user_id, problem_id, card = json.loads(line)
+                                    self._set_card(user_id, int(problem_id), card)
+                else:
+                    self._bootstrap_from_submissions()
+                self._write_snapshot()
+            except Exception:
+                logger.exception("Error loading study cards")
+            self._loaded = True
+
+    def _bootstrap_from_submissions(self) -> None:
+        if not os.path.exists(self.submissions_file):
+            return
+        with open(self.submissions_file, 'r') as f:
+            submissions = json.load(f)
+        submissions.sort(key=lambda s: s.get('timestamp', ''))
+        for s in submissions:
+            try:
+                answered_at = datetime.fromisoformat(s['timestamp'].replace('Z', '')).timestamp()
+            except (KeyError, ValueError):
+                continue
+            self._grade(str(s['user_id']), int(s['problem_id']), bool(s.get('is_correct')), answered_at)
+
+    def _write_snapshot(self) -> None:
+        data = {user_id: {str(pid): card for pid, card in cards.items()}
+                for user_id, cards in self._cards.items()}
+        tmp_file = self.cards_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_file, self.cards_file)
+        open(self.log_file, 'w').close()
+
+    def _append_log(self, user_id: str, problem_id: int, card: List) -> None:
+        with open(self.log_file, 'a') as f:
+            f.write(json.dumps([user_id, problem_id, card], separators=(',', ':')) + '\n')
+
+    # Scheduling
+    def _set_card(self, user_id: str, problem_id: int, card: List) -> None:
+        cards = self._cards.setdefault(user_id, {})
+        if problem_id not in cards:
+            self._card_count += 1
+        cards[problem_id] = card
+        due = card[4]
+        heap = self._user_heaps.setdefault(user_id, [])
+        heapq.heappush(heap, (due, problem_id))
+        heapq.heappush(self._global_heap, (due, user_id, problem_id))
+        if len(heap) > 2 * len(cards):
+            self._user_heaps[user_id] = [(c[4], pid) for pid, c in cards.items()]
+            heapq.heapify(self._user_heaps[user_id])
+        if len(self._global_heap) > 2 * self._card_count:
+            self._global_heap = [(c[4], uid, pid) for uid, user_cards in self._cards.items()
+                                 for pid, c in user_cards.items()]
+            heapq.heapify(self._global_heap)
+
+    def _grade(self, user_id: str, problem_id: int, is_correct: bool, now: float) -> Optional[List]:
+        card = self._cards.get(user_id, {}).get(problem_id)
+        if card is None:
+            if is_correct:
+                return None
+            card = [DEFAULT_EASE, 0, 0, 0, 0]
+        ease, interval, reps, lapses, _ = card
+        quality = 4 if is_correct else 1
+        if quality < 3:
+            reps = 0
+            interval = 1
+            lapses += 1
+        else:
+            reps += 1
+            if reps == 1:
+                interval = 1
+            elif reps == 2:
+                interval = 6
+            else:
+                interval = int(round(interval * ease))
+        ease = max(MIN_EASE, round(ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02), 2))
+        new_card = [ease, interval, reps, lapses, int(now) + interval * DAY_SECONDS]
+        self._set_card(user_id, problem_id, new_card)
+        return new_card
+
+    def _is_current(self, user_id: str, problem_id: int, due: int) -> bool:
+        card = self._cards.get(user_id, {}).get(problem_id)
+        return card is not None and card[4] == due
+
+    def record_answer(self, user_id: str, problem_id: int, is_correct: bool) -> Optional[Dict]:
+        """Grade an answer and reschedule the matching card, creating it on a miss."""
+        self._ensure_loaded()
+        user_id = str(user_id)
+        problem_id = int(problem_id)
+        with self._lock:
+            card = self._grade(user_id, problem_id, is_correct, time.time())
+            if card is None:
+                return None
+            try:
+                self._append_log(user_id, problem_id, card)
+            except Exception:
+                logger.exception("Error persisting study card")
+            return self._format_card(user_id, problem_id, card)
+
+    def _format_card(self, user_id: str, problem_id: int, card: List) -> Dict:
+        return {
+            'user_id': user_id,
+            'problem_id': problem_id,
+            'ease': card[0],
+            'interval_days': card[1],
+            'repetitions': card[2],
+            'lapses': card[3],
+            'due': datetime.fromtimestamp(card[4]).isoformat()
+        }
+
+    def get_due(self, user_id: str, limit: int = 20, now: Optional[float] = None) -> List[Dict]:
+        """Return up to ``limit`` of the user's cards that are due, most overdue first."""
+        self._ensure_loaded()
+        now = time.time() if now is None else now
+        with self._lock:
+            heap = self._user_heaps.get(str(user_id), [])
+            due_cards = []
+            kept = []
+            seen = set()
+            while heap and len(due_cards) < limit and heap[0][0] <= now:
+                due, problem_id = heapq.heappop(heap)
+                if problem_id not in seen and self._is_current(str(user_id), problem_id, due):
+                    seen.add(problem_id)
+                    kept.append((due, problem_id))
+                    due_cards.append(self._format_card(str(user_id), problem_id, self._cards[str(user_id)][problem_id]))
+            for entry in kept:
+                heapq.heappush(heap, entry)
+            return due_cards
+
+    def get_due_today(self, limit: int = 1000, now: Optional[float] = None) -> List[Dict]:
+        """Return up to ``limit`` cards across all users due before the end of today."""
+        self._ensure_loaded()
+        now = time.time() if now is None else now
+        today = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff = today.timestamp() + DAY_SECONDS
+        with self._lock:
+            due_cards = []
+            kept = []
+            seen = set()
+            while self._global_heap and len(due_cards) < limit and self._global_heap[0][0] < cutoff:
+                due, user_id, problem_id = heapq.heappop(self._global_heap)
+                if (user_id, problem_id) not in seen and self._is_current(user_id, problem_id, due):
+                    seen.add((user_id, problem_id))
+                    kept.append((due, user_id, problem_id))
+                    due_cards.append(self._format_card(user_id, problem_id, self._cards[user_id][problem_id]))
+            for entry in kept:
+                heapq.heappush(self._global_heap, entry)
+            return due_cards
+
+
+study_planner = StudyPlanService()
@@ -0,0 +1,184 @@
+"""Popularity-ranked typeahead over problem titles, topics and subjects.
+
+Every title, topic and subject is normalized: lowercased, accents removed,
+punctuation collapsed to single spaces. Each word-initial suffix becomes a
+key, so "Calculus Problem 12" is found by "calc", "prob" and "12". The keys
+live in one sorted list, and a prefix matches the contiguous slice between
+two binary searches. The top completions in that slice are then chosen by
+attempt count.
+
+Short prefixes match large slices. Their results are cached for
+``CACHE_TTL`` seconds, and the cache is dropped whenever the catalog
+changes. New problems are inserted into the sorted list in place.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from database.db_handler import db
+from database.submission_store import submission_store
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+MAX_SUGGESTIONS = 20
+# Slices longer than this are ranked once and cached instead of per keystroke
+SCAN_LIMIT = 4096
+CACHE_TTL = 30.0
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return _NON_WORD.sub(' ', text.lower()).strip()
+
+
+class ProblemSuggester:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._keys: List[str] = []
+        self._key_targets = np.empty(0, dtype=np.int32)
+        # Targets are what a suggestion points at: one per problem, topic and subject
+        self._targets: List[Dict] = []
+        self._target_index: Dict[Tuple[str, str], int] = {}
+        self._popularity = np.zeros(0, dtype=np.int64)
+        self._problem_targets: Dict[int, List[int]] = {}
+        self._cache: Dict[Tuple[str, int], Tuple[float, List[Dict]]] = {}
+
+    def load(self) -> None:
+        """Index the catalog and seed popularity from recorded attempts."""
+        self._ensure_loaded()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                keys: List[Tuple[str, int]] = []
+                for problem in db.get_all_problems():
+                    keys.extend(self._register_locked(problem))
+                keys.sort()
+                self._keys = [key for key, _ in keys]
+                self._key_targets = np.array([target for _, target in keys], dtype=np.int32)
+                for problem_id, stats in submission_store.problem_accuracy().items():
+                    self._attempt_locked(problem_id, stats['attempts'])
+            except Exception:
+                logger.exception("Error building problem suggestions")
+            self._loaded = True
+
+    # Index maintenance
+    def _target_locked(self, kind: str, value: str, entry: Dict) -> Tuple[int, bool]:
+        index = self._target_index.get((kind, value))
+        if index is not None:
+            return index, False
+        index = self._target_index[(kind, value)] = len(self._targets)
+        self._targets.append(entry)
+        if len(self._popularity) <= index:
+            self._popularity = np.concatenate([self._popularity, np.zeros(max(len(self._popularity), 64), dtype=np.int64)])
+        return index, True
+
+    @staticmethod
+    def _suffixes(text: str) -> List[str]:
+        words = normalize(text).split()
+        return [' '.join(words[i:]) for i in range(len(words))]
+
+    def _register_locked(self, problem: Dict) -> List[Tuple[str, int]]:
+        """Create the targets for one problem and return the keys that should point at them."""
+        problem_id = int(problem['id'])
+        subject = problem.get('subject') or problem.get('category')
+        topic = problem.get('topic')
+        keys = []
+        target, _ = self._target_locked('problem', str(problem_id), {
+            'type': 'problem', 'id': problem_id, 'label': problem.get('title') or f'Problem {problem_id}',
+            'difficulty': problem.get('difficulty'), 'topic': topic, 'subject': subject})
+        targets = [target]
+        keys.extend((key, target) for key in self._suffixes(self._targets[target]['label']))
+        for kind, value in (('topic', topic), ('subject', subject)):
+            if not value:
+                continue
+            target, created = self._target_locked(kind, normalize(value), {'type': kind, 'label': value})
+            targets.append(target)
+            if created:
+                keys.extend((key, target) for key in self._suffixes(value))
+        self._problem_targets[problem_id] = targets
+        return keys
+
+    def _attempt_locked(self, problem_id: int, count: int = 1) -> None:
+        for target in self._problem_targets.get(int(problem_id), ()):
+            self._popularity[target] += count
+
+    def add_problem(self, problem: Dict) -> None:
+        """Index a newly created problem in place."""
+        self._ensure_loaded()
+        with self._lock:
+            if int(problem['id']) in self._problem_targets:
+                return
+            for key, target in self._register_locked(problem):
+                position = bisect_left(self._keys, key)
+                self._keys.insert(position, key)
+                self._key_targets = np.insert(self._key_targets, position, target)
+            self._cache.clear()
+
+    def record_attempt(self, problem_id: int) -> None:
+        """Count one submission towards the problem's, its topic's and its subject's popularity."""
+        self._ensure_loaded()
+        with self._lock:
+            self._attempt_locked(problem_id)
+
+    def recount_attempts(self) -> None:
+        """Reseed popularity from the submission store, after submissions have been removed."""
+        self._ensure_loaded()
+        with self._lock:
+            self._popularity[:] = 0
+            for problem_id, stats in submission_store.problem_accuracy().items():
+                self._attempt_locked(problem_id, stats['attempts'])
+            self._cache.clear()
+
+    # Lookup
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict]:
+        """Up to ``limit`` completions of ``prefix``, most attempted first."""
+        self._ensure_loaded()
+        prefix = normalize(prefix)
+        limit = min(max(limit, 1), MAX_SUGGESTIONS)
+        if not prefix:
+            return []
+        with self._lock:
+            lo = bisect_left(self._keys, prefix)
+            hi = bisect_left(self._keys, prefix + '\x7f', lo)
+            if hi - lo > SCAN_LIMIT:
+                cached = self._cache.get((prefix, limit))
+                if cached and time.time() - cached[0] < CACHE_TTL:
+                    return cached[1]
+            targets = self._key_targets[lo:hi]
+            if len(targets) > 4 * limit:
+                # A target rarely has two keys under one prefix, so the best 4 * limit keys nearly always hold limit targets
+                best = np.argpartition(-self._popularity[targets], 4 * limit - 1)[:4 * limit]
+                shortlist = np.unique(targets[best])
+                targets = shortlist if len(shortlist) >= limit else np.unique(targets)
+            else:
+                targets = np.unique(targets)
+            popularity = self._popularity[targets]
+            if len(targets) > limit:
+                best = np.argpartition(-popularity, limit - 1)[:limit]
+                targets, popularity = targets[best], popularity[best]
+            ranked = sorted(zip(targets.tolist(), popularity.tolist()),
+                            key=lambda item: (-item[1], self._targets[item[0]]['label']))
+            suggestions = [dict(self._targets[target], attempts=attempts) for target, attempts in ranked]
+            if hi - lo > SCAN_LIMIT:
+                self._cache[(prefix, limit)] = (time.time(), suggestions)
+            return suggestions
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        with self._lock:
+            return {'keys': len(self._keys), 'targets': len(self._targets), 'cached_prefixes': len(self._cache)}
+
+
+problem_suggester = ProblemSuggester()
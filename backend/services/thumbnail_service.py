@@ -0,0 +1,147 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, Optional
+import os
+import shutil
+import subprocess
+import threading
+import time
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; image thumbnails are skipped without it
+    Image = None
+
+from services.media_service import media_store
+
+THUMBNAIL_SIZE = (320, 320)
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'webm'}
+DERIVATIVE_KINDS = ('thumb', 'poster')
+
+
+def derivative_path(source_path: str, kind: str) -> str:
+    """``<dir>/<digest>.<ext>`` -> ``<dir>/<digest>.<kind>.jpg``."""
+    base = os.path.basename(source_path).split('.', 1)[0]
+    return os.path.join(os.path.dirname(source_path), f'{base}.{kind}.jpg')
+
+
+def generate_derivative(source_path: str) -> Optional[str]:
+    """Create the thumbnail or poster frame for one blob. Runs in a worker process."""
+    ext = source_path.rsplit('.', 1)[-1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        if Image is None:
+            return None
+        target = derivative_path(source_path, 'thumb')
+        with Image.open(source_path) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            image.convert('RGB').save(target + '.tmp', 'JPEG', quality=80)
+        os.replace(target + '.tmp', target)
+        return target
+    if ext in VIDEO_EXTENSIONS:
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None:
+            return None
+        target = derivative_path(source_path, 'poster')
+        # ffmpeg picks the output format from the extension, so the partial file keeps .jpg
+        partial = target + '.tmp.jpg'
+        subprocess.run([
+            ffmpeg, '-y', '-loglevel', 'error', '-ss', '1', '-i', source_path,
+            '-frames:v', '1', '-vf', f'scale={THUMBNAIL_SIZE[0]}:-2', partial
+        ], check=True, timeout=60)
+        os.replace(partial, target)
+        return target
+    return None
+
+
+class ThumbnailService:
+    """Generates review media derivatives in a background process pool.
+
+    Uploads only enqueue work, so the request never waits on image decoding or
+    ffmpeg. Derivatives are written next to the original blob and looked up by
+    name when reviews are listed. Queue depth and processing latency are kept
+    for the metrics endpoint.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, float] = {}
+        self.completed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Forking a threaded server copies locks held by other threads into the child
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=get_context('spawn'))
+        return self._executor
+
+    def enqueue(self, filename: str) -> bool:
+        """Schedule derivative generation for an uploaded blob name; never blocks on the work."""
+        source_path = media_store.resolve(filename)
+        if source_path is None or self.derivative_name(filename) is None:
+            return False
+        with self._lock:
+            if filename in self._pending:
+                return False
+            self._pending[filename] = time.time()
+            future = self._get_executor().submit(generate_derivative, source_path)
+        future.add_done_callback(lambda f: self._finished(filename, f))
+        return True
+
+    def _finished(self, filename: str, future) -> None:
+        with self._lock:
+            started = self._pending.pop(filename, time.time())
+            latency = time.time() - started
+            if future.exception() is not None:
+                self.failed += 1
+                error = future.exception()
+                logger.error(f"Error generating derivative for {filename}", exc_info=(type(error), error, error.__traceback__))
+                return
+            self.completed += 1
+            self.total_latency += latency
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def derivative_name(self, filename: str) -> Optional[str]:
+        ext = filename.rsplit('.', 1)[-1].lower()
+        base = filename.split('.', 1)[0]
+        if ext in IMAGE_EXTENSIONS:
+            return f'{base}.thumb.jpg'
+        if ext in VIDEO_EXTENSIONS:
+            return f'{base}.poster.jpg'
+        return None
+
+    def derivative_url(self, media_url: Optional[str]) -> Optional[str]:
+        """URL of the generated thumbnail/poster for ``media_url``, if it exists yet."""
+        if not media_url or not media_url.startswith('/uploads/'):
+            return None
+        filename = media_url.rsplit('/', 1)[-1]
+        name = self.derivative_name(filename)
+        path = media_store.resolve(name) if name else None
+        if path and os.path.exists(path):
+            return f'/uploads/{name}'
+        return None
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                'queue_depth': len(self._pending),
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_latency_ms': round(self.total_latency / self.completed * 1000, 2) if self.completed else 0,
+                'max_latency_ms': round(self.max_latency * 1000, 2),
+                'last_latency_ms': round(self.last_latency * 1000, 2),
+                'image_support': Image is not None,
+                'video_support': shutil.which('ffmpeg') is not None
+            }
+
+
+thumbnailer = ThumbnailService()
@@ -0,0 +1,209 @@
+"""Platform-wide submission time series at minute, hour and day resolution.
+
+Every resolution is a fixed-size ring of buckets, so memory is bounded by
+the retention, not by how much history there is::
+
+    minute  7 days     10080 buckets
+    hour    90 days     2160 buckets
+    day     5 years     1830 buckets
+
+Each bucket holds two counters (submissions, correct) and one gauge
+(active_users, the distinct users who submitted in it). Submissions are
+counted into all three rings as they arrive. A query picks the finest
+resolution that still covers the range within ``MAX_POINTS``, so a chart of
+several months reads a few hundred day or hour buckets.
+
+The rings are saved to ``data/timeseries/rollups.npz`` with a watermark and
+caught up from the submission store on boot, as described in
+``services.rollup``.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+
+import numpy as np
+
+from database.submission_store import EPOCH, submission_store, to_micros
+from config import DATA_DIR
+from services.rollup import SubmissionRollup
+
+MICROS_PER_MINUTE = 60 * 1000000
+RESOLUTIONS = {
+    # name: (bucket width in microseconds, buckets kept)
+    'minute': (MICROS_PER_MINUTE, 7 * 24 * 60),
+    'hour': (60 * MICROS_PER_MINUTE, 90 * 24),
+    'day': (24 * 60 * MICROS_PER_MINUTE, 5 * 366)
+}
+METRICS = ('submissions', 'correct', 'active_users')
+# Ring columns: bucket id, then one column per metric
+BUCKET, SUBMISSIONS, CORRECT, ACTIVE = range(4)
+MAX_POINTS = 2000
+
+
+class TimeSeriesService(SubmissionRollup):
+    label = 'time series'
+
+    def __init__(self):
+        super().__init__(os.path.join(DATA_DIR, 'timeseries', 'rollups.npz'))
+        self._rings: Dict[str, np.ndarray] = {}
+        self._newest: Dict[str, int] = {}
+        # Users seen in the newest bucket of each resolution, for the active_users gauge
+        self._open: Dict[str, Tuple[int, set]] = {}
+
+    @staticmethod
+    def _empty_ring(capacity: int) -> np.ndarray:
+        ring = np.zeros((capacity, len(METRICS) + 1), dtype=np.int64)
+        ring[:, BUCKET] = -1
+        return ring
+
+    # Loading and persistence
+    def _reset(self) -> None:
+        self._rings = {name: self._empty_ring(capacity) for name, (_, capacity) in RESOLUTIONS.items()}
+        self._newest = {name: -1 for name in RESOLUTIONS}
+        self._open = {}
+
+    def _restore(self, saved) -> None:
+        if any(len(saved[name]) != capacity for name, (_, capacity) in RESOLUTIONS.items()):
+            raise ValueError('ring sizes have changed')
+        self._rings = {name: saved[name] for name in RESOLUTIONS}
+        self._newest = {name: int(ring[:, BUCKET].max()) for name, ring in self._rings.items()}
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return self._rings
+
+    def _replay(self, chunks: List[Dict[str, np.ndarray]], start: int) -> None:
+        """Count rows from ``start`` on and seed the open buckets."""
+        offset = 0
+        tail_start = None
+        for chunk in chunks:
+            size = len(chunk['timestamp'])
+            if offset + size > start:
+                skip = max(start - offset, 0)
+                timestamps = chunk['timestamp'][skip:]
+                self._add_counts(timestamps, chunk['correct'][skip:])
+                first = int(timestamps.min())
+                tail_start = first if tail_start is None else min(tail_start, first)
+            offset += size
+
+        # Distinct users cannot be added up, so recount every bucket the replay
+        # touched, plus the newest bucket of each ring to rebuild its user set
+        day_width = RESOLUTIONS['day'][0]
+        starts = [self._newest['day'] * day_width] if self._newest['day'] >= 0 else []
+        if tail_start is not None:
+            starts.append(tail_start // day_width * day_width)
+        if not starts:
+            return
+        since = min(starts)
+        users, timestamps = [], []
+        for chunk in chunks:
+            mask = chunk['timestamp'] >= since
+            if mask.any():
+                users.append(chunk['user'][mask])
+                timestamps.append(chunk['timestamp'][mask])
+        if users:
+            self._recount_active(np.concatenate(users), np.concatenate(timestamps))
+
+    # Updating
+    def _slots(self, name: str, buckets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Ring slots for ``buckets``, claiming stale slots; returns (mask of kept rows, slots)."""
+        ring = self._rings[name]
+        capacity = len(ring)
+        newest = self._newest[name] = max(self._newest[name], int(buckets.max()))
+        keep = buckets > newest - capacity
+        kept = buckets[keep]
+        unique = np.unique(kept)
+        unique_slots = unique % capacity
+        stale = ring[unique_slots, BUCKET] != unique
+        ring[unique_slots[stale]] = 0
+        ring[unique_slots[stale], BUCKET] = unique[stale]
+        return keep, kept % capacity
+
+    def _add_counts(self, timestamps: np.ndarray, correct: np.ndarray) -> None:
+        if not len(timestamps):
+            return
+        for name, (width, _) in RESOLUTIONS.items():
+            keep, slots = self._slots(name, timestamps // width)
+            ring = self._rings[name]
+            np.add.at(ring[:, SUBMISSIONS], slots, 1)
+            np.add.at(ring[:, CORRECT], slots, correct[keep].astype(np.int64))
+        self._dirty = True
+
+    def _recount_active(self, users: np.ndarray, timestamps: np.ndarray) -> None:
+        for name, (width, capacity) in RESOLUTIONS.items():
+            buckets = timestamps // width
+            keep, slots = self._slots(name, buckets)
+            ring = self._rings[name]
+            pairs = np.unique(np.stack([buckets[keep], users[keep].astype(np.int64)]), axis=1)
+            counted, counts = np.unique(pairs[0], return_counts=True)
+            ring[counted % capacity, ACTIVE] = counts
+            newest = self._newest[name]
+            self._open[name] = (newest, {submission_store.user_name(int(u)) for u in pairs[1][pairs[0] == newest]})
+        self._dirty = True
+
+    def record(self, user_id: str, timestamp: str, is_correct: bool) -> None:
+        """Count one submission; call after it has been appended to the submission store."""
+        self.load()
+        micros = to_micros(timestamp)
+        with self._lock:
+            self._rows += 1
+            self._add_counts(np.array([micros], dtype=np.int64), np.array([is_correct]))
+            for name, (width, capacity) in RESOLUTIONS.items():
+                bucket = micros // width
+                open_bucket, users = self._open.get(name, (-1, set()))
+                if bucket > open_bucket:
+                    open_bucket, users = bucket, set()
+                    self._open[name] = (open_bucket, users)
+                if bucket == open_bucket and str(user_id) not in users:
+                    users.add(str(user_id))
+                    self._rings[name][bucket % capacity, ACTIVE] = len(users)
+                # Late submissions for a closed bucket only count towards its counters
+
+    # Queries
+    def _pick_resolution(self, start: int, end: int, newest: int) -> str:
+        for name, (width, capacity) in RESOLUTIONS.items():
+            if start // width > newest // width - capacity and end // width - start // width < MAX_POINTS:
+                return name
+        return 'day'
+
+    def query(self, start: datetime, end: datetime, resolution: Optional[str] = None,
+              metrics: Optional[Iterable[str]] = None) -> Dict:
+        """Dense series for ``start``..``end`` at ``resolution``, or the finest that fits."""
+        metrics = list(metrics or METRICS)
+        unknown = [m for m in metrics if m not in METRICS]
+        if unknown:
+            raise ValueError(f"Unknown metric {unknown[0]}; use one of {', '.join(METRICS)}")
+        if resolution is not None and resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution}; use one of {', '.join(RESOLUTIONS)}")
+        if end <= start:
+            raise ValueError("'from' must be before 'to'")
+        self.load()
+        start_micros, end_micros = to_micros(start.isoformat()), to_micros(end.isoformat())
+        with self._lock:
+            newest = max(to_micros(datetime.now().isoformat()), self._newest['minute'] * RESOLUTIONS['minute'][0])
+            resolution = resolution or self._pick_resolution(start_micros, end_micros, newest)
+            width, capacity = RESOLUTIONS[resolution]
+            buckets = np.arange(start_micros // width, (end_micros - 1) // width + 1, dtype=np.int64)
+            if len(buckets) > MAX_POINTS:
+                raise ValueError(f'{len(buckets)} {resolution} buckets requested; at most {MAX_POINTS} are returned')
+            rows = self._rings[resolution][buckets % capacity]
+        # Slots reused by newer buckets, or never written, read as zero
+        rows = np.where((rows[:, BUCKET] == buckets)[:, None], rows, 0)
+        columns = {'submissions': SUBMISSIONS, 'correct': CORRECT, 'active_users': ACTIVE}
+        points: List[Dict] = []
+        for bucket, row in zip(buckets.tolist(), rows.tolist()):
+            point = {'t': (EPOCH + timedelta(microseconds=bucket * width)).isoformat()}
+            for metric in metrics:
+                point[metric] = row[columns[metric]]
+            if 'submissions' in metrics and 'correct' in metrics:
+                point['accuracy'] = round(row[CORRECT] / row[SUBMISSIONS] * 100, 2) if row[SUBMISSIONS] else None
+            points.append(point)
+        return {
+            'resolution': resolution,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'retention_days': capacity * width // RESOLUTIONS['day'][0],
+            'points': points
+        }
+
+
+timeseries = TimeSeriesService()
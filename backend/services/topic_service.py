@@ -0,0 +1,218 @@
+from typing import Dict, List, Optional, Set, Tuple
+import json
+import os
+import threading
+
+from database.db_handler import db
+from database.state_store import state_store
+from logger import get_logger
+from config import DATA_DIR
+
+logger = get_logger(__name__)
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+
+class TopicIndex:
+    """Incrementally maintained subject -> topic aggregates.
+
+    Counters are updated as problems are written to the state store and answers
+    are submitted, so serving the topic tree costs O(number of topics) instead
+    of a rescan of every problem per topic. An edited problem moves to its new
+    topic with its answer counts; a deleted one is taken out.
+    """
+
+    def __init__(self):
+        self.submissions_file = os.path.join(DATA_DIR, 'submissions.json')
+        self._lock = threading.Lock()
+        self._loaded = False
+        # subject -> topic -> counters
+        self._subjects: Dict[str, Dict[str, Dict]] = {}
+        # problem id -> (subject, topic), its difficulty and its [attempts, correct]
+        self._problem_topics: Dict[int, Tuple[str, str]] = {}
+        self._problem_difficulty: Dict[int, str] = {}
+        self._problem_counts: Dict[int, List[int]] = {}
+        # user id -> solved problem ids, and user id -> (subject, topic) -> solved count
+        self._user_solved: Dict[str, Set[int]] = {}
+        self._user_topic_solved: Dict[str, Dict[Tuple[str, str], int]] = {}
+
+    def _new_bucket(self) -> Dict:
+        return {
+            'total': 0,
+            'difficulty': {d: 0 for d in DIFFICULTIES},
+            'attempts': 0,
+            'correct': 0
+        }
+
+    def _add_problem_locked(self, problem: Dict) -> None:
+        """Index a new problem, or move an edited one to its current topic and difficulty."""
+        problem_id = int(problem['id'])
+        subject = problem.get('subject') or problem.get('category') or 'General'
+        topic = problem.get('topic') or subject
+        difficulty = str(problem.get('difficulty', 'medium')).lower()
+        if (self._problem_topics.get(problem_id) == (subject, topic)
+                and self._problem_difficulty.get(problem_id) == difficulty):
+            return
+        self._detach_problem_locked(problem_id)
+        bucket = self._subjects.setdefault(subject, {}).setdefault(topic, self._new_bucket())
+        bucket['total'] += 1
+        if difficulty in bucket['difficulty']:
+            bucket['difficulty'][difficulty] += 1
+        attempts, correct = self._problem_counts.get(problem_id, (0, 0))
+        bucket['attempts'] += attempts
+        bucket['correct'] += correct
+        self._problem_topics[problem_id] = (subject, topic)
+        self._problem_difficulty[problem_id] = difficulty
+        for user_id, solved in self._user_solved.items():
+            if problem_id in solved:
+                per_topic = self._user_topic_solved.setdefault(user_id, {})
+                per_topic[(subject, topic)] = per_topic.get((subject, topic), 0) + 1
+
+    def _detach_problem_locked(self, problem_id: int) -> None:
+        """Take a problem and its answer counts out of its topic; they stay recorded for re-adding."""
+        key = self._problem_topics.pop(problem_id, None)
+        if key is None:
+            return
+        topics = self._subjects[key[0]]
+        bucket = topics[key[1]]
+        bucket['total'] -= 1
+        difficulty = self._problem_difficulty.pop(problem_id)
+        if difficulty in bucket['difficulty']:
+            bucket['difficulty'][difficulty] -= 1
+        attempts, correct = self._problem_counts.get(problem_id, (0, 0))
+        bucket['attempts'] -= attempts
+        bucket['correct'] -= correct
+        if not bucket['total']:
+            del topics[key[1]]
+            if not topics:
+                del self._subjects[key[0]]
+        for user_id, solved in self._user_solved.items():
+            if problem_id in solved:
+                per_topic = self._user_topic_solved[user_id]
+                per_topic[key] -= 1
+                if not per_topic[key]:
+                    del per_topic[key]
+
+    def _delete_problem_locked(self, problem_id: int) -> None:
+        self._detach_problem_locked(problem_id)
+        self._problem_counts.pop(problem_id, None)
+        for solved in self._user_solved.values():
+            solved.discard(problem_id)
+
+    def _record_locked(self, user_id: str, problem_id: int, is_correct: bool) -> None:
+        key = self._problem_topics.get(problem_id)
+        if key is None:
+            return
+        bucket = self._subjects[key[0]][key[1]]
+        counts = self._problem_counts.setdefault(problem_id, [0, 0])
+        bucket['attempts'] += 1
+        counts[0] += 1
+        if not is_correct:
+            return
+        bucket['correct'] += 1
+        counts[1] += 1
+        solved = self._user_solved.setdefault(user_id, set())
+        if problem_id not in solved:
+            solved.add(problem_id)
+            per_topic = self._user_topic_solved.setdefault(user_id, {})
+            per_topic[key] = per_topic.get(key, 0) + 1
+
+    def load(self) -> None:
+        """Build the index; call before new submissions are written to disk."""
+        self._ensure_loaded()
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        # Problem writes reach _on_state_change under the store lock, so holding it
+        # while the catalog is read keeps any from landing between the read and _loaded
+        with state_store.lock, self._lock:
+            if self._loaded:
+                return
+            try:
+                for problem in db.get_all_problems():
+                    self._add_problem_locked(problem)
+                if os.path.exists(self.submissions_file):
+                    with open(self.submissions_file, 'r') as f:
+                        for s in json.load(f):
+                            self._record_locked(str(s['user_id']), int(s['problem_id']),
+                                                bool(s.get('is_correct')))
+            except Exception:
+                logger.exception("Error building topic index")
+            self._loaded = True
+
+    def rebuild(self) -> None:
+        """Recount from the catalog and submissions.json, after submissions have been removed."""
+        with self._lock:
+            self._subjects = {}
+            self._problem_topics = {}
+            self._problem_difficulty = {}
+            self._problem_counts = {}
+            self._user_solved = {}
+            self._user_topic_solved = {}
+            self._loaded = False
+        self._ensure_loaded()
+
+    def _on_state_change(self, record: Dict) -> None:
+        """Follow problem puts, merges and deletes, whether from the API, a reimport or a primary."""
+        if record['c'] != 'problems' or not self._loaded:
+            return
+        problem_id = int(record['k'])
+        with self._lock:
+            if record['op'] == 'delete':
+                self._delete_problem_locked(problem_id)
+                return
+            # A merge record only carries the changed fields
+            problem = state_store.get('problems', problem_id)
+            if problem is not None:
+                self._add_problem_locked(dict(problem, id=problem_id))
+
+    def record_submission(self, user_id: str, problem_id: int, is_correct: bool) -> None:
+        """Account for a graded submission."""
+        self._ensure_loaded()
+        with self._lock:
+            self._record_locked(str(user_id), int(problem_id), is_correct)
+
+    def get_topics(self, user_id: Optional[str] = None) -> List[Dict]:
+        """Return the subject -> topic tree, with solved counts for ``user_id`` if given."""
+        self._ensure_loaded()
+        with self._lock:
+            user_counts = self._user_topic_solved.get(user_id, {}) if user_id else {}
+            subjects = []
+            for subject, topics in sorted(self._subjects.items()):
+                subject_entry = {
+                    'name': subject,
+                    'total': 0,
+                    'difficulty': {d: 0 for d in DIFFICULTIES},
+                    'attempts': 0,
+                    'correct': 0,
+                    'topics': []
+                }
+                if user_id:
+                    subject_entry['solved'] = 0
+                for topic, bucket in sorted(topics.items()):
+                    topic_entry = {
+                        'name': topic,
+                        'total': bucket['total'],
+                        'difficulty': dict(bucket['difficulty']),
+                        'attempts': bucket['attempts'],
+                        'correct': bucket['correct'],
+                        'accuracy': round(bucket['correct'] / bucket['attempts'] * 100, 2) if bucket['attempts'] > 0 else 0
+                    }
+                    if user_id:
+                        topic_entry['solved'] = user_counts.get((subject, topic), 0)
+                        subject_entry['solved'] += topic_entry['solved']
+                    subject_entry['total'] += bucket['total']
+                    subject_entry['attempts'] += bucket['attempts']
+                    subject_entry['correct'] += bucket['correct']
+                    for d in DIFFICULTIES:
+                        subject_entry['difficulty'][d] += bucket['difficulty'][d]
+                    subject_entry['topics'].append(topic_entry)
+                attempts = subject_entry['attempts']
+                subject_entry['accuracy'] = round(subject_entry['correct'] / attempts * 100, 2) if attempts > 0 else 0
+                subjects.append(subject_entry)
+            return subjects
+
+
+topic_index = TopicIndex()
+state_store.add_listener(topic_index._on_state_change)
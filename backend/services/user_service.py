@@ -1,34 +1,40 @@
-from database.db_handler import db
+from database.db_handler import db, profile_cache, stats_cache
+from database.answer_store import answer_store
+from services.review_service import review_store
 from typing import Dict, Optional, List
 from datetime import datetime
-import json
 import os
+from logger import get_logger
+
+logger = get_logger(__name__)
 
 class UserService:
     def __init__(self):
         self.current_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.users_file = os.path.join(self.current_dir, 'data', 'users.json')
-        self.answers_file = os.path.join(self.current_dir, 'data', 'user_answers.json')
+
+    @staticmethod
+    def _load_user(user_id: str) -> Optional[Dict]:
+        user = db.get_user_by_id(user_id)
+        if not user:
+            return None
+
+        # Return user data with stats
+        return {
+            'id': user['id'],
+            'name': user['name'],
+            'email': user['email'],
+            'avatar': user['avatar'],
+            'joinedDate': user['joinedDate'],
+            'stats': user['stats']
+        }
 
     @staticmethod
     def get_user(user_id: str) -> Optional[Dict]:
         try:
-            # Get user data
-            user = db.get_user_by_id(user_id)
-            if not user:
-                return None
-            
-            # Return user data with stats
-            return {
-                'id': user['id'],
-                'name': user['name'],
-                'email': user['email'],
-                'avatar': user['avatar'],
-                'joinedDate': user['joinedDate'],
-                'stats': user['stats']
-            }
-        except Exception as e:
-            print(f"Error in get_user: {e}")
+            # Served from the profile cache; unknown users are cached briefly too
+            return profile_cache.get_or_load(str(user_id), lambda: UserService._load_user(user_id))
+        except Exception:
+            logger.exception("Error in get_user")
             return None
 
     @staticmethod
@@ -38,9 +44,7 @@ class UserService:
     def get_user_stats(self, user_id: str) -> Optional[Dict]:
         try:
             # Get all user answers
-            with open(self.answers_file, 'r') as f:
-                answers_data = json.load(f)
-            user_answers = answers_data.get('answers', {}).get(user_id, {})
+            user_answers = answer_store.get_user_answers(user_id)
             
             # Calculate stats
             total_problems = len(user_answers)
@@ -48,9 +52,7 @@ class UserService:
             accuracy = (correct_problems / total_problems * 100) if total_problems > 0 else 0
             
             # Get user data
-            with open(self.users_file, 'r') as f:
-                users_data = json.load(f)
-            user_data = next((user for user in users_data.get('users', []) if user.get('id') == user_id), None)
+            user_data = db.get_user_by_id(user_id)
             
             if not user_data:
                 return None
@@ -64,17 +66,13 @@ class UserService:
                 'totalPoints': user_data.get('total_points', 0),
                 'lastUpdated': datetime.now().isoformat()
             }
-        except Exception as e:
-            print(f"Error getting user stats: {e}")
+        except Exception:
+            logger.exception("Error getting user stats")
             return None
 
     def get_user_answer(self, user_id: str, problem_id: int) -> Optional[Dict]:
         try:
-            with open(self.answers_file, 'r') as f:
-                answers_data = json.load(f)
-            
-            user_answers = answers_data.get('answers', {}).get(user_id, {})
-            answer = user_answers.get(str(problem_id))
+            answer = answer_store.get_answer(user_id, problem_id)
             
             if answer:
                 return {
@@ -83,16 +81,13 @@ class UserService:
                     'timestamp': answer.get('timestamp', '')
                 }
             return None
-        except Exception as e:
-            print(f"Error getting user answer: {e}")
+        except Exception:
+            logger.exception("Error getting user answer")
             return None
 
     def get_user_answers(self, user_id: str) -> Dict:
         try:
-            with open(self.answers_file, 'r') as f:
-                answers_data = json.load(f)
-            
-            user_answers = answers_data.get('answers', {}).get(user_id, {})
+            user_answers = answer_store.get_user_answers(user_id)
             formatted_answers = {}
             
             for problem_id, answer in user_answers.items():
@@ -103,8 +98,8 @@ class UserService:
                 }
             
             return formatted_answers
-        except Exception as e:
-            print(f"Error getting user answers: {e}")
+        except Exception:
+            logger.exception("Error getting user answers")
             return {}
 
     @staticmethod
@@ -184,7 +179,7 @@ class UserService:
 
     @staticmethod
     def get_user_stats(user_id: str) -> Dict:
-        stats = db.get_user_stats(user_id)
+        stats = stats_cache.get_or_load(str(user_id), lambda: db.get_user_stats(user_id))
         if not stats:
             stats = {
                 'stats': {
@@ -206,44 +201,36 @@ class UserService:
         # Get the user's answer to check if it was correct
         answer = db.get_specific_answer(user_id, problem_id)
         
+        stored = review_store.add_review(problem_id, user_id, review)
         review_data = {
+            'id': stored['id'],
             'username': user_id,
             'review': review,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': stored['timestamp'],
             'is_correct': answer.get('is_correct', False) if answer else False,
             'answer': answer.get('answer') if answer else None
         }
         
-        # Get existing reviews and add new one
-        reviews = db.get_reviews(problem_id)
-        if not isinstance(reviews, list):
-            reviews = []
-        reviews.append(review_data)
-        db.save_reviews(problem_id, reviews)
-        
         return review_data
 
     @staticmethod
     def get_problem_submissions(problem_id: int) -> List[Dict]:
         # Get all answers for this problem
-        answers = db.get_user_answers()
         submissions = []
         
-        for user_id, user_answers in answers.items():
-            if str(problem_id) in user_answers:
-                answer = user_answers[str(problem_id)]
-                submission = {
-                    'username': user_id,
-                    'answer': answer.get('answer'),
-                    'is_correct': answer.get('is_correct'),
-                    'timestamp': answer.get('timestamp')
-                }
-                submissions.append(submission)
+        for user_id, answer in answer_store.get_problem_answers(problem_id):
+            submission = {
+                'username': user_id,
+                'answer': answer.get('answer'),
+                'is_correct': answer.get('is_correct'),
+                'timestamp': answer.get('timestamp')
+            }
+            submissions.append(submission)
         
-        # Get all reviews for this problem
-        reviews = db.get_reviews(problem_id)
-        if isinstance(reviews, list):
-            submissions.extend(reviews)
+        # Get the latest reviews for this problem
+        reviews, _ = review_store.get_reviews(problem_id, limit=50)
+        submissions.extend({'username': r['user_id'], 'review': r['review'], 'timestamp': r['timestamp']}
+                           for r in reviews)
         
         # Sort by timestamp, most recent first
         submissions.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
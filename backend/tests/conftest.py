@@ -0,0 +1,114 @@
+"""Shared setup for the backend tests.
+
+Every service reads ``DATA_DIR`` when it is imported, so the tests point it at
+a scratch copy of the problem catalog before anything from the backend is
+imported. Tests that use the app share that directory and keep apart by using
+their own user ids. Tests of a single store build a fresh instance on
+``tmp_path`` instead.
+"""
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG = os.path.join(BACKEND_DIR, 'data', 'problems.json')
+CLUSTER_SECRET = 'test-secret'
+ADMIN_TOKEN = 'test-admin'
+
+_session_dir = tempfile.mkdtemp(prefix='backend-tests-')
+shutil.copy(CATALOG, _session_dir)
+os.environ.update(DATA_DIR=_session_dir, LOG_STDOUT='0', STATE_FSYNC='never',
+                  CLUSTER_SECRET=CLUSTER_SECRET, ADMIN_TOKEN=ADMIN_TOKEN)
+os.environ.pop('REPLICA_OF', None)
+sys.path.insert(0, BACKEND_DIR)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_session_dir, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """An empty data directory holding only the problem catalog."""
+    shutil.copy(CATALOG, tmp_path)
+    return str(tmp_path)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def http(method: str, url: str, body=None, headers=None, raw: bool = False):
+    """``(status, parsed JSON or bytes)`` of one request, errors included."""
+    data = body if isinstance(body, bytes) or body is None else json.dumps(body).encode()
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers=dict({'Content-Type': 'application/json'}, **(headers or {})))
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            payload = response.read()
+            return response.status, payload if raw else json.loads(payload or b'null')
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        return e.code, payload if raw else json.loads(payload or b'null')
+
+
+def wait_until(check, timeout: float = 20.0, interval: float = 0.2):
+    deadline = time.time() + timeout
+    while True:
+        result = check()
+        if result or time.time() > deadline:
+            return result
+        time.sleep(interval)
+
+
+@pytest.fixture
+def start_node(tmp_path_factory):
+    """Start ``app.py`` in a subprocess with its own data directory; returns its URL."""
+    processes = []
+
+    def start(**env) -> str:
+        data = str(tmp_path_factory.mktemp('node'))
+        shutil.copy(CATALOG, data)
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, '-c', f"from app import app; app.run(port={port}, threaded=True)"],
+            cwd=BACKEND_DIR, env=dict(os.environ, DATA_DIR=data, LOG_FILE='', **env),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        processes.append(process)
+        url = f'http://127.0.0.1:{port}'
+
+        def ready():
+            try:
+                return http('GET', f'{url}/problems/1')[0] == 200
+            except OSError:
+                return False
+        if not wait_until(ready, timeout=60):
+            pytest.fail(f'Node on port {port} did not start')
+        return url
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait(timeout=10)
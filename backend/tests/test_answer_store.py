@@ -0,0 +1,64 @@
+import json
+import os
+import threading
+
+from database.answer_store import AnswerStore
+
+
+def test_legacy_file_is_imported_keeping_the_latest_answer(data_dir):
+    with open(os.path.join(data_dir, 'user_answers.json'), 'w') as f:
+        json.dump({
+            'u1': {'1': {'answer': 'A', 'timestamp': '2026-10-01T10:00:00'}},
+            'answers': {'u1': {'1': {'answer': 'B', 'timestamp': '2026-10-02T10:00:00'}},
+                        'u2': {'3': {'answer': 'C', 'timestamp': '2026-10-01T10:00:00'}}}
+        }, f)
+
+    store = AnswerStore(data_dir)
+    assert store.get_answer('u1', 1)['answer'] == 'B'
+    assert store.get_answer('u2', 3)['answer'] == 'C'
+
+
+def test_reshard_moves_every_user(data_dir):
+    store = AnswerStore(data_dir)
+    for i in range(50):
+        store.save_answer(f'user {i}', 1, {'answer': str(i)})
+
+    result = store.reshard(3)
+    assert result == {'layout': 'v2', 'shards': 3, 'copied': 50}
+    assert sorted(os.listdir(store.root)) == ['directory.json', 'reshard.lock', 'v2', 'writers.lock']
+    # Another process, such as the running server, picks up the new layout
+    assert AnswerStore(data_dir).get_answer('user 7', 1) == {'answer': '7'}
+
+
+def test_reshard_keeps_concurrent_writes_and_deletes(data_dir):
+    store = AnswerStore(data_dir)
+    users = [f'u{i}' for i in range(200)]
+    for user in users:
+        store.save_answer(user, 1, {'n': 0})
+    expected = {}
+    done = threading.Event()
+
+    def write():
+        # A separate instance has its own lock files, like a server in another process
+        writer = AnswerStore(data_dir)
+        i = 0
+        while not done.is_set() or i < len(users):
+            user = users[i % len(users)]
+            if i % 17 == 0:
+                writer.delete_user(user)
+                expected[user] = {}
+            else:
+                expected[user] = writer.update_user_answers(
+                    user, lambda answers: answers.update({'2': {'n': i}}))
+            i += 1
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    store.reshard(7)
+    done.set()
+    thread.join()
+
+    reader = AnswerStore(data_dir)
+    assert reader._read_directory() == {'layout': 'v2', 'shards': 7, 'next': None}
+    for user, answers in expected.items():
+        assert reader.get_user_answers(user) == answers
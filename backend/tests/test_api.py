@@ -0,0 +1,250 @@
+"""Routes of one node, through the Flask test client."""
+import json
+
+import pytest
+
+from conftest import ADMIN_TOKEN, CLUSTER_SECRET, wait_until
+from database.state_store import state_store
+from services.event_service import broadcaster, problem_channel
+
+NEW_PROBLEM = {
+    'title': 'Integrating a rotated parabola over the unit disc',
+    'description': 'Find the integral of the rotated parabola over the unit disc using polar coordinates.',
+    'options': [{'id': 'A', 'text': 'pi / 2'}, {'id': 'B', 'text': 'pi'}, {'id': 'C', 'text': '2 pi'},
+                {'id': 'D', 'text': 'pi / 4'}],
+    'correct_answer': 'A',
+    'topic': 'Calculus',
+    'subject': 'Mathematics',
+    'difficulty': 'Hard'
+}
+ADMIN = {'X-Admin-Token': ADMIN_TOKEN}
+
+
+def submit(client, user, problem_id, answer, time_taken=None):
+    body = {'answer': answer}
+    if time_taken is not None:
+        body['time_taken'] = time_taken
+    response = client.post(f'/users/{user}/submit_answer/{problem_id}', json=body)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def events(subscription):
+    frames = []
+    while not subscription.queue.empty():
+        frame = subscription.queue.get_nowait()
+        event, data = frame.split('\n')[:2]
+        frames.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return frames
+
+
+# Contests
+def test_contests_are_created_and_unfrozen_only_by_admins(client):
+    body = {'title': 'Test contest', 'start_time': '2026-01-01T00:00:00', 'duration_minutes': 60,
+            'problem_ids': [1, 2], 'freeze_minutes': 30}
+    assert client.post('/api/contests', json=body).status_code == 403
+    contest = client.post('/api/contests', json=body, headers=ADMIN)
+    assert contest.status_code == 201
+    contest_id = contest.get_json()['id']
+    assert client.get(f'/api/contests/{contest_id}/scoreboard?live=true').status_code == 403
+    assert client.post(f'/api/contests/{contest_id}/unfreeze').status_code == 403
+    assert client.get(f'/api/contests/{contest_id}/scoreboard?live=true', headers=ADMIN).status_code == 200
+    assert client.post(f'/api/contests/{contest_id}/unfreeze', headers=ADMIN).status_code == 200
+
+
+# Submissions and their deltas
+def test_resubmission_sends_a_latest_answer_delta(client):
+    subscription = broadcaster.subscribe(problem_channel(2))
+    try:
+        first = submit(client, 'delta-user', 2, 'wrong answer')
+        assert first['answer']['is_correct'] is False
+        submit(client, 'delta-user', 2, 'another wrong answer')
+        deltas = [data for event, data in events(subscription) if event == 'stats_delta']
+    finally:
+        broadcaster.unsubscribe(subscription)
+    assert [(d['total_attempts'], d['correct_attempts'], d['previous_answer']) for d in deltas] == [
+        (1, 0, None), (0, 0, 'wrong answer')]
+
+
+# Query API
+@pytest.mark.parametrize('value, status', [(True, 200), ('false', 200), ('TRUE', 200), (1, 400), ('yes', 400)])
+def test_is_correct_filter_takes_booleans_only(client, value, status):
+    response = client.post('/api/query', json={'filter': {'is_correct': value}, 'metrics': ['count']})
+    assert response.status_code == status
+
+
+def test_is_correct_false_matches_wrong_answers(client):
+    submit(client, 'query-user', 4, 'surely wrong')
+
+    def count(value):
+        rows = client.post('/api/query', json={'filter': {'is_correct': value, 'user_id': 'query-user'},
+                                               'metrics': ['count']}).get_json()['rows']
+        return rows[0]['count'] if rows else 0
+    assert (count('false'), count(True)) == (1, 0)
+
+
+# Time series
+@pytest.mark.parametrize('query', [
+    'from=2026-10-18T00:00:00%2B02:00&to=2026-10-20T00:00:00',
+    'from=2026-10-18T00:00:00Z&to=2026-10-20T00:00:00Z&approx=true',
+    'from=2026-10-18&to=2026-10-20'
+])
+def test_timeseries_accepts_bounds_with_and_without_offsets(client, query):
+    response = client.get('/api/admin/timeseries?' + query, headers=ADMIN)
+    assert response.status_code == 200
+    assert response.get_json()['from'].startswith('2026-10-1')
+
+
+def test_timeseries_offsets_are_converted_to_utc(client):
+    series = client.get('/api/admin/timeseries?from=2026-10-18T00:00:00%2B02:00&to=2026-10-19T00:00:00%2B02:00',
+                        headers=ADMIN)
+    assert series.get_json()['from'] == '2026-10-17T22:00:00'
+
+
+@pytest.mark.parametrize('query', ['from=yesterday', 'from=2026-10-20&to=2026-10-18', 'resolution=week'])
+def test_bad_timeseries_requests_are_400(client, query):
+    assert client.get('/api/admin/timeseries?' + query, headers=ADMIN).status_code == 400
+
+
+
+@pytest.mark.parametrize('change', [
+    {'options': None}, {'options': []}, {'options': ['pi / 2', 'pi']}, {'options': [{'id': 'A'}]},
+    {'options': [{'id': 'A', 'text': 'pi'}, {'id': 'A', 'text': '2 pi'}]}, {'correct_answer': 'E'},
+    {'correct_answer': 'pi / 2'}
+])
+def test_created_problem_needs_options_that_include_the_answer(client, change):
+    response = client.post('/problems', json=dict(NEW_PROBLEM, title='A problem that is never created', **change))
+    assert response.status_code == 400
+
+
+# Node-to-node routes
+def test_node_to_node_routes_need_the_cluster_secret(client):
+    assert client.get('/api/admin/partition/catalog').status_code == 403
+    assert client.get('/api/replication/snapshot').status_code == 403
+    allowed = client.get('/api/admin/partition/catalog', headers={'X-Cluster-Secret': CLUSTER_SECRET})
+    assert allowed.status_code == 200
+    assert 'correct_answer' in allowed.get_json()[0]
+
+
+# Similar problems
+def test_similar_problems_once_the_index_is_built(client):
+    # Built in the background at startup; 503 until then
+    response = wait_until(lambda: client.get('/problems/1/similar?limit=3').status_code != 503)
+    assert response
+    similar = client.get('/problems/1/similar?limit=3').get_json()
+    assert 0 < len(similar) <= 3
+    assert all('correct_answer' not in s for s in similar)
+    assert client.get('/problems/999999/similar').status_code == 404
+
+
+# Projections
+@pytest.mark.parametrize('query', ['', '?fields=*', '?fields=*&exclude=title'])
+def test_problem_list_never_serves_correct_answers(client, query):
+    problems = client.get('/problems' + query).get_json()
+    assert problems
+    assert not any('correct_answer' in p for p in problems)
+
+
+@pytest.mark.parametrize('query', ['', '?fields=*', '?fields=title,options'])
+def test_problem_never_serves_its_correct_answer(client, query):
+    problem = client.get('/problems/1' + query).get_json()
+    assert problem
+    assert 'correct_answer' not in problem
+
+
+@pytest.mark.parametrize('path', ['/problems?fields=correct_answer', '/problems/1?fields=title,correct_answer'])
+def test_asking_for_the_correct_answer_is_refused(client, path):
+    assert client.get(path).status_code == 400
+
+
+def test_list_fields_default_to_the_summary(client):
+    problem = client.get('/problems').get_json()[0]
+    assert set(problem) <= {'id', 'title', 'difficulty', 'topic', 'acceptance_rate'}
+    assert 'hints' not in client.get('/problems/1?fields=*').get_json()
+
+
+def test_created_problem_is_listed_without_its_answer(client):
+    created = client.post('/problems', json=NEW_PROBLEM)
+    assert created.status_code == 201
+    problem_id = created.get_json()['id']
+    assert 'correct_answer' not in created.get_json()
+    listed = {p['id']: p for p in client.get('/problems?fields=*').get_json()}
+    assert problem_id in listed and 'correct_answer' not in listed[problem_id]
+
+    duplicate = client.post('/problems', json=NEW_PROBLEM)
+    assert duplicate.status_code == 409
+    assert duplicate.get_json()['duplicates'][0]['id'] == problem_id
+
+
+
+@pytest.mark.parametrize('time_taken', ['NaN', 'Infinity', '1e400', str(10 ** 20), '-1', '86401', 'true', '"30"'])
+def test_unusable_solve_times_are_rejected_before_anything_is_written(client, time_taken):
+    before = client.post('/api/query', json={'metrics': ['count']}).get_json()['rows']
+    response = client.post('/users/time-user/submit_answer/1', data=f'{{"answer": "C", "time_taken": {time_taken}}}',
+                           content_type='application/json')
+    assert response.status_code == 400
+    assert client.post('/api/query', json={'metrics': ['count']}).get_json()['rows'] == before
+    submit(client, 'time-user', 1, 'C', time_taken=86400)
+
+
+# Approximate stats
+def test_problem_stats_count_latest_answers(client):
+    before = client.get('/problem_stats/3').get_json()
+    submit(client, 'stats-user', 3, 'wrong answer')
+    submit(client, 'stats-user', 3, 'still wrong')
+    for query in ('', '?approx=true'):
+        after = client.get('/problem_stats/3' + query).get_json()
+        assert after['total_attempts'] == before.get('total_attempts', 0) + 1
+
+
+@pytest.mark.parametrize('method', ['GET', 'POST', 'DELETE'])
+def test_sketch_routes_need_the_admin_token_or_cluster_secret(client, method):
+    assert client.open('/api/admin/sketches?shard=evil', method=method, data=b'').status_code == 403
+
+
+def test_merged_shard_sketches_count_once(client):
+    submit(client, 'sketch-user', 1, 'C')
+    exported = client.get('/api/admin/sketches', headers={'X-Cluster-Secret': CLUSTER_SECRET}).data
+    before = client.get('/problem_stats/1?approx=true').get_json()['total_attempts']
+    try:
+        for _ in range(2):
+            assert client.post('/api/admin/sketches?shard=copy', data=exported, headers=ADMIN).status_code == 200
+        assert client.get('/problem_stats/1?approx=true').get_json()['total_attempts'] == 2 * before
+    finally:
+        assert client.delete('/api/admin/sketches?shard=copy', headers=ADMIN).status_code == 200
+    assert client.get('/problem_stats/1?approx=true').get_json()['total_attempts'] == before
+
+
+@pytest.mark.parametrize('path', ['/api/admin/media/metrics', '/api/admin/query/metrics', '/api/admin/timeseries',
+                                  '/api/admin/cache/metrics', '/api/admin/problems/duplicates'])
+def test_admin_routes_need_the_admin_token(client, path):
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers=ADMIN).status_code == 200
+
+
+def test_duplicate_check_needs_the_admin_token(client):
+    assert client.post('/api/admin/problems/duplicates/check', json=[NEW_PROBLEM]).status_code == 403
+    checked = client.post('/api/admin/problems/duplicates/check', json=[NEW_PROBLEM], headers=ADMIN)
+    assert checked.status_code == 200
+
+
+# Topics
+def test_topic_tree_follows_problem_edits_and_deletes(client):
+    def topics(user_id='topic-user'):
+        tree = client.get(f'/api/topics?user_id={user_id}').get_json()['subjects']
+        return {(s['name'], t['name']): (t['total'], t['attempts'], t['solved']) for s in tree for t in s['topics']}
+
+    created = client.post('/problems', json=dict(NEW_PROBLEM, title='Counting holes in a coffee mug and a doughnut',
+                                                 description='How many holes does each surface have?',
+                                                 subject='Geometry', topic='Topology'))
+    problem_id = created.get_json()['id']
+    submit(client, 'topic-user', problem_id, 'A')
+    assert topics()[('Geometry', 'Topology')] == (1, 1, 1)
+
+    state_store.merge('problems', problem_id, {'topic': 'Knot Theory', 'difficulty': 'Easy'})
+    assert ('Geometry', 'Topology') not in topics()
+    assert topics()[('Geometry', 'Knot Theory')] == (1, 1, 1)
+
+    state_store.delete('problems', problem_id)
+    assert not any(subject == 'Geometry' for subject, _ in topics())
+
@@ -0,0 +1,112 @@
+"""Partition handoff and replication, with every node in its own process."""
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from conftest import CLUSTER_SECRET, http, wait_until
+from router import Router
+
+USERS = [f'player-{i}' for i in range(40)]
+
+
+@pytest.fixture
+def router():
+    instances = []
+
+    def make(*nodes):
+        instance = Router(list(nodes))
+        instances.append(instance)
+        return instance
+    yield make
+    for instance in instances:
+        instance._pool.shutdown(wait=False)
+
+
+def request(client, method, path, body=None):
+    response = client.open(path, method=method, json=body)
+    return response.status_code, response.get_json()
+
+
+def owned_submitters(node, problem_id):
+    status, submissions = http('GET', f'{node}/problems/{problem_id}/submissions')
+    assert status == 200
+    return {s['user_id'] for s in submissions}
+
+
+def test_adding_a_node_moves_users_without_losing_or_double_counting(start_node, router):
+    first, second = start_node(), start_node()
+    ring = router(first, second)
+    client = Client(ring, Response)
+    for i, user in enumerate(USERS):
+        status, _ = request(client, 'POST', f'/users/{user}/submit_answer/1', {'answer': 'C' if i % 2 else 'A',
+                                                                              'time_taken': 10 + i})
+        assert status == 200
+    _, before = request(client, 'GET', '/problem_stats/1')
+    assert (before['total_attempts'], before['correct_attempts']) == (40, 20)
+
+    third = start_node()
+    status, result = request(client, 'POST', '/_router/nodes', {'url': third})
+    assert status == 200 and result['moved'] > 0
+
+    _, after = request(client, 'GET', '/problem_stats/1')
+    assert (after['total_attempts'], after['correct_attempts']) == (40, 20)
+    _, approx = request(client, 'GET', '/problem_stats/1?approx=true')
+    assert approx['total_attempts'] == 40
+    # The stated error is one standard deviation of the distinct count
+    error = approx['approximation']['unique_users_relative_error']
+    assert abs(approx['unique_users'] - len(USERS)) <= 3 * error * len(USERS)
+    _, times = request(client, 'GET', '/problems/1/solve_times')
+    assert times['count'] == 20
+
+    # Each user's history now lives only on the node that owns them
+    for node in (first, second, third):
+        assert all(ring.ring.node_for(user) == node for user in owned_submitters(node, 1))
+    for i, user in enumerate(USERS):
+        status, answer = request(client, 'GET', f'/user_answer/{user}/1')
+        assert status == 200 and answer['is_correct'] == bool(i % 2)
+
+
+def test_replica_catches_up_and_serves_read_your_writes(start_node):
+    primary = start_node()
+    for user in ('ann', 'ben', 'cat'):
+        assert http('POST', f'{primary}/users/{user}/submit_answer/1', {'answer': 'C'})[0] == 200
+    replica = start_node(REPLICA_OF=primary)
+
+    def caught_up():
+        status = http('GET', f'{replica}/api/replication/status')[1]
+        return status['applied']['submissions'] >= 3 and status['lag_records']['submissions'] == 0
+    assert wait_until(caught_up)
+    assert http('GET', f'{replica}/problem_stats/1')[1]['total_attempts'] == \
+        http('GET', f'{primary}/problem_stats/1')[1]['total_attempts']
+
+    status, result = http('POST', f'{primary}/users/dan/submit_answer/1', {'answer': 'A'})
+    token = result['replication_token']
+    status, answer = http('GET', f'{replica}/user_answer/dan/1', headers={'X-Min-Replication-Token': token})
+    assert status == 200 and answer['answer'] == 'A'
+
+    assert http('POST', f'{replica}/users/eve/submit_answer/1', {'answer': 'C'})[0] == 405
+
+
+def test_internal_routes_are_not_routed(start_node, router):
+    client = Client(router(start_node()), Response)
+    assert client.get('/api/admin/partition/catalog').status_code == 404
+    assert client.get('/api/replication/snapshot', headers={'X-Cluster-Secret': CLUSTER_SECRET}).status_code == 404
+
+
+def test_created_problems_reach_every_node_with_their_answer(start_node, router):
+    first, second = start_node(), start_node()
+    client = Client(router(first, second), Response)
+    status, created = request(client, 'POST', '/problems', {
+        'title': 'Eigenvalues of a rotation by a quarter turn in the plane',
+        'description': 'Which complex numbers are eigenvalues of the rotation?',
+        'options': [{'id': 'A', 'text': 'i and -i'}, {'id': 'B', 'text': '1 and -1'}, {'id': 'C', 'text': '0'}],
+        'correct_answer': 'A',
+        'topic': 'Linear Algebra',
+        'subject': 'Mathematics'
+    })
+    assert status == 201 and 'correct_answer' not in created
+
+    for node in (first, second):
+        assert http('GET', f"{node}/problems/{created['id']}")[0] == 200
+        status, result = http('POST', f"{node}/users/checker/submit_answer/{created['id']}", {'answer': 'A'})
+        assert status == 200 and result['answer']['is_correct'] is True
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from services.dedupe_service import ProblemDedupeIndex, shingles
+from services.problem_text import problem_tokens
+from services.similarity_service import IndexNotReady, SimilarProblemIndex
+
+PROBLEM = {'title': 'Limits', 'description': 'Find the limit of sin(x)/x',
+           'options': [{'id': 'A', 'text': 'One'}, 'Zero']}
+
+
+def test_both_indexes_read_the_same_words():
+    assert problem_tokens(PROBLEM) == ['limits', 'find', 'the', 'limit', 'of', 'sin', 'x', 'x', 'one', 'zero']
+    assert shingles(PROBLEM)[0] == 'limits find the'
+    assert shingles({'title': 'Two words'}) == ['two words']
+
+
+def test_similar_problems_are_unavailable_while_the_index_builds():
+    index = SimilarProblemIndex()
+    release = threading.Event()
+    build = index._build_locked
+
+    def slow_build(problems):
+        release.wait(10)
+        build(problems)
+    index._build_locked = slow_build
+    index.load()
+    started = time.time()
+    with pytest.raises(IndexNotReady):
+        index.similar(1)
+    assert time.time() - started < 1
+    assert index.stats() == {'ready': False}
+
+    release.set()
+    index.add_problem(dict(PROBLEM, id=10 ** 6, topic='Calculus'))
+    assert index.stats()['ready']
+    assert index.similar(1) is not None
+    assert index.similar(10 ** 6) is not None
+
+
+def test_duplicate_index_finds_a_reworded_copy():
+    index = ProblemDedupeIndex()
+    index._loaded = True
+    original = {'id': 1, 'title': 'Area of a circle', 'description': ' '.join(['Compute the area of a circle'] * 5),
+                'options': ['pi r squared', '2 pi r']}
+    index.add_problem(original)
+    copy = dict(original, id=None, title='Area of a circle!')
+    assert [m['id'] for m in index.find_duplicates(copy)] == [1]
+    assert index.find_duplicates({'title': 'Something else entirely', 'description': 'Unrelated words here'}) == []
@@ -0,0 +1,38 @@
+import io
+import os
+
+import pytest
+
+from services.media_service import MediaStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    media = MediaStore()
+    media.upload_dir = str(tmp_path / 'uploads')
+    media.tmp_dir = str(tmp_path / 'uploads' / 'tmp')
+    media.refs_file = str(tmp_path / 'media_refs.json')
+    return media
+
+
+def test_review_takes_over_the_uploads_reference(store):
+    session = store.create_session('diagram.png', size=4)
+    store.append_chunk(session['upload_id'], 0, io.BytesIO(b'\x89PNG'))
+    stored = store.complete_session(session['upload_id'])
+    name = stored['filename']
+
+    # Adding the review: it references the blob, then the upload lets go
+    assert store.acquire(name)
+    store.attach(name)
+    entry = store._load_refs()[name]
+    assert (entry['refs'], entry['unattached']) == (1, 0)
+    store.release(name)
+    assert name not in store._load_refs()
+    assert not os.path.exists(store.resolve(name))
+
+
+def test_file_sent_with_its_review_has_only_the_reviews_reference(store):
+    stored = store.save_stream(io.BytesIO(b'GIF89a'), 'reaction.gif', attached=True)
+    store.attach(stored['filename'])
+    store.release(stored['filename'])
+    assert not os.path.exists(store.resolve(stored['filename']))
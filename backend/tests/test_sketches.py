@@ -0,0 +1,32 @@
+import numpy as np
+
+from services.sketches import TDigest
+
+
+def test_tdigest_quantiles_are_close_at_the_median_and_the_tails():
+    values = np.random.default_rng(7).lognormal(3, 1, 100_000)
+    digest = TDigest()
+    for value in values:
+        digest.add(value)
+
+    assert digest.count == len(values)
+    assert len(digest.means) < 200
+    for q in (0.5, 0.9, 0.99):
+        assert abs(digest.cdf(np.quantile(values, q)) - q) < 0.005
+    assert (digest.quantile(0), digest.quantile(1)) == (values.min(), values.max())
+
+
+def test_merged_digests_answer_like_one_digest_of_both_streams():
+    rng = np.random.default_rng(11)
+    fast, slow = rng.normal(20, 5, 5000), rng.normal(80, 10, 5000)
+    first, second = TDigest(), TDigest()
+    first.add_many(fast)
+    second.add_many(slow)
+
+    # Shipped between nodes as JSON before the router merges them
+    merged = TDigest.from_dict(first.to_dict())
+    merged.merge(TDigest.from_dict(second.to_dict()))
+    both = np.concatenate([fast, slow])
+    assert merged.count == len(both)
+    for q in (0.25, 0.5, 0.75, 0.99):
+        assert abs(merged.cdf(np.quantile(both, q)) - q) < 0.01
@@ -0,0 +1,85 @@
+import json
+import os
+
+from database.state_store import StateStore
+
+
+def open_store(path, **kwargs):
+    store = StateStore(str(path), fsync_policy='never', **kwargs)
+    store.load()
+    return store
+
+
+def test_wal_replays_writes_made_after_the_snapshot(data_dir):
+    store = open_store(data_dir)
+    store.put('users', 'u1', {'name': 'Ada'})
+    store.merge('users', 'u1', {'email': 'ada@example.com'})
+    store.put('users', 'u2', {'name': 'Bob'})
+    store.delete('users', 'u2')
+
+    # A second store on the same directory is what a restart after a crash sees
+    recovered = open_store(data_dir)
+    assert recovered.get('users', 'u1') == {'name': 'Ada', 'email': 'ada@example.com'}
+    assert recovered.get('users', 'u2') is None
+    assert recovered.version == store.version
+
+
+def test_snapshot_drops_covered_wal_segments(data_dir):
+    store = open_store(data_dir)
+    store.put('users', 'u1', {'name': 'Ada'})
+    store.snapshot()
+    store.put('users', 'u1', {'name': 'Ada Lovelace'})
+
+    segments = store._wal_segments()
+    assert len(segments) == 1
+    recovered = open_store(data_dir)
+    assert recovered.get('users', 'u1') == {'name': 'Ada Lovelace'}
+
+
+def test_torn_wal_record_is_truncated(data_dir):
+    store = open_store(data_dir)
+    store.put('users', 'u1', {'name': 'Ada'})
+    segment = store._wal_segments()[-1]
+    intact = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(b'{"seq": 99, "op": "put", "c": "us')
+
+    recovered = open_store(data_dir)
+    assert recovered.get('users', 'u1') == {'name': 'Ada'}
+    assert os.path.getsize(segment) == intact
+    recovered.put('users', 'u2', {'name': 'Bob'})
+    assert open_store(data_dir).get('users', 'u2') == {'name': 'Bob'}
+
+
+def test_read_only_store_recovers_without_writing(data_dir):
+    store = open_store(data_dir)
+    store.put('users', 'u1', {'name': 'Ada'})
+    segment = store._wal_segments()[-1]
+    with open(segment, 'ab') as f:
+        f.write(b'{"torn')
+    size = os.path.getsize(segment)
+
+    reader = open_store(data_dir, read_only=True)
+    assert reader.get('users', 'u1') == {'name': 'Ada'}
+    assert os.path.getsize(segment) == size
+
+
+def test_changed_catalog_is_reimported_until_problems_are_written(data_dir):
+    catalog = os.path.join(data_dir, 'problems.json')
+    store = open_store(data_dir)
+    first = store.keys('problems')[0]
+
+    with open(catalog) as f:
+        problems = json.load(f)
+    problems = problems['problems'] if isinstance(problems, dict) else problems
+    changed = [dict(p, title='Renamed') if str(p['id']) == first else p for p in problems]
+    with open(catalog, 'w') as f:
+        json.dump(changed, f)
+    store = open_store(data_dir)
+    assert store.get('problems', first)['title'] == 'Renamed'
+
+    # Once the collection takes writes, a changed file no longer overwrites them
+    store.merge('problems', first, {'title': 'Edited live'})
+    with open(catalog, 'w') as f:
+        json.dump(problems, f)
+    assert open_store(data_dir).get('problems', first)['title'] == 'Edited live'
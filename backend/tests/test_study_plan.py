@@ -0,0 +1,33 @@
+import time
+
+import services.study_plan_service as study_plan_module
+from services.study_plan_service import StudyPlanService
+
+
+def test_study_plan_heaps_stay_bounded_by_the_live_cards(data_dir, monkeypatch):
+    monkeypatch.setattr(study_plan_module, 'DATA_DIR', data_dir)
+    planner = StudyPlanService()
+    planner.load()
+    for round_ in range(40):
+        for user in range(10):
+            for problem in range(5):
+                planner.record_answer(f'u{user}', problem, is_correct=round_ % 2 == 1)
+
+    assert planner._card_count == 50
+    assert len(planner._global_heap) <= 2 * 50
+    assert all(len(heap) <= 2 * 5 for heap in planner._user_heaps.values())
+    far_future = time.time() + 1000 * 86400
+    assert len(planner.get_due('u1', now=far_future)) == 5
+    assert len(planner.get_due_today(now=far_future)) == 50
+
+
+def test_study_cards_survive_a_restart(data_dir, monkeypatch):
+    monkeypatch.setattr(study_plan_module, 'DATA_DIR', data_dir)
+    planner = StudyPlanService()
+    planner.load()
+    planner.record_answer('u1', 7, is_correct=False)
+    card = planner.record_answer('u1', 7, is_correct=True)
+
+    recovered = StudyPlanService()
+    recovered.load()
+    assert recovered._format_card('u1', 7, recovered._cards['u1'][7]) == card
@@ -0,0 +1,128 @@
+import json
+import os
+
+import pytest
+
+import database.submission_store as submission_store_module
+import services.problem_service as problem_service_module
+from database.submission_store import SubmissionColumns, append_json_array
+
+
+@pytest.fixture
+def open_store(data_dir, monkeypatch):
+    """Open a fresh columnar store on ``data_dir``, as a server restart would."""
+    monkeypatch.setattr(submission_store_module, 'DATA_DIR', data_dir)
+    source = os.path.join(data_dir, 'submissions.json')
+
+    def open_():
+        store = SubmissionColumns()
+        store.load()
+        return store
+
+    def write(store, *submissions):
+        store.write(list(submissions))
+
+    open_.write = write
+    open_.source = source
+    return open_
+
+
+def submission(user, problem, minute, correct=True, answer='A', time_taken=30):
+    return {'user_id': user, 'problem_id': problem, 'answer': answer, 'is_correct': correct,
+            'timestamp': f'2026-10-01T10:{minute:02d}:00', 'time_taken': time_taken}
+
+
+def test_unsealed_tail_is_reread_from_the_source(open_store):
+    store = open_store()
+    open_store.write(store, submission('u1', 1, 0), submission('u2', 1, 1, correct=False))
+    store.seal()
+    open_store.write(store, submission('u1', 2, 2))
+
+    recovered = open_store()
+    assert recovered.row_count() == 3
+    assert recovered._manifest['source_offset'] == 2
+    assert [s['problem_id'] for s in recovered.iter_submissions()] == [1, 1, 2]
+    assert recovered.problem_accuracy()[1] == {'attempts': 2, 'correct': 1, 'accuracy': 50.0}
+
+
+def test_small_segments_are_merged_on_seal(open_store):
+    store = open_store()
+    open_store.write(store, submission('u1', 1, 0))
+    store.seal()
+    open_store.write(store, submission('u1', 2, 1))
+    store.seal()
+
+    assert len(store._manifest['segments']) == 1
+    assert open_store().row_count() == 2
+
+
+def test_shorter_source_rebuilds_the_store(open_store):
+    store = open_store()
+    open_store.write(store, submission('u1', 1, 0), submission('u1', 2, 1))
+    store.seal()
+    with open(open_store.source, 'w') as f:
+        json.dump([submission('u3', 3, 5)], f)
+
+    recovered = open_store()
+    assert [s['user_id'] for s in recovered.iter_submissions()] == ['u3']
+
+
+def test_removing_users_rewrites_segments_and_bumps_generation(open_store):
+    store = open_store()
+    open_store.write(store, submission('u1', 1, 0), submission('u2', 1, 1))
+    store.seal()
+    open_store.write(store, submission('u1', 2, 2), submission('u3', 2, 3))
+
+    assert store.remove_users(['u1']) == 2
+    assert store.generation == 1
+    assert store.removals_since(0) == [{'generation': 1, 'users': ['u1']}]
+    with open(open_store.source) as f:
+        assert {s['user_id'] for s in json.load(f)} == {'u2', 'u3'}
+
+    recovered = open_store()
+    assert recovered.generation == 1
+    assert sorted(s['user_id'] for s in recovered.iter_submissions()) == ['u2', 'u3']
+
+
+def test_out_of_range_numbers_are_replayed_as_missing(open_store):
+    rows = [dict(submission('u1', 1, 0), time_taken=10 ** 20), dict(submission('u2', 1, 1), attempts=float('inf')),
+            dict(submission('u3', 1, 2), time_taken=float('nan')), dict(submission('u4', 10 ** 12, 3))]
+    with open(open_store.source, 'w') as f:
+        json.dump(rows, f)
+
+    store = open_store()
+    assert store.row_count() == 3
+    assert [s['user_id'] for s in store.iter_submissions()] == ['u1', 'u2', 'u3']
+    replayed = list(store.iter_submissions())
+    assert ('time_taken' in replayed[0], 'attempts' in replayed[1], 'time_taken' in replayed[2]) == (False,) * 3
+    store.seal()
+    open_store.write(store, submission('u5', 1, 4))
+    assert open_store().row_count() == 4
+
+
+def test_writes_append_to_the_source_in_place(open_store):
+    store = open_store()
+    with open(open_store.source, 'w') as f:
+        json.dump([], f)
+    written = [submission('u1', 1, 0), submission('u2', 2, 1)]
+    open_store.write(store, written[0])
+    open_store.write(store, written[1])
+    with open(open_store.source) as f:
+        assert f.read() == json.dumps(written, indent=2)
+
+    # Written by hand without the trailing newline-and-bracket layout
+    with open(open_store.source, 'w') as f:
+        f.write(json.dumps(written) + '\n\n')
+    written.append(submission('u3', 3, 2))
+    append_json_array(open_store.source, written[-1:])
+    with open(open_store.source) as f:
+        assert json.load(f) == written
+
+
+
+def test_submissions_added_through_the_problem_service_reach_the_store(open_store, monkeypatch):
+    store = open_store()
+    monkeypatch.setattr(problem_service_module, 'submission_store', store)
+    problem_service_module.ProblemService().add_submission(1, 'u1', {'answer': 'A', 'is_correct': True})
+    store.seal()
+    assert open_store().row_count() == 1
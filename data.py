@@ -105,12 +105,12 @@ def generate_dummy_questions(num_questions=200):
     topic_stats = {}
     for subject in topics:
         for topic in topics[subject]:
-            topic_questions = [q for q in questions if q["topic"] == topic]
-            topic_stats[topic] = {
-                "total": len(topic_questions),
-                "solved": len([q for q in topic_questions if q["solved"]]),
-                "subject": subject
-            }
+            topic_stats[topic] = {"total": 0, "solved": 0, "subject": subject}
+    for q in questions:
+        stats = topic_stats[q["topic"]]
+        stats["total"] += 1
+        if q["solved"]:
+            stats["solved"] += 1
 
     return {
         "problems": questions,
@@ -15,7 +15,7 @@ export default function FeaturedProblems({ onProblemSelect }: FeaturedProblemsPr
     const fetchData = async () => {
       try {
         setLoading(true);
-        const problemsData = await ApiService.getProblems();
+        const problemsData = await ApiService.getProblems(['id', 'title', 'description', 'difficulty', 'category']);
         // Get top 6 problems based on a mix of criteria
         const featuredProblems = problemsData
           .slice(0, 6)
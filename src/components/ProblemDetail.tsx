@@ -2,7 +2,7 @@ import React, { useEffect, useState, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { ArrowLeft, HelpCircle, ChevronLeft, ChevronRight, ChevronDown, Upload } from 'lucide-react';
 import { ApiService } from '../services/api';
-import { Problem, UserAnswer, ProblemStats, UserSubmission } from '../types';
+import { Problem, UserAnswer, ProblemStats, UserSubmission, SimilarProblem } from '../types';
 import '../styles/ProblemDetail.css';
 
 interface ProblemDetailProps {
@@ -18,6 +18,7 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
   const [feedbackMessage, setFeedbackMessage] = useState('');
   const [submitting, setSubmitting] = useState(false);
   const [showHint, setShowHint] = useState(false);
+  const [hints, setHints] = useState<string[] | null>(null);
   const [problemStats, setProblemStats] = useState<ProblemStats>({ total_attempts: 0, correct_attempts: 0, accuracy: 0 });
   const [reviews, setReviews] = useState([]);
   const [review, setReview] = useState('');
@@ -37,6 +38,7 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
   const [attempts, setAttempts] = useState<number>(0);
   const [isSolved, setIsSolved] = useState<boolean>(false);
   const [showTimer, setShowTimer] = useState<boolean>(true);
+  const [similarProblems, setSimilarProblems] = useState<SimilarProblem[]>([]);
 
   useEffect(() => {
     let intervalId: NodeJS.Timeout;
@@ -67,8 +69,16 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
     setShowFeedback(false);
     setFeedbackMessage('');
     setShowHint(false);
+    setHints(null);
   }, [id, problem?.id]);
 
+  useEffect(() => {
+    // Hints are not part of the problem payload; fetch them the first time one is shown
+    if (showHint && hints === null && problem) {
+      ApiService.getProblemHints(problem.id).then(setHints);
+    }
+  }, [showHint, hints, problem]);
+
   useEffect(() => {
     // Start timer when component mounts or when problem changes
     if (!userAnswer) {
@@ -222,6 +232,23 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
     }
   }, [id]);
 
+  useEffect(() => {
+    if (!id) return;
+    return ApiService.subscribeToProblem(parseInt(id), {
+      onStatsDelta: (delta) => {
+        setProblemStats(prev => {
+          const total = prev.total_attempts + delta.total_attempts;
+          const correct = prev.correct_attempts + delta.correct_attempts;
+          return {
+            total_attempts: total,
+            correct_attempts: correct,
+            accuracy: total > 0 ? Math.round((correct / total) * 100) : 0
+          };
+        });
+      }
+    });
+  }, [id]);
+
   const fetchRelatedProblems = async (currentProblem: Problem) => {
     try {
       const allProblems = await ApiService.getProblems();
@@ -280,7 +307,9 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
         setShowFeedback(true);
         
         if (result.answer.is_correct) {
-          setFeedbackMessage('Correct! Great job!');
+          setFeedbackMessage(result.faster_than != null
+            ? `Correct! Great job! You were faster than ${result.faster_than}% of solvers.`
+            : 'Correct! Great job!');
           setIsSolved(true);
           // Don't increment attempts if already solved
           if (!isSolved) {
@@ -297,12 +326,7 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
           }
         }
 
-        // Update stats and submissions immediately
-        const [newStats] = await Promise.all([
-          ApiService.getProblemStats(parseInt(id))
-        ]);
-
-        setProblemStats(newStats);
+        // Stats are updated by the live problem event stream
       } else {
         console.error('Invalid response format:', result);
         setFeedbackMessage('Error processing answer. Please try again.');
@@ -463,6 +487,30 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
     </div>
   );
 
+  useEffect(() => {
+    if (!id) return;
+    ApiService.getSimilarProblems(Number(id)).then(setSimilarProblems);
+  }, [id]);
+
+  const renderSimilarSection = () => similarProblems.length > 0 && (
+    <div className="bg-white rounded-lg shadow-sm p-6 mt-8">
+      <h2 className="text-xl font-semibold mb-4">Similar Problems</h2>
+      <ul className="divide-y divide-gray-100">
+        {similarProblems.map((similar) => (
+          <li key={similar.id}>
+            <button
+              onClick={() => navigate(`/problems/${similar.id}`)}
+              className="w-full flex justify-between items-center py-2 text-left hover:text-blue-600"
+            >
+              <span>{similar.title}</span>
+              <span className="text-sm text-gray-500">{similar.topic} · {similar.difficulty}</span>
+            </button>
+          </li>
+        ))}
+      </ul>
+    </div>
+  );
+
   const renderReviewsSection = () => (
     <div className="bg-white rounded-lg shadow-sm p-6 mt-8">
       <h2 className="text-2xl font-semibold mb-6">Reviews & Discussion</h2>
@@ -636,7 +684,7 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
         </div>
 
         {/* Hint Button */}
-        {!userAnswer?.is_correct && problem.hints && (
+        {!userAnswer?.is_correct && hints?.length !== 0 && (
           <div className="mb-4">
             <button
               onClick={() => setShowHint(!showHint)}
@@ -647,7 +695,7 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
             </button>
             {showHint && (
               <div className="mt-2 p-3 bg-blue-50 rounded-lg text-blue-700">
-                {problem.hints[0]}
+                {hints ? hints[0] : 'Loading hint...'}
               </div>
             )}
           </div>
@@ -726,6 +774,9 @@ const ProblemDetail: React.FC<ProblemDetailProps> = ({ onBack }) => {
       {/* Stats Section */}
       {renderStatsSection()}
 
+      {/* Related problems */}
+      {renderSimilarSection()}
+
       {/* Show reviews */}
       {renderReviewsSection()}
     </div>
@@ -1,6 +1,7 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { Problem } from '../types';
+import { Problem, Suggestion } from '../types';
+import { ApiService } from '../services/api';
 import { 
   ChevronLeft, 
   ChevronRight, 
@@ -92,6 +93,7 @@ export default function ProblemList({ onProblemSelect, selectedTopic, selectedSu
   const [problems, setProblems] = useState<Problem[]>([]);
   const [userAnswers, setUserAnswers] = useState<Record<string, any>>({});
   const [searchTerm, setSearchTerm] = useState('');
+  const [suggestions, setSuggestions] = useState<Suggestion[]>([]);
   const [selectedDifficulty, setSelectedDifficulty] = useState<string | null>(null);
   const [currentPage, setCurrentPage] = useState(1);
   const [activeSubject, setActiveSubject] = useState<string | null>(null);
@@ -129,6 +131,17 @@ export default function ProblemList({ onProblemSelect, selectedTopic, selectedSu
     fetchData();
   }, []);
 
+  useEffect(() => {
+    if (!searchTerm.trim()) {
+      setSuggestions([]);
+      return;
+    }
+    const timer = setTimeout(async () => {
+      setSuggestions(await ApiService.suggestProblems(searchTerm));
+    }, 150);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   // Calculate solved and unsolved counts
   const solvedCount = problems.filter(problem => userAnswers[problem.id]?.is_correct).length;
   const unsolvedCount = problems.length - solvedCount;
@@ -532,7 +545,15 @@ export default function ProblemList({ onProblemSelect, selectedTopic, selectedSu
                   onChange={(e) => setSearchTerm(e.target.value)}
                   className="block w-full pl-10 pr-3 py-2 border border-gray-300 rounded-md leading-5 bg-white placeholder-gray-500 focus:outline-none focus:placeholder-gray-400 focus:ring-1 focus:ring-indigo-500 focus:border-indigo-500 sm:text-sm"
                   placeholder="Search problems..."
+                  list="problem-suggestions"
                 />
+                <datalist id="problem-suggestions">
+                  {suggestions.map((suggestion) => (
+                    <option key={`${suggestion.type}-${suggestion.id ?? suggestion.label}`} value={suggestion.label}>
+                      {suggestion.type === 'problem' ? suggestion.topic : suggestion.type}
+                    </option>
+                  ))}
+                </datalist>
               </div>
               <select
                 value={selectedDifficulty || ''}
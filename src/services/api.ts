@@ -1,5 +1,5 @@
 import axios, { AxiosError } from 'axios';
-import { Problem, UserStats, ProblemStats, UserSubmission, User, Achievement, UserAnswer, SubmitAnswerResponse } from '../types';
+import { Problem, UserStats, ProblemStats, UserSubmission, User, Achievement, UserAnswer, SubmitAnswerResponse, UserActivity, SimilarProblem, Suggestion } from '../types';
 
 const API_BASE_URL = 'http://192.168.0.102:5001';
 
@@ -40,9 +40,11 @@ export const ApiService = {
     }
   },
 
-  async getProblems(): Promise<Problem[]> {
+  async getProblems(fields?: string[]): Promise<Problem[]> {
     try {
-      const response = await axiosInstance.get<Problem[]>('/problems');
+      // The backend returns a compact projection unless other fields are named
+      const params = fields ? { fields: fields.join(',') } : undefined;
+      const response = await axiosInstance.get<Problem[]>('/problems', { params });
       return response.data;
     } catch (error) {
       console.error('Error getting problems:', error);
@@ -60,6 +62,36 @@ export const ApiService = {
     }
   },
 
+  async getProblemHints(id: number): Promise<string[]> {
+    try {
+      const response = await axiosInstance.get<{ hints: string[] }>(`/problems/${id}/hints`);
+      return response.data.hints;
+    } catch (error) {
+      console.error('Error fetching hints:', error);
+      return [];
+    }
+  },
+
+  async getSimilarProblems(id: number, limit = 5): Promise<SimilarProblem[]> {
+    try {
+      const response = await axiosInstance.get<SimilarProblem[]>(`/problems/${id}/similar`, { params: { limit } });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching similar problems:', error);
+      return [];
+    }
+  },
+
+  async suggestProblems(prefix: string, limit = 8): Promise<Suggestion[]> {
+    try {
+      const response = await axiosInstance.get<Suggestion[]>('/problems/suggest', { params: { prefix, limit } });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching suggestions:', error);
+      return [];
+    }
+  },
+
   async getUserAnswer(userId: string, problemId: number): Promise<UserAnswer | null> {
     try {
       const response = await axiosInstance.get<UserAnswer>(`/user_answer/${userId}/${problemId}`);
@@ -86,11 +118,11 @@ export const ApiService = {
     }
   },
 
-  async submitAnswer(userId: string, problemId: number, answer: string): Promise<SubmitAnswerResponse> {
+  async submitAnswer(userId: string, problemId: number, answer: string, timeTaken?: number): Promise<SubmitAnswerResponse> {
     try {
       const response = await axiosInstance.post<SubmitAnswerResponse>(
         `/users/${userId}/submit_answer/${problemId}`,
-        { answer },
+        { answer, time_taken: timeTaken },
         {
           headers: {
             'Content-Type': 'application/json'
@@ -260,6 +292,19 @@ export const ApiService = {
     }
   },
 
+  subscribeToProblem(
+    problemId: number,
+    handlers: {
+      onStatsDelta?: (delta: { total_attempts: number; correct_attempts: number }) => void;
+      onSubmission?: (submission: any) => void;
+    }
+  ): () => void {
+    const source = new EventSource(`${API_BASE_URL}/api/stream/problems/${problemId}`);
+    source.addEventListener('stats_delta', (e) => handlers.onStatsDelta?.(JSON.parse((e as MessageEvent).data)));
+    source.addEventListener('submission', (e) => handlers.onSubmission?.(JSON.parse((e as MessageEvent).data)));
+    return () => source.close();
+  },
+
   async getUnifiedStats(userId: string): Promise<any> {
     try {
       const response = await axiosInstance.get(`/api/unified-stats/${userId}`);
@@ -268,5 +313,15 @@ export const ApiService = {
       console.error('Error getting unified stats:', error);
       throw handleApiError(error);
     }
+  },
+
+  async getUserActivity(userId: string, from?: string, to?: string): Promise<UserActivity> {
+    try {
+      const response = await axiosInstance.get(`/api/users/${userId}/activity`, { params: { from, to } });
+      return response.data;
+    } catch (error) {
+      console.error('Error getting user activity:', error);
+      throw handleApiError(error);
+    }
   }
 };
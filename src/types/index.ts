@@ -7,9 +7,10 @@ export interface Problem {
     id: string;
     text: string;
   }>;
-  correct_answer: string;
+  correct_answer?: string;
   hints?: string[];
   difficulty: string;
+  acceptance_rate?: number;
 }
 
 export interface UserStats {
@@ -92,6 +93,7 @@ export interface SubmitAnswerResponse {
     is_correct: boolean;
     timestamp: string;
   };
+  faster_than?: number | null;
   stats: {
     problemsSolved: number;
     accuracyRate: number;
@@ -109,4 +111,43 @@ export interface UserSubmission {
   review?: string;
   timestamp: string;
   is_correct: boolean;
-}
\ No newline at end of file
+}
+
+export interface ActivityDay {
+  date: string;
+  attempts: number;
+  correct: number;
+  time_taken: number;
+}
+
+export interface SimilarProblem {
+  id: number;
+  title: string;
+  difficulty: string;
+  subject?: string;
+  topic?: string;
+  similarity: number;
+}
+
+export interface Suggestion {
+  type: 'problem' | 'topic' | 'subject';
+  id?: number;
+  label: string;
+  difficulty?: string;
+  topic?: string;
+  subject?: string;
+  attempts: number;
+}
+
+export interface UserActivity {
+  user_id: string;
+  from: string;
+  to: string;
+  days: ActivityDay[];
+  totals: {
+    attempts: number;
+    correct: number;
+    time_taken: number;
+  };
+  active_days: number;
+}